@@ -1,44 +1,22 @@
+"""
+把本目录下的切片标注合并为全局坐标，实际由仓库根目录的 label_merge.py 完成
+（进程池并行解析、按块流式写出，保留 4 行文件头）。也可以直接运行：
+    python label_merge.py Dataset_Label_Test2/Label2 -o Dataset_Label_Test2/Label2/tile_all_points.csv
+"""
 import os
-import pandas as pd
+import sys
 
-def extract_offset_from_filename(filename):
-    """
-    从文件名中提取坐标偏移值
-    例如：从 'tile_0_0_points.csv' 提取 (0, 0)
-    """
-    parts = filename.split('_')
-    offset_x = int(parts[1])
-    offset_y = int(parts[2])
-    return offset_x, offset_y
+input_folder = os.path.dirname(os.path.abspath(__file__))  # 本脚本所在的标注目录
+sys.path.insert(0, os.path.abspath(os.path.join(input_folder, '..', '..')))
 
-def process_csv_files(input_folder, output_file):
-    all_data = []
+from label_merge import merge_directory
 
-    for filename in os.listdir(input_folder):
-        if filename.endswith('.csv'):
-            filepath = os.path.join(input_folder, filename)
-            
-            # 提取偏移值
-            offset_x, offset_y = extract_offset_from_filename(filename)
-            
-            # 加载CSV文件
-            df = pd.read_csv(filepath, skiprows=3)
-            
-            # 修改坐标值
-            df['LeftX'] += offset_x
-            df['LeftY'] += offset_y
-            df['RightX'] += offset_x
-            df['RightY'] += offset_y
-            
-            # 添加到总数据中
-            all_data.append(df)
-
-    # 合并所有数据并保存到一个CSV文件中
-    result = pd.concat(all_data, ignore_index=True)
-    result.to_csv(output_file, index=False)
-    print(f"所有CSV文件已合并到 {output_file}")
-
-# 使用示例
-input_folder = r'C:\Users\liukunkun\Desktop\OPT-SAR-Registration-script\Dataset_Label_Test2\Label2'  # 替换为你的文件夹路径
-output_file = 'tile_all_points.csv'     # 输出文件名
-process_csv_files(input_folder, output_file)
+if __name__ == '__main__':
+    output_file = os.path.join(input_folder, 'tile_all_points.csv')  # 输出文件名
+    # 输出在上次合并后被改过（如场景模式保存的全局标注）时拒绝覆盖，加 --full 才重新生成
+    full = '--full' in sys.argv[1:]
+    try:
+        tiles, points = merge_directory(input_folder, output_file, incremental=not full, overwrite=full)
+    except ValueError as e:
+        sys.exit(str(e))
+    print(f"所有CSV文件已合并到 {output_file}（{tiles} 个切片，{points} 对点）")
@@ -1,234 +1,1100 @@
 import sys
 import os
-import csv
-from PyQt5.QtWidgets import (QApplication, QMainWindow, QLabel, QPushButton, QFileDialog,
-                             QHBoxLayout, QVBoxLayout, QWidget, QMessageBox)
-from PyQt5.QtGui import QPixmap, QPainter, QPen, QColor, QFont
-from PyQt5.QtCore import Qt, QPoint, QSize
-from PyQt5.QtWidgets import QScrollArea, QLineEdit
+import sqlite3
+import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, QFileDialog,
+                             QHBoxLayout, QVBoxLayout, QWidget, QMessageBox, QDockWidget, QListView)
+from PyQt5.QtGui import (QPixmap, QImage, QImageReader, QPainter, QPen, QColor, QFont, QRegion,
+                         QPolygonF, QStaticText)
+from PyQt5.QtCore import (Qt, QObject, QPoint, QPointF, QLineF, QRect, QRectF, QSize, QTimer, QFileSystemWatcher,
+                          QAbstractListModel, QModelIndex, QEventLoop, pyqtSignal)
+from PyQt5.QtWidgets import QAbstractScrollArea, QLineEdit, QProgressDialog
 from PyQt5.QtWidgets import QSizePolicy
 from PyQt5.QtGui import QIcon
 
+import numpy as np
+
+import raster_io
+from label_io import read_points_csv, write_points_csv, parse_tile_offset, tile_name
+from label_store import PointPairStore, LEFT, RIGHT
+from label_history import UndoStack, AddLeft, SetRight, DeletePairs, MovePoint
+from label_journal import SessionJournal, journal_paths, replay_journals
+from label_db import LabelDatabase, DB_NAME
+from label_sidecar import load_points_dir, patch_sidecar
+from spatial_index import PointGridIndex, TileIndex
+from dataset_catalog import DatasetCatalog
+from image_probe import probe_size
+from thumbnail_cache import ThumbnailCache, THUMB_SIZE
 
 # from PIL import Image
 
+# 场景模式下整幅图像与全局标注文件的名称，与 concat.py 合并结果保持一致
+SCENE_IMAGE_NAME = "tile_all.png"
+SCENE_CSV_NAME = "tile_all_points.csv"
+
+class ImagePrefetcher(QObject):
+    """
+    在后台线程池中预解码前后相邻的 OPT/SAR 图像对，结果放入按内存上限淘汰的 LRU 缓存。
+    缓存中保存的是 QImage（可在子线程中解码），显示时再在主线程转换为 QPixmap。
+    缓存键为 (路径, 金字塔层级)，层级 k 表示缩小到原图的 1/2^k，场景模式用它作为分块缓存。
+    """
+
+    loaded = pyqtSignal()  # 后台解码完成（跨线程以排队方式发送到主线程）
+
+    def __init__(self, budget_mb=512, radius=2, workers=2):
+        super().__init__()
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.radius = radius  # 预取当前图片前后各 radius 对
+        self.hits = 0
+        self.misses = 0
+
+        self._cache = OrderedDict()  # (path, level) -> QImage，按最近使用排序
+        self._cache_bytes = 0
+        self._pending = {}  # (path, level) -> Future
+        self._errors = {}  # path -> 最近一次解码失败的原因
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def set_budget_mb(self, budget_mb):
+        with self._lock:
+            self.budget_bytes = int(budget_mb * 1024 * 1024)
+            self._evict()
+
+    def get(self, path, level=0):
+        """取出解码后的图像，缓存未命中时在当前线程同步解码"""
+        key = (path, level)
+        with self._lock:
+            image = self._cache.get(key)
+            if image is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return image
+            self.misses += 1
+            future = self._pending.get(key)
+
+        # 正在后台解码的直接等待结果，避免重复解码
+        if future is not None and not future.cancel():
+            return future.result()
+        return self._decode(key)
+
+    def cached(self, path, level=0):
+        """只查缓存，不触发解码；未命中返回 None"""
+        key = (path, level)
+        with self._lock:
+            image = self._cache.get(key)
+            if image is not None:
+                self._cache.move_to_end(key)
+            return image
+
+    def prefetch(self, paths, level=0):
+        """按给定顺序（近的在前）提交后台解码，不在本次列表中的排队任务会被取消"""
+        keys = [(path, level) for path in paths]
+        wanted = set(keys)
+        with self._lock:
+            for key, future in list(self._pending.items()):
+                if key not in wanted and future.cancel():
+                    del self._pending[key]
+            for key in keys:
+                if key in self._cache or key in self._pending:
+                    continue
+                self._pending[key] = self._pool.submit(self._decode, key, True)
+
+    def clear(self):
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+            self._cache.clear()
+            self._errors.clear()
+            self._cache_bytes = 0
+
+    def shutdown(self):
+        self.clear()
+        self._pool.shutdown(wait=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return (f"缓存命中 {self.hits}/{total} ({rate:.0f}%)，"
+                f"占用 {self._cache_bytes / 1024 / 1024:.0f}/{self.budget_bytes / 1024 / 1024:.0f} MB")
+
+    def error(self, path):
+        """最近一次解码 path 失败的原因；没有记录时返回 None"""
+        with self._lock:
+            return self._errors.get(path)
+
+    def _decode(self, key, notify=False):
+        try:
+            image = load_qimage(*key)
+        except (OSError, ValueError) as e:
+            image = QImage()
+            with self._lock:
+                self._errors[key[0]] = str(e)
+        self._store(key, image)
+        if notify:
+            self.loaded.emit()
+        return image
+
+    def _store(self, key, image):
+        with self._lock:
+            self._pending.pop(key, None)
+            if image.isNull() or key in self._cache:
+                return
+            self._cache[key] = image
+            self._cache_bytes += image.sizeInBytes()
+            self._evict()
+
+    def _evict(self):
+        # 调用方需持有锁；至少保留最近使用的一张
+        while self._cache_bytes > self.budget_bytes and len(self._cache) > 1:
+            _, old = self._cache.popitem(last=False)
+            self._cache_bytes -= old.sizeInBytes()
+
+
+def load_qimage(path, level=0):
+    """
+    解码一张图像，level>0 时缩小到原图的 1/2^level。
+    16 位 / 浮点 SAR 栅格经 raster_io 内存映射读取，跨步抽样后拉伸为 8 位灰度，不整体复制原始数据。
+    栅格无法读取时抛出 OSError / ValueError；Qt 无法解码的普通图像返回空的 QImage。
+    """
+    if raster_io.needs_stretch(path):
+        array = raster_io.render(path, step=2 ** level)
+        height, width = array.shape
+        return QImage(array.data, width, height, width, QImage.Format_Grayscale8).copy()
+
+    image = QImage(path)
+    if level and not image.isNull():
+        factor = 0.5 ** level
+        image = image.scaled(max(1, int(image.width() * factor)), max(1, int(image.height() * factor)),
+                             Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+    return image
+
+
+def image_size(path):
+    """只读取文件头得到图像尺寸；image_probe 不认识的格式交给 QImageReader"""
+    size = probe_size(path)
+    if size is not None:
+        return QSize(*size)
+    return QImageReader(path).size()
+
+
+def pyramid_level(scale, max_level=None):
+    """缩放比例 scale 对应的金字塔层级：满足 0.5^k >= scale 的最大 k"""
+    level = 0
+    while scale <= 0.5 ** (level + 1) and (max_level is None or level < max_level):
+        level += 1
+    return level
+
+
+def render_thumbnail(path, size=THUMB_SIZE):
+    """生成一张缩略图：按金字塔层级缩小解码，再缩放到长边 size"""
+    full = image_size(path)
+    try:
+        image = load_qimage(path, pyramid_level(size / max(full.width(), full.height(), 1)))
+    except (OSError, ValueError):
+        return QImage()  # 与无法解码的普通图像一样显示占位图
+    if image.isNull():
+        return image
+    return image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+
+class TileScene:
+    """
+    把一个 tile_X_Y 切片目录当作一整幅场景：只读取各切片的文件头获得尺寸，
+    绘制时按可见范围从分块缓存中取出对应切片，不会一次性解码整幅大图。
+    """
+
+    def __init__(self, directory, filenames, budget_mb=256, workers=4, infos=None):
+        """infos 为与 filenames 对应的 ImageInfo（如数据集目录中缓存的），为 None 的切片现读文件头"""
+        self.directory = directory
+        self.tiles = []  # [(path, QRect)]，QRect 为切片在场景中的全局范围
+        for filename, info in zip(filenames, infos or [None] * len(filenames)):
+            offset = parse_tile_offset(filename)
+            if offset is None:
+                continue
+            path = os.path.join(directory, filename)
+            size = QSize(info.width, info.height) if info else image_size(path)  # 只读文件头
+            if size.isValid():
+                self.tiles.append((path, QRect(offset[0], offset[1], size.width(), size.height())))
+
+        width = max((rect.right() + 1 for _, rect in self.tiles), default=0)
+        height = max((rect.bottom() + 1 for _, rect in self.tiles), default=0)
+        self._size = QSize(width, height)
+
+        # 以最大切片尺寸为格网步长建立 格网 -> 切片 的索引
+        self.cell_w = max((rect.width() for _, rect in self.tiles), default=1)
+        self.cell_h = max((rect.height() for _, rect in self.tiles), default=1)
+        self._cells = {}
+        for tile in self.tiles:
+            rect = tile[1]
+            for cx in range(rect.left() // self.cell_w, rect.right() // self.cell_w + 1):
+                for cy in range(rect.top() // self.cell_h, rect.bottom() // self.cell_h + 1):
+                    self._cells.setdefault((cx, cy), []).append(tile)
+
+        self.cache = ImagePrefetcher(budget_mb=budget_mb, radius=0, workers=workers)
+
+    def width(self):
+        return self._size.width()
+
+    def height(self):
+        return self._size.height()
+
+    def size(self):
+        return self._size
+
+    def max_level(self):
+        # 最小切片缩到 1 像素以下就没有意义了
+        side = min((min(rect.width(), rect.height()) for _, rect in self.tiles), default=1)
+        return max(0, int(math.log2(max(1, side))))
+
+    def tiles_in(self, rect):
+        """返回与全局矩形 rect 相交的切片"""
+        found = []
+        seen = set()
+        for cx in range(max(0, rect.left() // self.cell_w), rect.right() // self.cell_w + 1):
+            for cy in range(max(0, rect.top() // self.cell_h), rect.bottom() // self.cell_h + 1):
+                for tile in self._cells.get((cx, cy), ()):
+                    if tile[0] not in seen and tile[1].intersects(rect):
+                        seen.add(tile[0])
+                        found.append(tile)
+        return found
+
+
+class ImagePyramid:
+    """
+    单张图像的多分辨率金字塔：第 k 层为原图的 1/2^k，按需由上一层缩小一半得到，每层只生成一次。
+    绘制时选取不小于目标比例的最近一层，只对剩余的 (0.5, 1] 倍做重采样。
+    """
+
+    MIN_SIDE = 128  # 最小一层的短边不小于该值
+
+    def __init__(self, image):
+        self.levels = [image]
+
+    def level_for(self, scale):
+        """返回 (层图像, 该层相对原图的比例)"""
+        level = 0
+        while level < pyramid_level(scale) and self._ensure(level + 1):
+            level += 1
+        return self.levels[level], 0.5 ** level
+
+    def _ensure(self, level):
+        while len(self.levels) <= level:
+            last = self.levels[-1]
+            if min(last.width(), last.height()) // 2 < self.MIN_SIDE:
+                return False
+            self.levels.append(last.scaled(last.width() // 2, last.height() // 2,
+                                           Qt.IgnoreAspectRatio, Qt.SmoothTransformation))
+        return True
+
+
+class ImageLabel(QAbstractScrollArea):
+    """
+    只绘制当前可见视口的图像控件：不再生成整幅缩放后的 QPixmap，
+    而是通过坐标变换直接从原图（或金字塔中合适的一层）取出可见部分绘制，内存占用与缩放倍数无关。
+    """
+
+    SETTLE_MS = 200  # 滚轮停止这么久后再做一次高质量重绘
+    LABEL_MIN_SCALE = 0.5  # 缩放低于该比例时不显示点的序号
+    CLUSTER_PX = 12  # 缩小显示时，落在同一个 CLUSTER_PX 见方屏幕格内的点合并为聚类
+    BATCH_POINTS = 200  # 单独的点超过该数量时用一次 drawPoints 画实心点
+    GRID_MIN_PX = 6  # 网格线在屏幕上的最小间距，低于该值时自动加粗网格
 
-class ImageLabel(QLabel):
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.points = []
+        self.store = PointPairStore()  # 主窗口会换成左右图共享的同一个存储
+        self.side = LEFT  # 本控件显示点对中的哪一侧
+        self._point_index = None
+        self._overlay = None  # (缓存键, 网格与标注点图层)
+        self._cursor_pos = None  # 当前十字线位置（视口坐标）
+        self._static_texts = {}  # 序号 -> 预排版的 QStaticText
         self.scale_factor = 1.0
         self.image = None
+        self.pyramid = None
+        self.scene = None  # 场景模式下的 TileScene，点坐标为全局坐标
         self.index = 0
-        self.setMouseTracking(True)
-        self.setAlignment(Qt.AlignLeft | Qt.AlignTop)
+        self.viewport().setMouseTracking(True)
+        self.setFocusPolicy(Qt.NoFocus)  # 方向键交给主窗口切换图片
         self.checkMode = False
         self.checking = 0
         self.show_grid = False
         self.grid_size = 256  # 默认网格大小
-        
+        self.grid_anchor = (0, 0)  # 网格对齐的全局偏移（当前切片左上角的全局坐标）
+
         # For panning
         self.pan_enabled = False
         self.last_pan_pos = QPoint(0, 0)
-        self.offset_x = 0
-        self.offset_y = 0
-        
+        self._drag = None  # Shift+拖动移动点时的 [序号, 原位置, 当前位置]
+
         # Sync with other label
         self.paired_label = None
-        self.paired_scroll_area = None
-        
+
+        # 滚轮缩放合并：同一轮事件循环内的多次滚动只执行最后的目标比例；
+        # 交互过程中用快速变换绘制，空闲 SETTLE_MS 后再平滑重绘一次
+        self.interactive = False
+        self._pending_zoom = None  # [目标比例, 锚点图像坐标, 锚点视口坐标]
+        self._zoom_timer = QTimer(self)
+        self._zoom_timer.setSingleShot(True)
+        self._zoom_timer.setInterval(0)
+        self._zoom_timer.timeout.connect(self.apply_pending_zoom)
+        self._settle_timer = QTimer(self)
+        self._settle_timer.setSingleShot(True)
+        self._settle_timer.setInterval(self.SETTLE_MS)
+        self._settle_timer.timeout.connect(self.settle)
+
         # 用于添加标注点
         self.mainWindow = None
 
+    @property
+    def points(self):
+        """本侧已标注点的 (N, 2) 数组视图"""
+        return self.store.xy(self.side)
+
     def set_image(self, image):
+        self.set_scene(None)
         self.image = image
+        self.pyramid = ImagePyramid(image)
+        self.update_display()
+
+    def set_scene(self, scene):
+        if self.scene is not None:
+            self.scene.cache.shutdown()
+        self.scene = scene
+        if scene is not None:
+            self.image = None
+            self.pyramid = None
+            scene.cache.loaded.connect(self.viewport().update)
         self.update_display()
 
+    def has_source(self):
+        return self.image is not None or self.scene is not None
+
+    def source_size(self):
+        if self.scene is not None:
+            return self.scene.size()
+        if self.image is not None:
+            return self.image.size()
+        return QSize(0, 0)
+
+    def fit_scale(self):
+        """整幅图像恰好放入视口时的缩放比例"""
+        size = self.source_size()
+        if size.isEmpty():
+            return 1.0
+        view = self.viewport().size()
+        return min(view.width() / size.width(), view.height() / size.height())
+
     def update_display(self):
-        if self.image:
-            scaled_image = self.image.scaled(
-                int(self.image.width() * self.scale_factor),
-                int(self.image.height() * self.scale_factor),
-                Qt.KeepAspectRatio,
-                Qt.SmoothTransformation
-            )
-            self.setPixmap(scaled_image)
-            self.setFixedSize(scaled_image.size())  # 保持 QLabel 大小和图像一致
-            
-            # Update scrollbars if needed
-            if self.parent() and isinstance(self.parent(), QScrollArea):
-                self.parent().setWidgetResizable(False)
+        # 根据缩放后的图像尺寸更新滚动条范围
+        size = self.source_size()
+        content_w = int(size.width() * self.scale_factor)
+        content_h = int(size.height() * self.scale_factor)
+        view = self.viewport().size()
+        hbar = self.horizontalScrollBar()
+        vbar = self.verticalScrollBar()
+        hbar.setRange(0, max(0, content_w - view.width()))
+        vbar.setRange(0, max(0, content_h - view.height()))
+        hbar.setPageStep(view.width())
+        vbar.setPageStep(view.height())
+        hbar.setSingleStep(20)
+        vbar.setSingleStep(20)
+        self.viewport().update()
+
+    def origin(self):
+        """图像左上角在视口中的位置；图像小于视口时居中显示"""
+        if not self.has_source():
+            return QPointF(0, 0)
+        view = self.viewport().size()
+        size = self.source_size()
+        content_w = size.width() * self.scale_factor
+        content_h = size.height() * self.scale_factor
+        ox = (view.width() - content_w) / 2 if content_w < view.width() else -self.horizontalScrollBar().value()
+        oy = (view.height() - content_h) / 2 if content_h < view.height() else -self.verticalScrollBar().value()
+        return QPointF(ox, oy)
+
+    def map_to_image(self, pos):
+        origin = self.origin()
+        return QPointF((pos.x() - origin.x()) / self.scale_factor,
+                       (pos.y() - origin.y()) / self.scale_factor)
+
+    def map_from_image(self, x, y):
+        origin = self.origin()
+        return QPointF(origin.x() + x * self.scale_factor, origin.y() + y * self.scale_factor)
+
+    def scroll_by(self, dx, dy):
+        hbar = self.horizontalScrollBar()
+        vbar = self.verticalScrollBar()
+        hbar.setValue(hbar.value() - dx)
+        vbar.setValue(vbar.value() - dy)
+
+    def scrollContentsBy(self, dx, dy):
+        self.viewport().update()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.update_display()
 
     def mouseMoveEvent(self, event):
-        if self.pan_enabled and self.image:
+        if self._drag is not None:
+            raw = self.map_to_image(event.pos())
+            size = self.source_size()
+            x = min(max(int(raw.x()), 0), size.width() - 1)
+            y = min(max(int(raw.y()), 0), size.height() - 1)
+            if (x, y) != self._drag[2]:
+                self._drag[2] = (x, y)
+                self.store.move(self.side, self._drag[0], x, y)
+                self.viewport().update()
+        elif self.pan_enabled and self.has_source():
             delta = event.pos() - self.last_pan_pos
             self.last_pan_pos = event.pos()
-            
-            # 打印出父对象的类型，找出正确的层级关系
-            # parent = self.parent()
-            # print(f"Parent type: {type(parent)}")
-            
-            # 直接使用保存的scroll_area引用而不是通过parent()查找
-            # 在QLabel初始化时我们应已经保存了scroll_area的引用
-            if hasattr(self, 'mainWindow'):
-                if self == self.mainWindow.image_label1:
-                    scroll_area = self.mainWindow.scroll_area1
-                    # print("Using scroll_area1")
-                elif self == self.mainWindow.image_label2:
-                    scroll_area = self.mainWindow.scroll_area2
-                    # print("Using scroll_area2")
-                else:
-                    scroll_area = None
-                    
-                if scroll_area:
-                    # 现在我们有了正确的滚动区域引用
-                    hbar = scroll_area.horizontalScrollBar()
-                    vbar = scroll_area.verticalScrollBar()
-                    
-                    # 保存当前值用于调试
-                    old_h = hbar.value()
-                    old_v = vbar.value()
-                    
-                    # 设置新的滚动位置
-                    hbar.setValue(old_h - delta.x())
-                    vbar.setValue(old_v - delta.y())
-                    
-                    # print(f"Setting scrollbars: {old_h}->{hbar.value()}, {old_v}->{vbar.value()}") # 打印出滚动条的值
-            
+            self.scroll_by(delta.x(), delta.y())
+
             # Sync scroll position with paired widget
-            if self.paired_scroll_area:
-                paired_vbar = self.paired_scroll_area.verticalScrollBar()
-                paired_hbar = self.paired_scroll_area.horizontalScrollBar()
-                paired_hbar.setValue(paired_hbar.value() - delta.x())
-                paired_vbar.setValue(paired_vbar.value() - delta.y())
-            
-            self.update()
-        else:
-            self.update()
+            if self.paired_label:
+                self.paired_label.scroll_by(delta.x(), delta.y())
+        self.move_crosshair(event.pos())
+
+    def leaveEvent(self, event):
+        # 鼠标离开时清除十字线
+        self.move_crosshair(None)
+        super().leaveEvent(event)
+
+    def crosshair_region(self, pos):
+        if pos is None:
+            return QRegion()
+        view = self.viewport().rect()
+        return (QRegion(QRect(0, pos.y() - 1, view.width(), 3)) +
+                QRegion(QRect(pos.x() - 1, 0, 3, view.height())))
+
+    def move_crosshair(self, pos):
+        """十字线移动时只重绘新旧两条线经过的窄条"""
+        dirty = self.crosshair_region(self._cursor_pos) + self.crosshair_region(pos)
+        self._cursor_pos = pos
+        self.viewport().update(dirty)
 
     def mousePressEvent(self, event):
-        if event.button() == Qt.RightButton and self.image:
+        if event.button() == Qt.RightButton and self.has_source():
             self.pan_enabled = True
             self.last_pan_pos = event.pos()
-            self.setCursor(Qt.ClosedHandCursor)
+            self.viewport().setCursor(Qt.ClosedHandCursor)
+        elif (event.button() == Qt.LeftButton and event.modifiers() & Qt.ShiftModifier
+              and self.point_at(event.pos()) >= 0):
+            # Shift+拖动已有的点
+            idx = self.point_at(event.pos())
+            old = tuple(self.points[idx].tolist())
+            self._drag = [idx, old, old]
+            self.viewport().setCursor(Qt.SizeAllCursor)
+        elif event.button() == Qt.LeftButton and self.mainWindow and self.mainWindow.check_button.isChecked():
+            # 检查模式下点击某个点即跳到该点对
+            idx = self.point_at(event.pos())
+            if idx >= 0:
+                self.mainWindow.select_pair(idx)
         elif event.button() == Qt.LeftButton and self.mainWindow and not self.mainWindow.check_button.isChecked():
-            # 计算图像原始坐标
-            # 获取鼠标相对于QLabel的坐标
-            pos = event.pos()
-            
-            # 获取滚动区域的滚动位置
-            scroll_x = self.parent().horizontalScrollBar().value() if isinstance(self.parent(), QScrollArea) else 0
-            scroll_y = self.parent().verticalScrollBar().value() if isinstance(self.parent(), QScrollArea) else 0
-            
-            # 将坐标转换回原图坐标系
-            raw_x = pos.x() / self.scale_factor
-            raw_y = pos.y() / self.scale_factor
-            
-            # 检查是否在图像范围内 - 使用正确的图像尺寸比较
-            if self.image and 0 <= raw_x < self.image.width() and 0 <= raw_y < self.image.height():
+            # 将视口坐标转换回原图坐标系
+            raw = self.map_to_image(event.pos())
+            raw_x, raw_y = raw.x(), raw.y()
+
+            # 检查是否在图像范围内
+            size = self.source_size()
+            if self.has_source() and 0 <= raw_x < size.width() and 0 <= raw_y < size.height():
                 # 分别处理左图和右图的点击
                 if self == self.mainWindow.image_label1 and self.mainWindow.left_turn:
                     self.mainWindow.add_point_to_left(QPoint(int(raw_x), int(raw_y)))
                 elif self == self.mainWindow.image_label2 and not self.mainWindow.left_turn:
                     self.mainWindow.add_point_to_right(QPoint(int(raw_x), int(raw_y)))
-    
+
     def mouseReleaseEvent(self, event):
         if event.button() == Qt.RightButton:
             self.pan_enabled = False
-            self.setCursor(Qt.ArrowCursor)
+            self.viewport().setCursor(Qt.ArrowCursor)
+        elif event.button() == Qt.LeftButton and self._drag is not None:
+            idx, old, new = self._drag
+            self._drag = None
+            self.viewport().setCursor(Qt.ArrowCursor)
+            if new != old and self.mainWindow:
+                self.mainWindow.point_moved(self.side, idx, old, new)
 
     def wheelEvent(self, event):
-        if self.image:
-            # Calculate mouse position relative to original image
-            mouse_pos = event.pos()
-            scroll_x = self.parent().horizontalScrollBar().value() if isinstance(self.parent(), QScrollArea) else 0
-            scroll_y = self.parent().verticalScrollBar().value() if isinstance(self.parent(), QScrollArea) else 0
-            
-            # Get position in image coordinates
-            rel_x = (mouse_pos.x() + scroll_x) / self.scale_factor
-            rel_y = (mouse_pos.y() + scroll_y) / self.scale_factor
-            
+        if self.has_source():
             # Determine zoom direction
             factor = 1.25 if event.angleDelta().y() > 0 else 0.8
-            old_scale = self.scale_factor
-            self.scale_factor *= factor
-            
-            # Keep scale factor within reasonable bounds
-            self.scale_factor = max(0.1, min(10.0, self.scale_factor))
-            
-            # Update display
-            self.update_display()
-            
-            # Calculate new scroll positions
-            new_scroll_x = rel_x * self.scale_factor - mouse_pos.x()
-            new_scroll_y = rel_y * self.scale_factor - mouse_pos.y()
-            
-            # Adjust scroll position to keep mouse position centered
-            if isinstance(self.parent(), QScrollArea):
-                self.parent().horizontalScrollBar().setValue(int(new_scroll_x))
-                self.parent().verticalScrollBar().setValue(int(new_scroll_y))
-            
-            # Sync with paired label if exists
-            if self.paired_label and self.paired_label.image:
-                self.paired_label.scale_factor = self.scale_factor
-                self.paired_label.update_display()
-                
-                if self.paired_scroll_area:
-                    self.paired_scroll_area.horizontalScrollBar().setValue(int(new_scroll_x))
-                    self.paired_scroll_area.verticalScrollBar().setValue(int(new_scroll_y))
+
+            # 只累计目标比例，真正的缩放由零延时定时器合并执行
+            if self._pending_zoom is None:
+                # Calculate mouse position relative to original image
+                mouse_pos = event.pos()
+                self._pending_zoom = [self.scale_factor, self.map_to_image(mouse_pos), mouse_pos]
+            self._pending_zoom[0] = self.clamp_scale(self._pending_zoom[0] * factor)
+            self._zoom_timer.start()
+
+    def apply_pending_zoom(self):
+        if self._pending_zoom is None:
+            return
+        scale, rel, mouse_pos = self._pending_zoom
+        self._pending_zoom = None
+        self.begin_interaction()
+        self.zoom_to(scale, rel, mouse_pos)
+
+        # Sync with paired label if exists
+        if self.paired_label and self.paired_label.has_source():
+            self.paired_label.begin_interaction()
+            self.paired_label.zoom_to(self.scale_factor, rel, mouse_pos)
+
+    def begin_interaction(self):
+        self.interactive = True
+        self._settle_timer.start()
+
+    def settle(self):
+        self.interactive = False
+        self.viewport().update()
+
+    def clamp_scale(self, scale):
+        # Keep scale factor within reasonable bounds（大场景允许缩小到整幅可见）
+        return max(min(0.1, self.fit_scale()), min(10.0, scale))
+
+    def zoom_to(self, scale, anchor, view_pos):
+        """缩放到 scale，并保持图像坐标 anchor 停留在视口位置 view_pos"""
+        self.scale_factor = self.clamp_scale(scale)
+        self.update_display()
+        self.horizontalScrollBar().setValue(int(anchor.x() * self.scale_factor - view_pos.x()))
+        self.verticalScrollBar().setValue(int(anchor.y() * self.scale_factor - view_pos.y()))
+
+    def point_index(self):
+        """点集变化后才重建空间索引"""
+        if self._point_index is None or self._point_index[0] != (id(self.store), self.store.revision):
+            self._point_index = ((id(self.store), self.store.revision), PointGridIndex(self.points))
+        return self._point_index[1]
+
+    def point_at(self, pos, radius=8):
+        """命中测试：视口位置 pos 附近 radius 像素内的点序号，没有则返回 -1"""
+        raw = self.map_to_image(pos)
+        return self.point_index().nearest(raw.x(), raw.y(), radius / self.scale_factor)
+
+    def visible_image_rect(self, view_rect):
+        """视口矩形对应的原图像素范围（已裁剪到图像边界，按整像素对齐）"""
+        top_left = self.map_to_image(QPointF(view_rect.left(), view_rect.top()))
+        bottom_right = self.map_to_image(QPointF(view_rect.right() + 1, view_rect.bottom() + 1))
+        left = max(0, int(math.floor(top_left.x())))
+        top = max(0, int(math.floor(top_left.y())))
+        size = self.source_size()
+        right = min(size.width(), int(math.ceil(bottom_right.x())))
+        bottom = min(size.height(), int(math.ceil(bottom_right.y())))
+        return QRect(left, top, max(0, right - left), max(0, bottom - top))
+
+    def paint_scene(self, painter, src):
+        """场景模式：只绘制与可见范围相交的切片，缺失的切片交给后台解码，先用已缓存的更粗层级代替"""
+        if src.isEmpty():
+            return
+        scene = self.scene
+        max_level = scene.max_level()
+        level = pyramid_level(self.scale_factor, max_level)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, not self.interactive)
+        for path, rect in scene.tiles_in(src):
+            target = QRectF(self.map_from_image(rect.left(), rect.top()),
+                            self.map_from_image(rect.left() + rect.width(), rect.top() + rect.height()))
+            block = scene.cache.cached(path, level)
+            if block is None:
+                for coarser in range(level + 1, max_level + 1):
+                    block = scene.cache.cached(path, coarser)
+                    if block is not None:
+                        break
+            if block is not None:
+                painter.drawImage(target, block, QRectF(block.rect()))
+            else:
+                painter.fillRect(target, QColor(60, 60, 60))
+
+        # 按整个视口（而不是本次重绘区域）请求缺失的切片，移出视口的排队任务会被取消
+        view_rect = self.visible_image_rect(self.viewport().rect())
+        missing = [path for path, _ in scene.tiles_in(view_rect) if scene.cache.cached(path, level) is None]
+        scene.cache.prefetch(missing, level)
 
     def paintEvent(self, event):
-        super().paintEvent(event)
-        painter = QPainter(self)
+        painter = QPainter(self.viewport())
+        if not self.has_source():
+            return
+
+        # --- draw only the exposed part of the image ---
+        src = self.visible_image_rect(event.rect())
+        if self.scene is not None:
+            self.paint_scene(painter, src)
+        elif not src.isEmpty():
+            level, level_scale = self.pyramid.level_for(self.scale_factor)
+            target = QRectF(self.map_from_image(src.left(), src.top()),
+                            self.map_from_image(src.left() + src.width(), src.top() + src.height()))
+            source = QRectF(src.left() * level_scale, src.top() * level_scale,
+                            src.width() * level_scale, src.height() * level_scale)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform, not self.interactive)
+            painter.drawPixmap(target, level, source)
+
+        # --- grid and points come from the cached overlay layer ---
+        painter.drawPixmap(QRectF(event.rect()), self.overlay_layer(), self.overlay_source_rect(event.rect()))
 
+        # Draw crosshair
+        if self._cursor_pos is not None and not self.checkMode:
+            cursor_pos = self._cursor_pos
+            painter.setPen(QPen(Qt.green, 1, Qt.DashLine))
+            painter.drawLine(0, cursor_pos.y(), self.viewport().width(), cursor_pos.y())
+            painter.drawLine(cursor_pos.x(), 0, cursor_pos.x(), self.viewport().height())
+
+    def overlay_source_rect(self, rect):
+        ratio = self._overlay[1].devicePixelRatio()
+        return QRectF(rect.x() * ratio, rect.y() * ratio, rect.width() * ratio, rect.height() * ratio)
+
+    def overlay_layer(self):
+        """
+        网格和标注点画在一张与视口等大的透明缓存图层上，
+        只有点集、网格设置、缩放/平移或检查状态变化时才重新绘制；十字线移动时直接复用。
+        """
+        key = (id(self.store), self.store.revision, self.show_grid, self.grid_size, self.grid_anchor, self.scale_factor,
+               self.horizontalScrollBar().value(), self.verticalScrollBar().value(),
+               self.viewport().size(), self.checkMode, self.checking)
+        if self._overlay is None or self._overlay[0] != key:
+            ratio = self.viewport().devicePixelRatioF()
+            size = self.viewport().size()
+            layer = QPixmap(max(1, int(size.width() * ratio)), max(1, int(size.height() * ratio)))
+            layer.setDevicePixelRatio(ratio)
+            layer.fill(Qt.transparent)
+            painter = QPainter(layer)
+            self.paint_overlay(painter, self.viewport().rect())
+            painter.end()
+            self._overlay = (key, layer)
+        return self._overlay[1]
+
+    def paint_overlay(self, painter, rect):
         # --- draw grid if enabled ---
-        if self.show_grid and self.image:
-            img_w = self.image.width() * self.scale_factor
-            img_h = self.image.height() * self.scale_factor
-            grid = int(self.grid_size * self.scale_factor)
-            painter.setPen(QPen(QColor(0, 0, 255, 200), 2, Qt.DotLine))
-            # 竖线
-            x = 0
-            while x <= img_w:
-                painter.drawLine(int(x), 0, int(x), int(img_h))
-                x += grid
-            # 横线
-            y = 0
-            while y <= img_h:
-                painter.drawLine(0, int(y), int(img_w), int(y))
-                y += grid
+        if self.show_grid:
+            self.paint_grid(painter, rect)
 
-        
-        pen = QPen(QColor(255, 0, 0), 3)
-        painter.setPen(pen)
         font = QFont()
         font.setPointSize(10)
         painter.setFont(font)
         if not self.checkMode:
-            for idx, point in enumerate(self.points):
-                x = point.x() * self.scale_factor
-                y = point.y() * self.scale_factor
-                painter.drawEllipse(QPoint(int(x), int(y)), 4, 4)
-                painter.setPen(QColor(255, 105, 180))
-                painter.drawText(int(x + 5), int(y + 5), str(idx))
-                painter.setPen(QPen(QColor(255, 0, 0), 3))
-        elif len(self.points):
-            x = self.points[self.checking].x() * self.scale_factor
-            y = self.points[self.checking].y() * self.scale_factor
-            painter.drawEllipse(QPoint(int(x), int(y)), 4, 4)
+            # 只画可见范围内的点；向外扩出标记半径和序号文字的宽度
+            margin = 40 / self.scale_factor
+            top_left = self.map_to_image(QPointF(rect.topLeft()))
+            bottom_right = self.map_to_image(QPointF(rect.bottomRight()))
+            visible = self.point_index().query(top_left.x() - margin, top_left.y() - margin,
+                                               bottom_right.x() + margin, bottom_right.y() + margin)
+            self.paint_points_lod(painter, visible)
+        elif self.checking < len(self.points):
+            x, y = self.points[self.checking].tolist()
+            pos = self.map_from_image(x, y)
+            painter.setPen(QPen(QColor(255, 0, 0), 3))
+            painter.drawEllipse(pos, 4, 4)
             painter.setPen(QColor(255, 105, 180))
-            painter.drawText(int(x + 5), int(y + 5), str(self.checking))
+            painter.drawStaticText(self.label_anchor(pos, painter), self.static_text(self.checking))
+
+    def paint_grid(self, painter, rect):
+        """
+        只在可见范围内画网格线，并合并为一次 drawLines。
+        屏幕上的线距小于 GRID_MIN_PX 时自动改用网格尺寸的 2^k 倍；
+        grid_anchor 为当前切片的全局偏移时，网格线落在全局坐标的整倍数上。
+        """
+        src = self.visible_image_rect(rect)
+        if src.isEmpty():
+            return
+        step = self.grid_size
+        while step * self.scale_factor < self.GRID_MIN_PX:
+            step *= 2
+
+        ax, ay = self.grid_anchor
+        origin = self.origin()
+        ox, oy, scale = origin.x(), origin.y(), self.scale_factor
+        left, right = ox + src.left() * scale, ox + (src.left() + src.width()) * scale
+        top, bottom = oy + src.top() * scale, oy + (src.top() + src.height()) * scale
+
+        lines = []
+        # 竖线
+        x = math.ceil((src.left() + ax) / step) * step - ax
+        while x <= src.left() + src.width():
+            vx = ox + x * scale
+            lines.append(QLineF(vx, top, vx, bottom))
+            x += step
+        # 横线
+        y = math.ceil((src.top() + ay) / step) * step - ay
+        while y <= src.top() + src.height():
+            vy = oy + y * scale
+            lines.append(QLineF(left, vy, right, vy))
+            y += step
+
+        painter.setPen(QPen(QColor(0, 0, 255, 200), 2, Qt.DotLine))
+        painter.drawLines(lines)
+
+    def paint_points_lod(self, painter, visible):
+        """
+        分级绘制标注点：缩小显示时屏幕上重叠的点合并为带数量的聚类标记；
+        其余点按同一画笔批量绘制，点很多时改用一次 drawPoints；序号文字使用缓存的 QStaticText，
+        缩放低于 LABEL_MIN_SCALE 时不画序号。这样每次绘制的开销受屏幕大小而不是点数限制。
+        """
+        origin = self.origin()
+        scale = self.scale_factor
+        xy = self.points[visible]  # 只取可见点，其余点不参与计算
+        sx = origin.x() + xy[:, 0] * scale
+        sy = origin.y() + xy[:, 1] * scale
+
+        single = np.ones(len(visible), dtype=bool)
+        clusters = []
+        if scale < 1.0 and len(visible):
+            cell = self.CLUSTER_PX
+            keys = np.floor(sx / cell).astype(np.int64) * (1 << 32) + np.floor(sy / cell).astype(np.int64)
+            _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+            inverse = inverse.reshape(-1)
+            single = counts[inverse] == 1
+            # 聚类中心取成员的平均屏幕位置
+            mean_x = np.bincount(inverse, weights=sx) / counts
+            mean_y = np.bincount(inverse, weights=sy) / counts
+            for group in np.flatnonzero(counts > 1):
+                clusters.append((mean_x[group], mean_y[group], int(counts[group])))
+
+        singles = [(int(idx), QPointF(x, y)) for idx, x, y in
+                   zip(visible[single].tolist(), sx[single].tolist(), sy[single].tolist())]
+
+        # 单独的点：同一画笔一次画完
+        if len(singles) > self.BATCH_POINTS:
+            painter.setPen(QPen(QColor(255, 0, 0), 6, Qt.SolidLine, Qt.RoundCap))
+            painter.drawPoints(QPolygonF([pos for _, pos in singles]))
+        else:
             painter.setPen(QPen(QColor(255, 0, 0), 3))
+            for _, pos in singles:
+                painter.drawEllipse(pos, 4, 4)
 
-        # Draw crosshair
-        if self.underMouse() and not self.checkMode:
-            cursor_pos = self.mapFromGlobal(self.cursor().pos())
-            painter.setPen(QPen(Qt.green, 1, Qt.DashLine))
-            painter.drawLine(0, cursor_pos.y(), self.width(), cursor_pos.y())
-            painter.drawLine(cursor_pos.x(), 0, cursor_pos.x(), self.height())
+        if self.scale_factor >= self.LABEL_MIN_SCALE:
+            painter.setPen(QColor(255, 105, 180))
+            for idx, pos in singles:
+                painter.drawStaticText(self.label_anchor(pos, painter), self.static_text(idx))
+
+        # 聚类：半透明圆 + 点数
+        if clusters:
+            painter.setBrush(QColor(255, 0, 0, 160))
+            painter.setPen(QPen(Qt.white, 1))
+            for cx, cy, count in clusters:
+                radius = 6 + min(10, 2 * math.log2(count))
+                painter.drawEllipse(QPointF(cx, cy), radius, radius)
+                text = self.static_text(count)
+                size = text.size()
+                painter.drawStaticText(QPointF(cx - size.width() / 2, cy - size.height() / 2), text)
+            painter.setBrush(Qt.NoBrush)
+
+    def static_text(self, value):
+        text = self._static_texts.get(value)
+        if text is None:
+            text = QStaticText(str(value))
+            text.setTextFormat(Qt.PlainText)
+            self._static_texts[value] = text
+        return text
+
+    def label_anchor(self, pos, painter):
+        # 与原来 drawText(x + 5, y + 5) 的基线位置一致；QStaticText 以左上角定位
+        return QPointF(pos.x() + 5, pos.y() + 5 - painter.fontMetrics().ascent())
+
+class SceneOverview(QWidget):
+    """
+    场景概览：按切片索引中的偏移和尺寸绘制整幅场景的切片格网，每个切片显示低分辨率缩略图，
+    并按标注状态着色（灰：没有标注文件，红：0 对点，黄到绿：点对数由少到多）；点击切片跳转过去。
+    点对数取自数据集目录（只重新读取有变化的 CSV），缩略图按绘制大小选择金字塔层级在后台解码并缓存。
+    """
+
+    MARGIN = 6
+    LEGEND_HEIGHT = 40
+
+    tile_clicked = pyqtSignal(int)  # 点击的切片序号
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.mainWindow = None
+        self.thumbs = ImagePrefetcher(budget_mb=64, radius=0, workers=2)
+        self.thumbs.loaded.connect(self.update)
+        self.setMouseTracking(True)
+        self.setMinimumSize(160, 160)
+
+    def sizeHint(self):
+        return QSize(280, 300)
+
+    def tile_layout(self):
+        """(有偏移的切片序号, 缩放比例, 场景左上角 x, y)；没有 tile_X_Y 切片时返回 None"""
+        index = self.mainWindow.tile_index
+        tiles = [i for i, position in enumerate(index.positions) if position is not None]
+        if not tiles:
+            return None
+        x0 = min(index.positions[i][0] for i in tiles)
+        y0 = min(index.positions[i][1] for i in tiles)
+        x1 = max(index.positions[i][0] + index.sizes[i][0] for i in tiles)
+        y1 = max(index.positions[i][1] + index.sizes[i][1] for i in tiles)
+        width = max(1, self.width() - 2 * self.MARGIN)
+        height = max(1, self.height() - 2 * self.MARGIN - self.LEGEND_HEIGHT)
+        return tiles, min(width / max(1, x1 - x0), height / max(1, y1 - y0)), x0, y0
+
+    def tile_rect(self, i, scale, x0, y0):
+        index = self.mainWindow.tile_index
+        (x, y), (width, height) = index.positions[i], index.sizes[i]
+        return QRectF(self.MARGIN + (x - x0) * scale, self.MARGIN + (y - y0) * scale, width * scale, height * scale)
+
+    def tile_at(self, pos):
+        layout = self.tile_layout() if self.mainWindow else None
+        if layout is None:
+            return None
+        _, scale, x0, y0 = layout
+        return self.mainWindow.tile_index.containing(int((pos.x() - self.MARGIN) / scale + x0),
+                                                     int((pos.y() - self.MARGIN) / scale + y0))
+
+    def point_count(self, i):
+        """切片的点对数；正在标注的切片取内存中的点，没有标注文件时返回 None"""
+        window = self.mainWindow
+        if not window.scene_mode and i == window.current_index and (window.store.is_dirty() or len(window.store)):
+            return window.store.side_count(RIGHT)
+        return window.catalog.point_count(window.image_list[i]) if window.catalog else None
+
+    @staticmethod
+    def status_color(count, max_count):
+        if count is None:
+            return QColor(128, 128, 128, 150)
+        if count == 0:
+            return QColor(220, 60, 60, 120)
+        return QColor.fromHsv(int(50 + 70 * count / max(count, max_count)), 255, 230, 110)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(40, 40, 40))
+        layout = self.tile_layout() if self.mainWindow else None
+        if layout is None:
+            painter.setPen(Qt.lightGray)
+            painter.drawText(self.rect(), Qt.AlignCenter, "没有 tile_X_Y 命名的切片")
+            return
+        window = self.mainWindow
+        tiles, scale, x0, y0 = layout
+        counts = [self.point_count(i) for i in tiles]
+        max_count = max((count for count in counts if count), default=1)
+        # 缩略图只需与绘制出的切片一样大
+        level = pyramid_level(scale * self.devicePixelRatioF())
+
+        missing = []
+        painter.setPen(QPen(QColor(0, 0, 0, 160), 1))
+        for i, count in zip(tiles, counts):
+            rect = self.tile_rect(i, scale, x0, y0)
+            path = os.path.join(window.opt_dir, window.image_list[i])
+            image = self.thumbs.cached(path, level)
+            if image is None:
+                missing.append(path)
+            else:
+                painter.drawImage(rect, image)
+            painter.fillRect(rect, self.status_color(count, max_count))
+            painter.drawRect(rect)
+        if missing:
+            self.thumbs.prefetch(missing, level)
+
+        if not window.scene_mode and window.current_index in window.tile_index.offsets.values():
+            # 当前切片：有未保存的修改时用虚线
+            pen = QPen(QColor(255, 220, 0), 2, Qt.DashLine if window.store.is_dirty() else Qt.SolidLine)
+            painter.setPen(pen)
+            painter.drawRect(self.tile_rect(window.current_index, scale, x0, y0))
+
+        labelled = sum(1 for count in counts if count)
+        painter.setPen(Qt.lightGray)
+        painter.drawText(QRect(self.MARGIN, self.height() - self.LEGEND_HEIGHT, self.width() - 2 * self.MARGIN,
+                               self.LEGEND_HEIGHT), Qt.AlignBottom | Qt.AlignLeft | Qt.TextWordWrap,
+                         f"已标注 {labelled}/{len(tiles)} 个切片\n灰：无标注  红：0 对  黄→绿：点对由少到多")
+
+    def mouseMoveEvent(self, event):
+        i = self.tile_at(event.pos())
+        if i is None:
+            self.setToolTip("")
+            return
+        count = self.point_count(i)
+        self.setToolTip(f"{self.mainWindow.image_list[i]}\n{'没有标注文件' if count is None else f'{count} 对点'}")
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            i = self.tile_at(event.pos())
+            if i is not None:
+                self.tile_clicked.emit(i)
+
+
+class ThumbnailModel(QAbstractListModel):
+    """
+    缩略图浏览器的列表模型：行与图像列表一一对应，只有视图请求（即可见）的行才生成缩略图。
+    OPT/SAR 缩略图经磁盘缓存在线程池中生成，左右拼成一幅后放入按条数淘汰的内存 LRU；
+    滚出视野的排队任务会被取消，内存中只保留最近显示过的缩略图。
+    """
+
+    MEMORY_ITEMS = 500
+    GAP = 4  # OPT 与 SAR 缩略图之间的间隔
+    SAVE_INDEX_MS = 2000  # 生成新缩略图后等待这么久再写回磁盘索引
+
+    # 后台生成完成 (数据集代数, OPT 文件名, 拼好的缩略图)，跨线程以排队方式发送到主线程
+    thumbnail_ready = pyqtSignal(int, str, QImage)
+    message = pyqtSignal(str)  # 生成失败、索引写入失败等提示，由主窗口显示在状态栏
+
+    def __init__(self, cache, workers=2):
+        super().__init__()
+        self.cache = cache
+        self.opt_dir = ""
+        self.sar_dir = ""
+        self.names = []
+        self.sar_names = {}
+        self.rows = {}  # OPT 文件名 -> 行号
+        self._generation = 0  # 每次更换数据集加一，丢弃旧数据集迟到的结果
+        self._pixmaps = OrderedDict()  # OPT 文件名 -> QPixmap，按最近使用排序
+        self._pending = {}  # OPT 文件名 -> Future
+        self._failed = set()  # 生成失败的 OPT 文件名
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+        size = cache.size
+        self.item_size = QSize(2 * size + self.GAP, size)
+        self._placeholder = QPixmap(self.item_size)
+        self._placeholder.fill(QColor(60, 60, 60))
+        self.thumbnail_ready.connect(self.on_thumbnail_ready)
+        self.save_timer = QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.setInterval(self.SAVE_INDEX_MS)
+        self.save_timer.timeout.connect(self.save_index)
+
+    def set_dataset(self, opt_dir, sar_dir, names, sar_names):
+        self.beginResetModel()
+        self.cancel_pending()
+        if (opt_dir, sar_dir) != (self.opt_dir, self.sar_dir):
+            self._pixmaps.clear()
+        self._generation += 1
+        self._failed.clear()
+        self.opt_dir, self.sar_dir = opt_dir, sar_dir
+        self.names, self.sar_names = list(names), dict(sar_names)
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.names)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.names):
+            return None
+        name = self.names[index.row()]
+        if role == Qt.DisplayRole:
+            return os.path.splitext(name)[0]
+        if role == Qt.DecorationRole:
+            pixmap = self._pixmaps.get(name)
+            if pixmap is not None:
+                self._pixmaps.move_to_end(name)
+                return pixmap
+            self.request(name)
+            return self._placeholder
+        if role == Qt.ToolTipRole:
+            return f"OPT: {name}\nSAR: {self.sar_names.get(name, name)}"
+        return None
+
+    def request(self, name):
+        if name in self._pending or name in self._failed:
+            return
+        paths = (os.path.join(self.opt_dir, name), os.path.join(self.sar_dir, self.sar_names.get(name, name)))
+        self._pending[name] = self._pool.submit(self._render, self._generation, name, paths)
+
+    def _render(self, generation, name, paths):
+        # 工作线程：QImage 和在 QImage 上绘制的 QPainter 都可以在非界面线程中使用
+        combined = QImage()
+        try:
+            size = self.cache.size
+            combined = QImage(self.item_size, QImage.Format_RGB32)
+            combined.fill(QColor(60, 60, 60))
+            painter = QPainter(combined)
+            try:
+                for i, path in enumerate(paths):
+                    image = self.cache.thumbnail(path, render_thumbnail)
+                    if not image.isNull():
+                        painter.drawImage(i * (size + self.GAP) + (size - image.width()) // 2,
+                                          (size - image.height()) // 2, image)
+            finally:
+                painter.end()
+        except Exception:
+            combined = QImage()  # 在界面线程中计入失败的行
+        finally:
+            # 无论成败都要通知界面线程，否则该行会一直留在排队列表中、再也不会重新请求
+            self.thumbnail_ready.emit(generation, name, combined)
+
+    def on_thumbnail_ready(self, generation, name, image):
+        if generation != self._generation:
+            return
+        self._pending.pop(name, None)
+        if image.isNull():
+            # 生成失败（原图损坏等）：一直显示占位图，换数据集之前不再重试
+            self._failed.add(name)
+            self.message.emit(f"{len(self._failed)} 个缩略图无法生成（最近一个: {name}）")
+            return
+        self._pixmaps[name] = QPixmap.fromImage(image)
+        while len(self._pixmaps) > self.MEMORY_ITEMS:
+            self._pixmaps.popitem(last=False)
+        row = self.rows.get(name)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+        self.save_timer.start()
+
+    def cancel_pending(self, keep=None):
+        """取消尚未开始的生成任务；keep(行号) 为真的保留"""
+        for name, future in list(self._pending.items()):
+            row = self.rows.get(name)
+            if (keep is None or row is None or not keep(row)) and future.cancel():
+                del self._pending[name]
+
+    def save_index(self):
+        try:
+            self.cache.save()
+        except OSError as e:
+            self.message.emit(f"无法写入缩略图索引: {e}")
+
+    def shutdown(self):
+        self.cancel_pending()
+        self._pool.shutdown(wait=False)
+        self.save_timer.stop()
+        self.save_index()
+
+
+class ThumbnailBrowser(QListView):
+    """
+    缩略图浏览器：虚拟化的列表视图，只向模型请求可见行的数据，上万个切片也只生成和保存看得到的缩略图。
+    停靠在窗口底部时是一条横向滚动的胶片条，拉高后按列排成网格。
+    """
+
+    PRUNE_MS = 100
+
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.setModel(model)
+        self.setViewMode(QListView.IconMode)
+        self.setFlow(QListView.TopToBottom)
+        self.setWrapping(True)
+        self.setResizeMode(QListView.Adjust)
+        self.setMovement(QListView.Static)
+        self.setUniformItemSizes(True)  # 所有行同样大小，布局时不必逐行询问尺寸
+        self.setLayoutMode(QListView.Batched)
+        self.setIconSize(model.item_size)
+        self.setSpacing(4)
+        self.setSelectionMode(QListView.SingleSelection)
+        self.setEditTriggers(QListView.NoEditTriggers)
+        self.setMinimumHeight(model.item_size.height() + 60)
+
+        # 快速滚动时排队的缩略图大多已滚出视野，停下后取消这些任务
+        self.prune_timer = QTimer(self)
+        self.prune_timer.setSingleShot(True)
+        self.prune_timer.setInterval(self.PRUNE_MS)
+        self.prune_timer.timeout.connect(self.prune)
+        self.horizontalScrollBar().valueChanged.connect(self.prune_timer.start)
+        self.verticalScrollBar().valueChanged.connect(self.prune_timer.start)
+
+    def prune(self):
+        area = self.viewport().rect()
+        model = self.model()
+        model.cancel_pending(lambda row: self.visualRect(model.index(row)).intersects(area))
 
 
 class MainWindow(QMainWindow):
+    COMPACT_MS = 30000  # 定时把日志压缩为当前点集快照的间隔（不写 CSV）
+    LABEL_REFRESH_MS = 500  # 保存目录有变化后等待这么久再刷新标注状态，合并连续的写入
+
+    save_finished = pyqtSignal(bool, str, str)  # 后台保存结果 (成功, CSV 路径, 错误信息)
+    catalog_refreshed = pyqtSignal(object, bool)  # 数据集目录后台刷新完成 (目录, 图像列表是否有变化)
+    replay_progress = pyqtSignal(int, int)  # 后台重放遗留日志的进度 (已处理数, 总数)
+
     def __init__(self):
         super().__init__()
         self.setWindowIcon(QIcon("image/mylogo.ico"))
@@ -238,66 +1104,118 @@ class MainWindow(QMainWindow):
         self.opt_dir = ""
         self.sar_dir = ""
         self.image_list = []
+        self.sar_names = {}  # OPT 文件名 -> 同名（扩展名可不同）的 SAR 文件名
+        # 图像对列表、尺寸和标注状态的持久化缓存，打开数据集时先用缓存，后台再增量刷新
+        self.catalog = None
+        # 按 tile_X_Y 偏移组织的切片索引：按名称 / 全局坐标定位，Ctrl+方向键切换到空间上相邻的切片
+        self.tile_index = TileIndex([])
         self.current_index = 0
 
         self.left_turn = True
         self.save_dir = ""
+
+        # 场景模式：把整个切片目录当作一幅大图标注，点坐标为全局坐标
+        self.scene_mode = False
         
-        # 保存原始点集，用于比较是否有变化
-        self.original_points1 = []
-        self.original_points2 = []
-
-        # Create scroll areas for image labels
-        self.scroll_area1 = QScrollArea()
-        self.scroll_area1.setWidgetResizable(True)
-        self.scroll_area1.setMinimumSize(500, 500)
-        self.scroll_area1.setAlignment(Qt.AlignCenter)
-        
-        self.scroll_area2 = QScrollArea()
-        self.scroll_area2.setWidgetResizable(True)
-        self.scroll_area2.setMinimumSize(500, 500)
-        self.scroll_area2.setAlignment(Qt.AlignCenter)
-        
-        # Create image labels
+        # 左右图共享的标注点对存储，自带修改计数，用于判断是否有未保存的变化
+        self.store = PointPairStore()
+        self.history = UndoStack(self.store)
+
+        # 相邻图像对的后台预取与缓存
+        self.prefetcher = ImagePrefetcher(budget_mb=512, radius=2)
+
+        # 写前日志与后台保存：设置保存目录后启用，编辑记录和 CSV 写入都在后台线程完成
+        self.journal = None
+        # 可选的 SQLite 项目库：启用后标注从 save_dir/labels.db 读写，不再逐个读写 CSV
+        self.database = None
+        self.save_finished.connect(self.on_save_finished)
+        self.catalog_refreshed.connect(self.on_catalog_refreshed)
+        self._compacted_revision = None  # 上次压缩日志时点集的 revision
+        self.compact_timer = QTimer(self)
+        self.compact_timer.setInterval(self.COMPACT_MS)
+        self.compact_timer.timeout.connect(self.compact_journal)
+        self.compact_timer.start()
+
+        # Create image views
         self.image_label1 = ImageLabel()
         self.image_label2 = ImageLabel()
+        self.image_label1.setMinimumSize(500, 500)
+        self.image_label2.setMinimumSize(500, 500)
         
         # 关联主窗口到标签
         self.image_label1.mainWindow = self
         self.image_label2.mainWindow = self
-        
-        # Set scroll areas to contain the labels
-        self.scroll_area1.setWidget(self.image_label1)
-        self.scroll_area2.setWidget(self.image_label2)
+        self.image_label1.store = self.store
+        self.image_label2.store = self.store
+        self.image_label1.side = LEFT
+        self.image_label2.side = RIGHT
         
         # Link the two image labels together
         self.image_label1.paired_label = self.image_label2
         self.image_label2.paired_label = self.image_label1
         
-        # Link scroll areas
-        self.image_label1.paired_scroll_area = self.scroll_area2
-        self.image_label2.paired_scroll_area = self.scroll_area1
-        
-        self.saved = True
 
         self.search_input = QLineEdit()
-        self.search_input.setPlaceholderText("输入图片名并回车定位...例如(0_0)")
+        self.search_input.setPlaceholderText("输入图片名(如 0_0)或全局坐标(如 1000,2000)并回车定位")
         self.search_input.returnPressed.connect(self.search_image)
 
+        # 场景概览：切片格网按标注点对数着色，点击跳转；保存目录中的 CSV 有变化时只重新读取变化的文件
+        self.overview = SceneOverview()
+        self.overview.mainWindow = self
+        self.overview.tile_clicked.connect(self.show_tile)
+        self.label_refresh_timer = QTimer(self)
+        self.label_refresh_timer.setSingleShot(True)
+        self.label_refresh_timer.setInterval(self.LABEL_REFRESH_MS)
+        self.label_refresh_timer.timeout.connect(self.refresh_label_status)
+        self.label_watcher = QFileSystemWatcher(self)
+        self.label_watcher.directoryChanged.connect(self.label_refresh_timer.start)
+
+        # 缩略图浏览器：虚拟化列表，只为可见的切片生成缩略图，缩略图按内容哈希缓存在磁盘上
+        self.thumbnail_model = ThumbnailModel(ThumbnailCache())
+        self.thumbnail_browser = ThumbnailBrowser(self.thumbnail_model)
+        self.thumbnail_browser.clicked.connect(self.thumbnail_clicked)
+        self.thumbnail_model.message.connect(lambda text: self.statusBar().showMessage(text, 5000))
+
         self.initUI()
 
     def initUI(self):
         layout = QVBoxLayout()
         hbox = QHBoxLayout()
 
-        hbox.addWidget(self.scroll_area1)
-        hbox.addWidget(self.scroll_area2)
+        hbox.addWidget(self.image_label1)
+        hbox.addWidget(self.image_label2)
 
         button_layout = QHBoxLayout()
         self.load_button = QPushButton("打开图片夹")
         self.load_button.clicked.connect(self.load_images)
         button_layout.addWidget(self.load_button)
 
+        self.scene_button = QPushButton("场景模式")
+        self.scene_button.setCheckable(True)
+        self.scene_button.setEnabled(False)
+        self.scene_button.clicked.connect(self.toggle_scene_mode)
+        button_layout.addWidget(self.scene_button)
+
+        self.overview_button = QPushButton("场景概览")
+        self.overview_button.setCheckable(True)
+        button_layout.addWidget(self.overview_button)
+        self.overview_dock = QDockWidget("场景概览", self)
+        self.overview_dock.setWidget(self.overview)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.overview_dock)
+        self.overview_dock.hide()
+        self.overview_button.toggled.connect(self.overview_dock.setVisible)
+        self.overview_dock.visibilityChanged.connect(self.overview_button.setChecked)
+
+        self.thumbnail_button = QPushButton("缩略图")
+        self.thumbnail_button.setCheckable(True)
+        button_layout.addWidget(self.thumbnail_button)
+        self.thumbnail_dock = QDockWidget("缩略图", self)
+        self.thumbnail_dock.setWidget(self.thumbnail_browser)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.thumbnail_dock)
+        self.thumbnail_dock.hide()
+        self.thumbnail_button.toggled.connect(self.thumbnail_dock.setVisible)
+        self.thumbnail_dock.visibilityChanged.connect(self.thumbnail_button.setChecked)
+
         self.prev_button = QPushButton("上一张")
         self.prev_button.clicked.connect(self.prev_image)
         button_layout.addWidget(self.prev_button)
@@ -314,6 +1232,11 @@ class MainWindow(QMainWindow):
         self.set_dir_button.clicked.connect(self.set_save_directory)
         button_layout.addWidget(self.set_dir_button)
 
+        self.database_button = QPushButton("项目数据库")
+        self.database_button.setCheckable(True)
+        self.database_button.clicked.connect(self.toggle_database)
+        button_layout.addWidget(self.database_button)
+
         button_layout.addWidget(self.search_input)
 
         check_layout = QHBoxLayout()
@@ -358,6 +1281,17 @@ class MainWindow(QMainWindow):
         self.grid_size_input.returnPressed.connect(self.set_grid_size_from_input)
         grid_button_layout.addWidget(self.grid_size_input)
 
+        self.grid_anchor_button = QPushButton("网格对齐全局坐标")
+        self.grid_anchor_button.setCheckable(True)
+        self.grid_anchor_button.clicked.connect(self.update_grid_anchor)
+        grid_button_layout.addWidget(self.grid_anchor_button)
+
+        self.cache_size_input = QLineEdit()
+        self.cache_size_input.setPlaceholderText("缓存上限MB,如512")
+        self.cache_size_input.setFixedWidth(110)
+        self.cache_size_input.returnPressed.connect(self.set_cache_budget_from_input)
+        grid_button_layout.addWidget(self.cache_size_input)
+
         # self.grid_size_button_256 = QPushButton("网格: 256x256")
         # self.grid_size_button_256.clicked.connect(lambda: self.set_grid_size(256))
         # grid_button_layout.addWidget(self.grid_size_button_256)
@@ -376,29 +1310,72 @@ class MainWindow(QMainWindow):
         state = self.grid_toggle_button.isChecked()
         self.image_label1.show_grid = state
         self.image_label2.show_grid = state
-        self.image_label1.update()
-        self.image_label2.update()
+        self.image_label1.viewport().update()
+        self.image_label2.viewport().update()
         self.grid_toggle_button.setText("隐藏网格" if state else "显示网格")
 
+    def update_grid_anchor(self):
+        # 按 tile_X_Y 文件名中的偏移对齐网格；场景模式下坐标本身就是全局坐标
+        anchor = (0, 0)
+        if self.grid_anchor_button.isChecked() and not self.scene_mode and self.image_list:
+            anchor = parse_tile_offset(self.image_list[self.current_index]) or (0, 0)
+        self.image_label1.grid_anchor = anchor
+        self.image_label2.grid_anchor = anchor
+        self.image_label1.viewport().update()
+        self.image_label2.viewport().update()
+
     def set_grid_size(self, size):
         self.image_label1.grid_size = size
         self.image_label2.grid_size = size
-        self.image_label1.update()
-        self.image_label2.update()
+        self.image_label1.viewport().update()
+        self.image_label2.viewport().update()
 
     def load_images(self):
         self.opt_dir = QFileDialog.getExistingDirectory(self, "选择OPT文件夹")
         self.sar_dir = QFileDialog.getExistingDirectory(self, "选择SAR文件夹")
         if not self.opt_dir or not self.sar_dir:
             return
-        # 根据文件修改时间排序
-        self.image_list = sorted(
-            list(set(os.listdir(self.opt_dir)).intersection(set(os.listdir(self.sar_dir)))),
-            key=lambda x: os.path.getmtime(os.path.join(self.opt_dir, x))
-        )
+        # 按去掉扩展名后的文件名配对（SAR 可以直接是 16 位 / 浮点的 TIFF 或 .npy），按修改时间排序；
+        # 打开过的目录直接用缓存的列表，首次打开只做一次 scandir，尺寸和标注状态都在后台读取
+        catalog = DatasetCatalog(self.opt_dir, self.sar_dir)
+        if not catalog.load():
+            catalog.refresh()
+        catalog.set_label_dir(self.save_dir)
+        self.catalog = catalog
+        self.image_list = catalog.names()
+        self.sar_names = catalog.sar_names()
+        self.update_tile_index()
+        self.thumbnail_model.set_dataset(self.opt_dir, self.sar_dir, self.image_list, self.sar_names)
         self.current_index = 0
+        self.prefetcher.clear()
+        self.overview.thumbs.clear()
+        self.scene_mode = False
+        self.scene_button.setChecked(False)
         self.load_current_image()
         self.check_button.setEnabled(True)
+        self.scene_button.setEnabled(True)
+        catalog.refresh_in_background(self.catalog_refreshed.emit)
+
+    def on_catalog_refreshed(self, catalog, changed):
+        if catalog is not self.catalog:
+            return
+        if not changed:
+            self.update_tile_index()  # 后台已读到切片尺寸
+            return
+        # 后台扫描发现图像增删或修改时间变化：更新列表，尽量停留在当前图像上
+        current = self.image_list[self.current_index] if self.image_list else None
+        image_list, sar_names = catalog.names(), catalog.sar_names()
+        if current is not None and current not in sar_names:
+            # 正在标注的图像已被删除或改名：先留在列表中，保存仍写到它自己的标注文件
+            image_list.insert(min(self.current_index, len(image_list)), current)
+            sar_names[current] = self.sar_names.get(current, current)
+        self.image_list, self.sar_names = image_list, sar_names
+        if current is not None:
+            self.current_index = self.image_list.index(current)
+        self.update_tile_index()
+        self.thumbnail_model.set_dataset(self.opt_dir, self.sar_dir, self.image_list, self.sar_names)
+        self.select_thumbnail()
+        self.statusBar().showMessage(f"图像列表已更新，共 {len(self.image_list)} 对图像", 5000)
 
     def load_current_image(self):
         if not self.image_list:
@@ -406,77 +1383,133 @@ class MainWindow(QMainWindow):
 
         filename = self.image_list[self.current_index]
         opt_path = os.path.join(self.opt_dir, filename)
-        sar_path = os.path.join(self.sar_dir, filename)
+        sar_path = os.path.join(self.sar_dir, self.sar_names.get(filename, filename))
 
         # Reset zoom and pan for both images
         self.image_label1.scale_factor = 1.0
         self.image_label2.scale_factor = 1.0
         
+        opt_image, sar_image = self.prefetcher.get(opt_path), self.prefetcher.get(sar_path)
+        self.image_label1.set_image(QPixmap.fromImage(opt_image))
+        self.image_label2.set_image(QPixmap.fromImage(sar_image))
+        failed = [path for path, image in ((opt_path, opt_image), (sar_path, sar_image)) if image.isNull()]
+
         # Reset scrollbar positions
-        self.scroll_area1.horizontalScrollBar().setValue(0)
-        self.scroll_area1.verticalScrollBar().setValue(0)
-        self.scroll_area2.horizontalScrollBar().setValue(0)
-        self.scroll_area2.verticalScrollBar().setValue(0)
-        
-        self.image_label1.set_image(QPixmap(opt_path))
-        self.image_label2.set_image(QPixmap(sar_path))
-        self.image_label1.points.clear()
-        self.image_label2.points.clear()
-        
-        # 清除原始点集
-        self.original_points1.clear()
-        self.original_points2.clear()
+        self.image_label1.horizontalScrollBar().setValue(0)
+        self.image_label1.verticalScrollBar().setValue(0)
+        self.image_label2.horizontalScrollBar().setValue(0)
+        self.image_label2.verticalScrollBar().setValue(0)
+        self.prefetch_neighbours()
+        self.store.listener = None  # 加载过程不记入日志
+        self.store.clear()
+        self.history.clear()
 
         # 自动加载对应的CSV坐标标注
         if self.save_dir:
             csv_name = os.path.splitext(filename)[0] + "_points.csv"
             csv_path = os.path.join(self.save_dir, csv_name)
-            if os.path.exists(csv_path):
+            if self.database is not None or os.path.exists(csv_path):
                 try:
-                    with open(csv_path, 'r', newline='') as file:
-                        reader = csv.reader(file)
-                        rows = list(reader)
-
-                        # 自动跳过前几行标题
-                        start_idx = 0
-                        for i, row in enumerate(rows):
-                            if row and row[0] == 'ID':
-                                start_idx = i + 1
-                                break
-
-                        for row in rows[start_idx:]:
-                            if len(row) >= 5:
-                                x1, y1, x2, y2 = map(int, row[1:5])
-                                self.image_label1.points.append(QPoint(x1, y1))
-                                self.image_label2.points.append(QPoint(x2, y2))
-                                # 保存原始点集
-                                self.original_points1.append(QPoint(x1, y1))
-                                self.original_points2.append(QPoint(x2, y2))
+                    self.append_points(self.read_points(csv_path))
                 except Exception as e:
                     QMessageBox.warning(self, "读取标注失败", f"无法读取标注文件：\n{str(e)}")
 
-        self.image_label1.update()
-        self.image_label2.update()
+        self.store.mark_saved()
+        self.begin_journal()
+        self.image_label1.viewport().update()
+        self.image_label2.viewport().update()
         self.left_turn = True
+        self.update_grid_anchor()
         self.setWindowTitle(f"图像配准标注器 - 当前图片: {filename}")
-        
-        # 重置保存状态
-        self.saved = True
-
-    def search_image(self):
-        target_name = self.search_input.text().strip()
-        target_name = 'tile_' + target_name + '.png'
-        if not target_name:
+        if failed:
+            self.statusBar().showMessage("无法读取图像 " + "；".join(
+                f"{path}: {self.prefetcher.error(path) or '格式不支持或文件已损坏'}" for path in failed))
+        else:
+            self.statusBar().showMessage(self.prefetcher.stats())
+        self.overview.update()
+        self.select_thumbnail()
+
+    def append_points(self, rows, offset_x=0, offset_y=0):
+        if offset_x or offset_y:
+            rows = rows + np.array([offset_x, offset_y, offset_x, offset_y], dtype=rows.dtype)
+        self.store.extend(rows)
+
+    def toggle_scene_mode(self):
+        if not self.confirm_leave():
+            self.scene_button.setChecked(self.scene_mode)
             return
-        if target_name not in self.image_list:
-            QMessageBox.warning(self, "未找到图片", f"未找到名为 {target_name} 的图片。")
+        if self.scene_button.isChecked():
+            self.enter_scene_mode()
+        else:
+            self.scene_mode = False
+            self.next_button.setEnabled(True)
+            self.prev_button.setEnabled(True)
+            self.load_current_image()
+
+    def enter_scene_mode(self):
+        # 切片尺寸优先取数据集目录中缓存的文件头信息
+        infos = [self.catalog.image_info(name) for name in self.image_list] if self.catalog else None
+        opt_scene = TileScene(self.opt_dir, self.image_list, infos=infos and [info[0] for info in infos])
+        sar_scene = TileScene(self.sar_dir, [self.sar_names.get(name, name) for name in self.image_list],
+                              infos=infos and [info[1] for info in infos])
+        if not opt_scene.tiles or not sar_scene.tiles:
+            QMessageBox.warning(self, "无法进入场景模式", "文件夹中没有 tile_X_Y 命名的切片！")
+            self.scene_button.setChecked(False)
             return
-        self.current_index = self.image_list.index(target_name)
-        self.load_current_image()
 
-    def next_image(self):
+        self.scene_mode = True
+        self.next_button.setEnabled(False)
+        self.prev_button.setEnabled(False)
+        self.image_label1.set_scene(opt_scene)
+        self.image_label2.set_scene(sar_scene)
+        self.update_grid_anchor()
+        for label in (self.image_label1, self.image_label2):
+            label.scale_factor = label.fit_scale()
+            label.update_display()
+        self.store.listener = None
+        self.store.clear()
+        self.history.clear()
+
+        # 加载全局标注：优先读取合并后的 tile_all_points.csv，否则把各切片的标注加上偏移量拼起来
+        source = ""
+        if self.save_dir:
+            all_path = os.path.join(self.save_dir, SCENE_CSV_NAME)
+            try:
+                if self.database is not None:
+                    # 项目库中一次查询即可取出所有切片的点并换算到全局坐标
+                    if self.database.has_tile(tile_name(all_path)):
+                        self.append_points(self.database.read(all_path))
+                    else:
+                        self.append_points(self.database.global_rows())
+                    source = DB_NAME
+                elif os.path.exists(all_path):
+                    self.append_points(read_points_csv(all_path))
+                    source = SCENE_CSV_NAME
+                else:
+                    # 优先从二进制 sidecar 读取，CSV 有变化的切片再单独解析；
+                    # 整目录读取时顺便重写过期的 sidecar（新切片、空洞过多等）
+                    tiles = load_points_dir(self.save_dir, refresh=True)
+                    for filename in self.image_list:
+                        offset = parse_tile_offset(filename)
+                        rows = tiles.get(os.path.splitext(filename)[0])
+                        if offset is not None and rows is not None:
+                            self.append_points(rows, *offset)
+                    source = "各切片标注"
+            except Exception as e:
+                QMessageBox.warning(self, "读取标注失败", f"无法读取标注文件：\n{str(e)}")
+
+        self.store.mark_saved()
+        self.begin_journal()
+        self.left_turn = True
+        self.overview.update()
+        size = opt_scene.size()
+        self.setWindowTitle(f"图像配准标注器 - 场景模式: {size.width()}x{size.height()}, {len(opt_scene.tiles)} 个切片")
+        self.statusBar().showMessage(f"已加载 {len(self.store)} 对全局标注点 {source}")
+
+    def confirm_leave(self):
+        """离开当前图片前的保存确认；返回 False 表示取消"""
         # 只在点集有变化且未保存时提示保存
-        if not self.saved and self.points_changed():
+        if self.points_changed():
             msg = QMessageBox(self)
             msg.setWindowTitle("未保存")
             msg.setText("当前标注结果尚未保存，是否继续？")
@@ -493,34 +1526,117 @@ class MainWindow(QMainWindow):
             if clicked_button == save_button:
                 self.save_points_to_csv()  # 保存当前标注
             elif clicked_button == cancel_button:
+                return False
+            elif self.journal and self.csv_target():
+                # 不保存，继续：日志中的这些修改以后也不再恢复
+                self.journal.discard(self.csv_target()[0])
+        return True
+
+    def prefetch_neighbours(self):
+        # 由近及远交替预取后一张和前一张
+        paths = []
+        for step in range(1, self.prefetcher.radius + 1):
+            for idx in (self.current_index + step, self.current_index - step):
+                if 0 <= idx < len(self.image_list):
+                    filename = self.image_list[idx]
+                    paths.append(os.path.join(self.opt_dir, filename))
+                    paths.append(os.path.join(self.sar_dir, self.sar_names.get(filename, filename)))
+        self.prefetcher.prefetch(paths)
+
+    def update_tile_index(self):
+        sizes = None
+        if self.catalog is not None:
+            infos = [self.catalog.image_info(name)[0] for name in self.image_list]
+            sizes = [(info.width, info.height) if info else None for info in infos]
+        self.tile_index = TileIndex(self.image_list, sizes)
+        self.overview.update()
+
+    def go_to_image(self, index):
+        """切换到序号为 index 的图像（先确认是否保存）；返回是否切换"""
+        if index == self.current_index:
+            return True
+        if not self.confirm_leave():
+            return False
+        self.current_index = index
+        self.load_current_image()
+        return True
+
+    def search_image(self):
+        text = self.search_input.text().strip()
+        if not text or not self.image_list:
+            return
+        # "x,y" 为全局坐标：场景模式下居中显示该点，否则打开包含它的切片并居中
+        parts = text.replace('，', ',').split(',')
+        if len(parts) == 2:
+            try:
+                x, y = (int(float(part)) for part in parts)
+            except ValueError:
+                pass
+            else:
+                self.search_coordinate(x, y)
+                return
+        index = self.tile_index.find(text)
+        if index is None:
+            QMessageBox.warning(self, "未找到图片", f"未找到名为 {text} 的图片。")
+            return
+        self.show_tile(index)
+
+    def show_tile(self, index):
+        """打开序号为 index 的切片；场景模式下把该切片居中显示"""
+        if not self.scene_mode:
+            self.go_to_image(index)
+        elif self.tile_index.positions[index] is not None:
+            (ox, oy), (width, height) = self.tile_index.positions[index], self.tile_index.sizes[index]
+            self.search_coordinate(ox + width // 2, oy + height // 2)
+
+    def thumbnail_clicked(self, index):
+        self.show_tile(index.row())
+        self.select_thumbnail()  # 取消切换时选中项回到当前图像
+
+    def select_thumbnail(self):
+        if self.scene_mode or not self.image_list:
+            return
+        index = self.thumbnail_model.index(self.current_index)
+        self.thumbnail_browser.setCurrentIndex(index)
+        self.thumbnail_browser.scrollTo(index)
+
+    def search_coordinate(self, x, y):
+        if self.scene_mode:
+            local = QPointF(x, y)
+        else:
+            index = self.tile_index.containing(x, y)
+            if index is None:
+                QMessageBox.warning(self, "未找到图片", f"没有切片包含全局坐标 ({x}, {y})。")
                 return
-            # 如果点击了"不保存，继续"，什么都不做，直接继续
+            if not self.go_to_image(index):
+                return
+            ox, oy = self.tile_index.positions[index]
+            local = QPointF(x - ox, y - oy)
+        for label in (self.image_label1, self.image_label2):
+            view = label.viewport()
+            label.zoom_to(label.scale_factor, local, QPointF(view.width() / 2, view.height() / 2))
+
+    def go_to_neighbour(self, dx, dy):
+        """切换到空间上相邻的切片（Ctrl+方向键）"""
+        if self.scene_mode or not self.image_list:
+            return
+        index = self.tile_index.neighbour(self.current_index, dx, dy)
+        if index is None:
+            self.statusBar().showMessage("该方向上没有相邻的切片", 2000)
+            return
+        self.go_to_image(index)
+
+    def next_image(self):
+        if self.scene_mode or not self.confirm_leave():
+            return
 
         if self.current_index < len(self.image_list) - 1:
             self.current_index += 1
             self.load_current_image()
 
     def prev_image(self):
-        # 只在点集有变化且未保存时提示保存
-        if not self.saved and self.points_changed():
-            msg = QMessageBox(self)
-            msg.setWindowTitle("未保存")
-            msg.setText("当前标注结果尚未保存，是否继续？")
-            msg.setIcon(QMessageBox.Warning)
-
-            save_button = msg.addButton("保存", QMessageBox.YesRole)
-            continue_button = msg.addButton("不保存，继续", QMessageBox.NoRole)
-            cancel_button = msg.addButton("取消", QMessageBox.RejectRole)
-
-            msg.exec_()
-
-            clicked_button = msg.clickedButton()
-
-            if clicked_button == save_button:
-                self.save_points_to_csv()  # 保存当前标注
-            elif clicked_button == cancel_button:
-                return
-            # 如果点击了"不保存，继续"，什么都不做，直接继续
+        if self.scene_mode or not self.confirm_leave():
+            return
 
         if self.current_index > 0:
             self.current_index -= 1
@@ -529,10 +1645,161 @@ class MainWindow(QMainWindow):
     def set_save_directory(self):
         dir_path = QFileDialog.getExistingDirectory(self, "选择保存目录")
         if dir_path:
+            # 已有保存目录时，未保存的修改属于原目录中的标注文件：先确认保存或放弃，切换后改读新目录中的标注。
+            # 还没有保存目录时（先标注后设置目录）内存中的点保留下来，保存到新目录
+            switching = bool(self.save_dir)
+            if switching and not self.confirm_leave():
+                return
             self.save_dir = dir_path
+            if self.catalog is not None:
+                self.catalog.set_label_dir(dir_path)
+                self.catalog.refresh_in_background(self.catalog_refreshed.emit)
+            if self.label_watcher.directories():
+                self.label_watcher.removePaths(self.label_watcher.directories())
+            self.label_watcher.addPath(dir_path)
+            # 项目库属于原来的保存目录，等日志写完后关闭
+            database, self.database = self.database, None
+            self.database_button.setChecked(False)
+            recovered = self.open_journal()
+            if database is not None:
+                database.close()
+            if switching or (recovered and not self.store.is_dirty()):
+                # 换了目录，或恢复的修改已经写回：重新加载当前图片的标注
+                self.reload_annotations()
+            else:
+                self.begin_journal()
+
+    def refresh_label_status(self):
+        """保存目录有变化：后台只重新读取有变化的 CSV 的点对数，完成后刷新场景概览"""
+        if self.catalog is not None and self.save_dir:
+            self.catalog.refresh_in_background(self.catalog_refreshed.emit, images=False)
+
+    def toggle_database(self):
+        if not self.confirm_leave():
+            self.database_button.setChecked(self.database is not None)
+            return
+        if self.database_button.isChecked():
+            if not self.save_dir:
+                QMessageBox.warning(self, "无法启用项目数据库", "尚未设置保存目录！")
+                self.database_button.setChecked(False)
+                return
+            try:
+                database = LabelDatabase(os.path.join(self.save_dir, DB_NAME))
+                # 新建的项目库先导入保存目录中已有的 CSV 标注
+                imported = database.import_csv(self.save_dir) if database.created else 0
+            except (OSError, sqlite3.Error, ValueError) as e:
+                QMessageBox.warning(self, "无法启用项目数据库", f"无法打开 {DB_NAME}：\n{str(e)}")
+                self.database_button.setChecked(False)
+                return
+            self.database = database
+            self.open_journal()
+            self.reload_annotations()
+            self.statusBar().showMessage(f"已启用项目数据库 {database.path}，导入 {imported} 个标注文件")
+        else:
+            database, self.database = self.database, None
+            self.open_journal()  # 先写完排队中的保存再关闭数据库
+            if database is not None:
+                database.close()
+            self.reload_annotations()
+
+    def reload_annotations(self):
+        if not self.image_list:
+            self.begin_journal()
+        elif self.scene_mode:
+            self.enter_scene_mode()
+        else:
+            self.load_current_image()
+
+    def open_journal(self):
+        """
+        结束旧日志，重放上次异常退出留下的日志，再开始本次会话的日志。
+        返回恢复的标注文件列表；调用方负责 begin_journal 或重新加载标注。
+        """
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+        self.store.listener = None
+        try:
+            recovered = self.replay_in_background()
+            self.journal = SessionJournal(self.save_dir, self.save_finished.emit, after_write=patch_sidecar)
+        except (OSError, sqlite3.Error, ValueError, KeyError, TypeError) as e:
+            QMessageBox.warning(self, "日志不可用", f"无法使用标注日志，修改只在手动保存时写入：\n{str(e)}")
+            return []
+        if recovered:
+            self.statusBar().showMessage(f"已从上次未正常退出的日志恢复 {len(recovered)} 个标注文件")
+        return recovered
+
+    def replay_in_background(self):
+        """
+        在后台线程中重放遗留日志，期间显示模态进度框，界面照常重绘；返回恢复的标注文件列表。
+        重放中的异常在这里重新抛出
+        """
+        if not journal_paths(self.save_dir):
+            return []
+        result = {}
+
+        def replay():
+            try:
+                result["recovered"] = replay_journals(self.save_dir, progress=self.replay_progress.emit)
+            except Exception as e:
+                result["error"] = e
+            finally:
+                self.replay_progress.emit(-1, -1)
+
+        dialog = QProgressDialog("正在从上次未正常退出的日志恢复标注...", None, 0, 0, self)
+        dialog.setWindowTitle("恢复标注")
+        dialog.setModal(True)
+        dialog.setMinimumDuration(0)
+        loop = QEventLoop()
+
+        def on_progress(done, total):
+            if total < 0:
+                loop.quit()  # 排队送达，线程先结束也不会漏掉
+            else:
+                dialog.setMaximum(total)
+                dialog.setValue(done)
+
+        self.replay_progress.connect(on_progress)
+        dialog.show()
+        threading.Thread(target=replay, name="journal-replay", daemon=True).start()
+        loop.exec_()
+        self.replay_progress.disconnect(on_progress)
+        dialog.close()
+        if "error" in result:
+            raise result["error"]
+        return result["recovered"]
+
+    def read_points(self, csv_path):
+        if self.database is not None:
+            return self.database.read(csv_path)
+        return read_points_csv(csv_path)
+
+    def begin_journal(self):
+        """开始把当前标注文件的修改记入日志"""
+        target = self.csv_target()
+        if not self.journal or not target:
+            return
+        self.journal.begin(*target, database=self.database)
+        if self.store.is_dirty():
+            # 内存中已有未保存的点（如先标注后设置保存目录），先记一份完整状态
+            self.journal.record('clear')
+            self.journal.record('extend', self.store.rows())
+            if self.store.has_pending():
+                self.journal.record('add_left', *self.store.left[-1])
+        self.store.listener = self.journal.record
+
+    def csv_target(self):
+        """当前标注对应的 (CSV 路径, 左图名, 右图名)；没有保存目录或图片时返回 None"""
+        if not self.save_dir or not (self.scene_mode or self.image_list):
+            return None
+        # 场景模式下的全局坐标保存为合并格式 tile_all_points.csv
+        filename = SCENE_IMAGE_NAME if self.scene_mode else self.image_list[self.current_index]
+        save_name = os.path.splitext(filename)[0] + "_points.csv"
+        return (os.path.join(self.save_dir, save_name),
+                f"OPT/{filename}", f"SAR/{self.sar_names.get(filename, filename)}")
 
     def save_points_to_csv(self):
-        if len(self.image_label1.points) != len(self.image_label2.points):
+        if self.store.has_pending():
             QMessageBox.warning(self, "保存失败", "左右图像标注的点数不一致，无法保存！")
             return
 
@@ -540,110 +1807,91 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "保存失败", "尚未设置保存目录！")
             return
 
-        filename = self.image_list[self.current_index]
-        save_name = os.path.splitext(filename)[0] + "_points.csv"
-        save_path = os.path.join(self.save_dir, save_name)
-
-        with open(save_path, mode='w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow([f"LeftImage: OPT/{filename}"])
-            writer.writerow([f"RightImage: SAR/{filename}"])
-            writer.writerow(["-" * 50])
-            writer.writerow(["ID", "LeftX", "LeftY", "RightX", "RightY"])
-            for i, (p1, p2) in enumerate(zip(self.image_label1.points, self.image_label2.points), start=1):
-                writer.writerow([i, int(p1.x()), int(p1.y()), int(p2.x()), int(p2.y())])
-
-        self.saved = True
-        
-        # 保存当前点集为原始点集
-        self.original_points1 = self.image_label1.points.copy()
-        self.original_points2 = self.image_label2.points.copy()
-        
-        QMessageBox.information(self, "保存成功", f"标注点已保存至 {save_path}")
+        target = self.csv_target()
+        if target is None:
+            return
+        if self.journal:
+            # 写盘交给后台线程，完成后由 on_save_finished 在状态栏提示
+            self.journal.save(target[0], self.store.rows(), *target[1:], database=self.database)
+            self.statusBar().showMessage(f"正在保存至 {target[0]} ...")
+        else:
+            try:
+                if self.database is not None:
+                    self.database.write(target[0], self.store.rows(), *target[1:])
+                else:
+                    write_points_csv(target[0], self.store.rows(), *target[1:])
+            except (OSError, sqlite3.Error) as e:
+                QMessageBox.warning(self, "保存失败", f"无法写入标注文件：\n{str(e)}")
+                return
+            if self.database is None:
+                try:
+                    patch_sidecar(target[0])
+                except (OSError, ValueError):
+                    pass  # sidecar 只是缓存，读取时会退回解析 CSV
+            self.statusBar().showMessage(f"标注点已保存至 {target[0]}")
+        self.store.mark_saved()
+
+    def compact_journal(self):
+        # 定时压缩日志：把累积的编辑记录换成当前点集的一份快照，崩溃后重放的结果不变。
+        # 只改写日志，不写 CSV、不标记为已保存，是否保存仍由用户决定
+        target = self.csv_target()
+        if not self.journal or not target or self.store.revision == self._compacted_revision:
+            return
+        if self.store.is_dirty(check_content=True):
+            pending = self.store.left[-1] if self.store.has_pending() else None
+            self.journal.compact(*target, self.store.rows(), pending, database=self.database)
+        self._compacted_revision = self.store.revision
+
+    def on_save_finished(self, ok, csv_path, message):
+        if ok:
+            where = f"{DB_NAME} ({tile_name(csv_path)})" if self.database is not None else csv_path
+            self.statusBar().showMessage(f"标注点已保存至 {where}", 5000)
+            self.overview.update()
+            return
+        target = self.csv_target()
+        if target and target[0] == csv_path:
+            self.store.mark_dirty()
+        QMessageBox.warning(self, "保存失败", f"无法写入标注文件 {csv_path}：\n{message}")
 
     def keyPressEvent(self, event):
-        if event.key() == Qt.Key_Right:
+        arrows = {Qt.Key_Left: (-1, 0), Qt.Key_Right: (1, 0), Qt.Key_Up: (0, -1), Qt.Key_Down: (0, 1)}
+        if event.key() in arrows and event.modifiers() & Qt.ControlModifier:
+            self.go_to_neighbour(*arrows[event.key()])
+        elif event.key() == Qt.Key_Right:
             self.next_image()
         elif event.key() == Qt.Key_Left:
             self.prev_image()
         elif event.key() == Qt.Key_S and event.modifiers() & Qt.ControlModifier:
             self.save_points_to_csv()
+        elif event.modifiers() & Qt.ControlModifier and (
+                event.key() == Qt.Key_Y or (event.key() == Qt.Key_Z and event.modifiers() & Qt.ShiftModifier)):
+            self.history_changed(self.history.redo(), "重做")
         elif event.key() == Qt.Key_Z and event.modifiers() & Qt.ControlModifier:
-            if self.image_label1.points and self.image_label2.points:
-                if len(self.image_label1.points) > len(self.image_label2.points):
-                    self.image_label1.points.pop()
-                elif len(self.image_label2.points) > len(self.image_label1.points):
-                    self.image_label2.points.pop()
-                else:
-                    self.image_label1.points.pop()
-                    self.image_label2.points.pop()
-                self.image_label1.update()
-                self.image_label2.update()
+            self.history_changed(self.history.undo(), "撤销")
 
-    def mousePressEvent(self, event):
-        if not self.check_button.isChecked():
-            if event.button() == Qt.LeftButton:
-                pos = self.mapFromGlobal(event.globalPos())
-                
-                # Check if click is in scroll area 1
-                scroll_pos1 = self.scroll_area1.mapFromParent(pos)
-                if self.scroll_area1.rect().contains(scroll_pos1) and self.left_turn:
-                    # Convert to ImageLabel coordinates
-                    local_pos = self.image_label1.mapFrom(self.scroll_area1, scroll_pos1)
-                    
-                    # Consider scrollbar positions
-                    scroll_x = self.scroll_area1.horizontalScrollBar().value()
-                    scroll_y = self.scroll_area1.verticalScrollBar().value()
-                    
-                    # Adjust position with scroll
-                    local_pos.setX(local_pos.x() + scroll_x)
-                    local_pos.setY(local_pos.y() + scroll_y)
-                    
-                    # Convert to original image coordinates
-                    raw_x = local_pos.x() / self.image_label1.scale_factor
-                    raw_y = local_pos.y() / self.image_label1.scale_factor
-                    
-                    # Check if the point is within the image
-                    if 0 <= raw_x < self.image_label1.image.width() / self.image_label1.scale_factor and \
-                       0 <= raw_y < self.image_label1.image.height() / self.image_label1.scale_factor:
-                        mapped_point = QPoint(int(raw_x), int(raw_y))
-                        self.image_label1.points.append(mapped_point)
-                        self.image_label1.update()
-                        self.left_turn = False
-                        self.saved = False
-                
-                # Check if click is in scroll area 2
-                scroll_pos2 = self.scroll_area2.mapFromParent(pos)
-                if self.scroll_area2.rect().contains(scroll_pos2) and not self.left_turn:
-                    # Convert to ImageLabel coordinates
-                    local_pos = self.image_label2.mapFrom(self.scroll_area2, scroll_pos2)
-                    
-                    # Consider scrollbar positions
-                    scroll_x = self.scroll_area2.horizontalScrollBar().value()
-                    scroll_y = self.scroll_area2.verticalScrollBar().value()
-                    
-                    # Adjust position with scroll
-                    local_pos.setX(local_pos.x() + scroll_x)
-                    local_pos.setY(local_pos.y() + scroll_y)
-                    
-                    # Convert to original image coordinates
-                    raw_x = local_pos.x() / self.image_label2.scale_factor
-                    raw_y = local_pos.y() / self.image_label2.scale_factor
-                    
-                    # Check if the point is within the image
-                    if 0 <= raw_x < self.image_label2.image.width() / self.image_label2.scale_factor and \
-                       0 <= raw_y < self.image_label2.image.height() / self.image_label2.scale_factor:
-                        mapped_point = QPoint(int(raw_x), int(raw_y))
-                        self.image_label2.points.append(mapped_point)
-                        self.image_label2.update()
-                        self.left_turn = True
-                        self.saved = False
+    def history_changed(self, command, action):
+        """撤销/重做之后同步轮到哪幅图标注、检查模式的位置和按钮状态"""
+        if command is None:
+            return
+        self.left_turn = not self.store.has_pending()
+        count = self.store.side_count(RIGHT)
+        if self.check_button.isChecked():
+            checking = min(self.image_label1.checking, max(count - 1, 0))
+            self.image_label1.checking = checking
+            self.image_label2.checking = checking
+            self.check_prev_button.setEnabled(checking > 0)
+            self.check_next_button.setEnabled(checking < count - 1)
+            self.delete_button.setEnabled(count > 0)
+        self.image_label1.viewport().update()
+        self.image_label2.viewport().update()
+        self.overview.update()
+        self.statusBar().showMessage(f"{action}：{command.text}")
 
     def __check_mode(self):
         if self.check_button.isChecked():
-            if self.image_label1.checking < len(self.image_label1.points) - 1:
+            if self.image_label1.checking < self.store.side_count(RIGHT) - 1:
                 self.check_next_button.setEnabled(True)
-            if len(self.image_label1.points):
+            if self.store.side_count(RIGHT):
                 self.delete_button.setEnabled(True)
 
             self.image_label1.checking = 0
@@ -652,8 +1900,8 @@ class MainWindow(QMainWindow):
             self.image_label1.checkMode = True
             self.image_label2.checkMode = True
 
-            self.image_label1.update()
-            self.image_label2.update()
+            self.image_label1.viewport().update()
+            self.image_label2.viewport().update()
 
         else:
             self.check_prev_button.setEnabled(False)
@@ -662,72 +1910,82 @@ class MainWindow(QMainWindow):
             self.image_label1.checkMode = False
             self.image_label2.checkMode = False
 
-            self.image_label1.update()
-            self.image_label2.update()
+            self.image_label1.viewport().update()
+            self.image_label2.viewport().update()
 
     def __check_next(self):
         self.image_label1.checking += 1
         self.image_label2.checking += 1
-        self.image_label1.update()
-        self.image_label2.update()
+        self.image_label1.viewport().update()
+        self.image_label2.viewport().update()
         self.check_prev_button.setEnabled(True)
-        if self.image_label1.checking >= len(self.image_label1.points) - 1:
+        if self.image_label1.checking >= self.store.side_count(RIGHT) - 1:
             self.check_next_button.setEnabled(False)
 
     def __check_prev(self):
         self.image_label1.checking -= 1
         self.image_label2.checking -= 1
-        self.image_label1.update()
-        self.image_label2.update()
+        self.image_label1.viewport().update()
+        self.image_label2.viewport().update()
         self.check_next_button.setEnabled(True)
         if not self.image_label1.checking:
             self.check_prev_button.setEnabled(False)
 
+    def select_pair(self, idx):
+        """检查模式下直接跳到第 idx 对点"""
+        if not 0 <= idx < self.store.side_count(RIGHT):
+            return
+        self.image_label1.checking = idx
+        self.image_label2.checking = idx
+        self.check_prev_button.setEnabled(idx > 0)
+        self.check_next_button.setEnabled(idx < self.store.side_count(RIGHT) - 1)
+        self.image_label1.viewport().update()
+        self.image_label2.viewport().update()
+
     def __delete(self):
-        self.image_label1.points.pop(self.image_label1.checking)
-        self.image_label2.points.pop(self.image_label2.checking)
+        if self.image_label1.checking >= self.store.side_count(RIGHT):
+            return
+        self.history.push(DeletePairs(self.store, self.image_label1.checking))
 
         if self.image_label1.checking:
             self.image_label1.checking -= 1
             self.image_label2.checking -= 1
 
-        if len(self.image_label1.points) == 0:
+        if self.store.side_count(RIGHT) == 0:
             self.delete_button.setEnabled(False)
 
-        if self.image_label1.checking >= len(self.image_label1.points) - 1:
+        if self.image_label1.checking >= self.store.side_count(RIGHT) - 1:
             self.check_next_button.setEnabled(False)
 
         if not self.image_label1.checking:
             self.check_prev_button.setEnabled(False)
 
-        self.image_label1.update()
-        self.image_label2.update()
+        self.image_label1.viewport().update()
+        self.image_label2.viewport().update()
+        self.overview.update()
 
     # 添加新方法用于从子控件中添加点
     def add_point_to_left(self, point):
-        self.image_label1.points.append(point)
-        self.image_label1.update()
+        self.history.push(AddLeft(point.x(), point.y()))
+        self.image_label1.viewport().update()
         self.left_turn = False
-        self.saved = False
         
     def add_point_to_right(self, point):
-        self.image_label2.points.append(point)
-        self.image_label2.update()
+        self.history.push(SetRight(point.x(), point.y()))
+        self.image_label2.viewport().update()
+        self.overview.update()
         self.left_turn = True
-        self.saved = False
+
+    def point_moved(self, side, index, old, new):
+        # 拖动过程中点已经实时移动，这里只记入历史
+        self.history.push(MovePoint(side, index, old, new), applied=True)
+        self.image_label1.viewport().update()
+        self.image_label2.viewport().update()
 
     # 判断点集是否有变化
     def points_changed(self):
-        # 数量不同则肯定有变化
-        if len(self.image_label1.points) != len(self.original_points1) or len(self.image_label2.points) != len(self.original_points2):
-            return True
-            
-        # 比较每个点是否有变化
-        for i in range(len(self.image_label1.points)):
-            if self.image_label1.points[i] != self.original_points1[i] or self.image_label2.points[i] != self.original_points2[i]:
-                return True
-                
-        return False
+        # revision 相同直接返回；不同时再比较内容摘要，添加后又撤销不算变化
+        return self.store.is_dirty(check_content=True)
 
     def set_grid_size_from_input(self):
         text = self.grid_size_input.text().strip()
@@ -736,11 +1994,46 @@ class MainWindow(QMainWindow):
             if size > 0:
                 self.image_label1.grid_size = size
                 self.image_label2.grid_size = size
-                self.image_label1.update()
-                self.image_label2.update()
+                self.image_label1.viewport().update()
+                self.image_label2.viewport().update()
         except Exception:
             QMessageBox.warning(self, "输入错误", "请输入大于0的整数作为网格尺寸！")
 
+    def set_cache_budget_from_input(self):
+        text = self.cache_size_input.text().strip()
+        try:
+            size = int(text)
+            if size <= 0:
+                raise ValueError(text)
+        except ValueError:
+            QMessageBox.warning(self, "输入错误", "请输入大于0的整数作为缓存上限(MB)！")
+            return
+        self.prefetcher.set_budget_mb(size)
+        for label in (self.image_label1, self.image_label2):
+            if label.scene is not None:
+                label.scene.cache.set_budget_mb(size)
+        self.statusBar().showMessage(self.prefetcher.stats())
+
+    def closeEvent(self, event):
+        # 与切换图片一样先确认：保存、放弃（日志中的修改也不再恢复）或取消退出
+        if not self.confirm_leave():
+            event.ignore()
+            return
+        self.compact_timer.stop()
+        if self.journal:
+            # 等后台写完排队中的保存
+            self.journal.close()
+            self.journal = None
+        if self.database is not None:
+            self.database.close()
+            self.database = None
+        self.prefetcher.shutdown()
+        self.overview.thumbs.shutdown()
+        self.thumbnail_model.shutdown()
+        self.image_label1.set_scene(None)
+        self.image_label2.set_scene(None)
+        super().closeEvent(event)
+
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
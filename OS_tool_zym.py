@@ -11,6 +11,9 @@ from PyQt5.QtGui import QIcon
 
 from PIL import Image
 
+from label_io import read_points_csv
+from dataset_catalog import DatasetCatalog
+
 
 class ImageLabel(QLabel):
     def __init__(self, parent=None):
@@ -149,24 +152,12 @@ class MainWindow(QMainWindow):
             return
 
         try:
-            with open(csv_path, 'r', newline='') as file:
-                reader = csv.reader(file)
-                rows = list(reader)
-
-                # 自动跳过前几行标题
-                start_idx = 0
-                for i, row in enumerate(rows):
-                    if row and row[0] == 'ID':
-                        start_idx = i + 1
-                        break
-
-                self.image_label1.points.clear()
-                self.image_label2.points.clear()
-                for row in rows[start_idx:]:
-                    if len(row) >= 5:
-                        x1, y1, x2, y2 = map(int, row[1:5])
-                        self.image_label1.points.append(QPoint(x1, y1))
-                        self.image_label2.points.append(QPoint(x2, y2))
+            rows = read_points_csv(csv_path)
+            self.image_label1.points.clear()
+            self.image_label2.points.clear()
+            for x1, y1, x2, y2 in rows.tolist():
+                self.image_label1.points.append(QPoint(x1, y1))
+                self.image_label2.points.append(QPoint(x2, y2))
 
             self.image_label1.update()
             self.image_label2.update()
@@ -180,11 +171,16 @@ class MainWindow(QMainWindow):
         self.sar_dir = QFileDialog.getExistingDirectory(self, "选择SAR文件夹")
         if not self.opt_dir or not self.sar_dir:
             return
-        # 根据文件修改时间排序
-        self.image_list = sorted(
-            list(set(os.listdir(self.opt_dir)).intersection(set(os.listdir(self.sar_dir)))),
-            key=lambda x: os.path.getmtime(os.path.join(self.opt_dir, x))
-        )
+        # 根据文件修改时间排序：一次 scandir 取得文件属性，不再逐个 getmtime；只保留文件名完全相同的图像对
+        catalog = DatasetCatalog(self.opt_dir, self.sar_dir)
+        catalog.load()
+        catalog.refresh()
+        sar_names = catalog.sar_names()
+        self.image_list = [name for name in catalog.names() if sar_names[name] == name]
+        try:
+            catalog.save()
+        except OSError:
+            pass
         self.current_index = 0
         self.load_current_image()
 
@@ -207,22 +203,9 @@ class MainWindow(QMainWindow):
             csv_path = os.path.join(self.save_dir, csv_name)
             if os.path.exists(csv_path):
                 try:
-                    with open(csv_path, 'r', newline='') as file:
-                        reader = csv.reader(file)
-                        rows = list(reader)
-
-                        # 自动跳过前几行标题
-                        start_idx = 0
-                        for i, row in enumerate(rows):
-                            if row and row[0] == 'ID':
-                                start_idx = i + 1
-                                break
-
-                        for row in rows[start_idx:]:
-                            if len(row) >= 5:
-                                x1, y1, x2, y2 = map(int, row[1:5])
-                                self.image_label1.points.append(QPoint(x1, y1))
-                                self.image_label2.points.append(QPoint(x2, y2))
+                    for x1, y1, x2, y2 in read_points_csv(csv_path).tolist():
+                        self.image_label1.points.append(QPoint(x1, y1))
+                        self.image_label2.points.append(QPoint(x2, y2))
                 except Exception as e:
                     QMessageBox.warning(self, "读取标注失败", f"无法读取标注文件：\n{str(e)}")
 
@@ -0,0 +1,99 @@
+"""
+标注 CSV 读取的性能测试
+
+对比原来的 csv.reader 逐行读取、label_io.read_points_csv 逐个读取、read_points_dir 线程池读取整个目录，
+以及从二进制 sidecar（label_sidecar，会在目录中生成 points.lbl）读取的吞吐量。
+不指定目录时在临时目录中生成一批随机标注文件：
+    python bench_label_io.py                       # 生成 5000 个文件，每个 25 对点
+    python bench_label_io.py --files 20000 --rows 50
+    python bench_label_io.py --dir Dataset_Label_Test1_1024x1024/Label
+"""
+import argparse
+import csv
+import glob
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from label_io import CSV_SUFFIX, read_points_csv, read_points_dir, write_points_csv
+from label_sidecar import load_points_dir, update_sidecar
+
+
+def make_dataset(directory, files, rows, tile=1024):
+    rng = np.random.default_rng(0)
+    side = int(np.ceil(np.sqrt(files)))
+    for i in range(files):
+        x, y = (i % side) * tile, (i // side) * tile
+        points = rng.integers(0, tile, size=(rows, 4))
+        write_points_csv(os.path.join(directory, f"tile_{x}_{y}{CSV_SUFFIX}"), points,
+                         f"OPT/tile_{x}_{y}.png", f"SAR/tile_{x}_{y}.png")
+
+
+def read_with_csv_module(paths):
+    # 原来界面中的读取方式：csv.reader 读成列表，找到 ID 行后逐行 map(int, ...)
+    total = 0
+    for path in paths:
+        with open(path, 'r', newline='') as file:
+            rows = list(csv.reader(file))
+        start_idx = 0
+        for i, row in enumerate(rows):
+            if row and row[0] == 'ID':
+                start_idx = i + 1
+                break
+        points = [tuple(map(int, row[1:5])) for row in rows[start_idx:] if len(row) >= 5]
+        total += len(points)
+    return total
+
+
+def read_one_by_one(paths):
+    return sum(len(read_points_csv(path)) for path in paths)
+
+
+def read_directory(directory, workers):
+    return sum(len(rows) for rows in read_points_dir(directory, workers).values())
+
+
+def read_sidecar(directory):
+    return sum(len(rows) for rows in load_points_dir(directory).values())
+
+
+def run(name, func, files):
+    start = time.perf_counter()
+    rows = func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<22}{elapsed * 1000:9.1f} ms {files / elapsed:10.0f} 文件/s {rows / elapsed:12.0f} 点对/s")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="标注 CSV 读取性能测试")
+    parser.add_argument("--dir", help="已有的标注目录；不指定则生成临时数据")
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--rows", type=int, default=25)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.dir
+        if directory is None:
+            directory = tmp
+            make_dataset(directory, args.files, args.rows)
+        paths = sorted(glob.glob(os.path.join(directory, "*" + CSV_SUFFIX)))
+        print(f"{directory}: {len(paths)} 个标注文件")
+        update_sidecar(directory)
+
+        for i in range(args.repeat):
+            print(f"--- 第 {i + 1} 轮")
+            expected = run("csv.reader", lambda: read_with_csv_module(paths), len(paths))
+            got = [run("read_points_csv", lambda: read_one_by_one(paths), len(paths)),
+                   run(f"read_points_dir x{args.workers}", lambda: read_directory(directory, args.workers), len(paths)),
+                   run("sidecar", lambda: read_sidecar(directory), len(paths))]
+            if any(count != expected for count in got):
+                raise SystemExit("读取结果不一致")
+
+
+if __name__ == '__main__':
+    main()
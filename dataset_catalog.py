@@ -0,0 +1,323 @@
+"""
+OPT/SAR 数据集目录（catalog）
+
+打开数据集时不再对每个文件单独 getmtime，而是用 os.scandir 一次列出两个目录（Windows 上文件属性随目录项一起返回，
+网络共享也只需一次目录枚举），按去掉扩展名后的文件名配对，按 OPT 文件的修改时间排序。
+每个图像对的 mtime、大小、图像信息（image_probe 只读文件头得到的宽、高、位深、通道数），
+以及保存目录中对应标注 CSV 的点对数，缓存在 ~/.os_tool/catalog/ 下的 JSON 中：
+再次打开同一对目录时直接用缓存的列表显示第一张图，然后在后台线程重新扫描，只为有变化的文件读取文件头和标注。
+
+命令行下可以用缓存的图像尺寸检查整个标注目录中是否有点落在切片范围之外：
+    python dataset_catalog.py OPT SAR Label
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from image_probe import ImageInfo, probe
+from label_io import CSV_SUFFIX, read_points_csv
+from label_sidecar import load_points_dir
+
+
+CATALOG_DIR = os.path.join(os.path.expanduser("~"), ".os_tool", "catalog")
+CATALOG_VERSION = 2
+
+# 支持的图像扩展名（OPT/SAR 按去掉扩展名后的文件名配对）
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.npy')
+
+# 图像对的字段；图像信息为 [宽, 高, 位深, 通道数]，尚未读取为 None，无法识别为 []
+SAR_NAME, OPT_MTIME, OPT_SIZE, SAR_MTIME, SAR_SIZE, OPT_INFO, SAR_INFO = range(7)
+# 标注的字段
+LABEL_MTIME, LABEL_SIZE, LABEL_COUNT = range(3)
+
+# 读取文件头的线程数（网络共享上主要是等待往返）
+PROBE_WORKERS = 8
+
+
+def _probe_info(path):
+    try:
+        return list(probe(path))
+    except (OSError, ValueError):
+        return []
+
+
+def _scan_images(directory):
+    """{文件名: (mtime_ns, 大小)}"""
+    found = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                stat = entry.stat()
+                found[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    return found
+
+
+class DatasetCatalog:
+    def __init__(self, opt_dir, sar_dir, cache_dir=CATALOG_DIR):
+        self.opt_dir = opt_dir
+        self.sar_dir = sar_dir
+        key = hashlib.blake2b(f"{os.path.abspath(opt_dir)}\n{os.path.abspath(sar_dir)}".encode("utf-8"),
+                              digest_size=8).hexdigest()
+        self.path = os.path.join(cache_dir, f"catalog_{key}.json")
+        self.label_dir = ""
+        self._pairs = {}  # OPT 文件名 -> [SAR 文件名, OPT mtime, OPT 大小, SAR mtime, SAR 大小, OPT 信息, SAR 信息]
+        self._labels = {}  # 切片名 -> [CSV mtime, CSV 大小, 点对数]
+        # 界面线程读取、后台线程刷新，替换整个字典时加锁
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        # 后台刷新同一时间只有一个线程在跑，运行期间的新请求合并为下一轮
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+        self._requested = False  # 有尚未开始的刷新请求
+        self._requested_images = False
+        self._callbacks = []
+
+    # ---- 读取（界面线程） ----
+
+    def names(self):
+        """配对成功的 OPT 文件名，按 OPT 的修改时间排序"""
+        with self._lock:
+            pairs = self._pairs
+        return sorted(pairs, key=lambda name: (pairs[name][OPT_MTIME], name))
+
+    def sar_names(self):
+        """{OPT 文件名: 同名（扩展名可不同）的 SAR 文件名}"""
+        with self._lock:
+            return {name: pair[SAR_NAME] for name, pair in self._pairs.items()}
+
+    def image_info(self, name):
+        """(OPT 的 ImageInfo, SAR 的 ImageInfo)，尚未读取或无法识别时为 None"""
+        with self._lock:
+            pair = self._pairs.get(name)
+        if not pair:
+            return None, None
+        return tuple(ImageInfo(*info) if info else None for info in (pair[OPT_INFO], pair[SAR_INFO]))
+
+    def point_count(self, name):
+        """保存目录中该图像对的标注点对数，没有标注文件时返回 None"""
+        with self._lock:
+            label = self._labels.get(os.path.splitext(name)[0])
+        return label[LABEL_COUNT] if label else None
+
+    # ---- 缓存文件 ----
+
+    def load(self):
+        """读取缓存的目录，成功返回 True"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            if (data.get("version") != CATALOG_VERSION or data.get("opt_dir") != os.path.abspath(self.opt_dir)
+                    or data.get("sar_dir") != os.path.abspath(self.sar_dir)):
+                return False
+            with self._lock:
+                self._pairs = data["pairs"]
+                self.label_dir = data.get("label_dir", "")
+                self._labels = data.get("labels", {})
+        except (OSError, ValueError, KeyError):
+            return False
+        return True
+
+    def save(self):
+        with self._lock:
+            data = {"version": CATALOG_VERSION, "opt_dir": os.path.abspath(self.opt_dir),
+                    "sar_dir": os.path.abspath(self.sar_dir), "pairs": self._pairs,
+                    "label_dir": self.label_dir, "labels": self._labels}
+            text = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        # 临时文件名带进程号和线程号：同时打开同一数据集的另一个实例不会写到同一个临时文件
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._save_lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as file:
+                    file.write(text)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    # ---- 刷新 ----
+
+    def refresh(self):
+        """重新扫描两个图像目录，mtime 和大小没变的图像沿用缓存的图像信息；返回列表是否有变化"""
+        opt_files, sar_files = _scan_images(self.opt_dir), _scan_images(self.sar_dir)
+        sar_by_stem = {os.path.splitext(name)[0]: name for name in sar_files}
+        with self._lock:
+            old_pairs = self._pairs
+        pairs = {}
+        for name, (opt_mtime, opt_size) in opt_files.items():
+            sar_name = sar_by_stem.get(os.path.splitext(name)[0])
+            if sar_name is None:
+                continue
+            sar_mtime, sar_size = sar_files[sar_name]
+            old = old_pairs.get(name)
+            opt_info = old[OPT_INFO] if old and old[OPT_MTIME:OPT_SIZE + 1] == [opt_mtime, opt_size] else None
+            sar_info = (old[SAR_INFO] if old and old[SAR_NAME] == sar_name
+                        and old[SAR_MTIME:SAR_SIZE + 1] == [sar_mtime, sar_size] else None)
+            pairs[name] = [sar_name, opt_mtime, opt_size, sar_mtime, sar_size, opt_info, sar_info]
+        changed = (pairs.keys() != old_pairs.keys()
+                   or any(pairs[name][:OPT_MTIME + 1] != old_pairs[name][:OPT_MTIME + 1] for name in pairs))
+        with self._lock:
+            self._pairs = pairs
+        return changed
+
+    def probe(self, workers=PROBE_WORKERS):
+        """为尚未读取的图像读取文件头（线程池并行），返回读取的图像数"""
+        with self._lock:
+            jobs = [(pair, field, os.path.join(directory, filename))
+                    for name, pair in self._pairs.items()
+                    for field, directory, filename in ((OPT_INFO, self.opt_dir, name),
+                                                       (SAR_INFO, self.sar_dir, pair[SAR_NAME]))
+                    if pair[field] is None]
+        if not jobs:
+            return 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            infos = pool.map(_probe_info, [path for _, _, path in jobs])
+            # 列表元素原地更新，界面线程只会读到 None 或完整的图像信息
+            for (pair, field, _), info in zip(jobs, infos):
+                pair[field] = info
+        return len(jobs)
+
+    def set_label_dir(self, label_dir):
+        """切换标注保存目录，原来目录的标注状态作废"""
+        with self._lock:
+            if label_dir != self.label_dir:
+                self.label_dir = label_dir
+                self._labels = {}
+
+    def refresh_labels(self):
+        """扫描保存目录中的 *_points.csv，只重新读取有变化的文件；返回标注状态是否有变化"""
+        label_dir = self.label_dir
+        if not label_dir or not os.path.isdir(label_dir):
+            return False
+        with self._lock:
+            old_labels = self._labels
+        labels = {}
+        with os.scandir(label_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(CSV_SUFFIX):
+                    continue
+                stat = entry.stat()
+                name = entry.name[:-len(CSV_SUFFIX)]
+                old = old_labels.get(name)
+                if old and old[LABEL_MTIME:LABEL_SIZE + 1] == [stat.st_mtime_ns, stat.st_size]:
+                    labels[name] = old
+                    continue
+                try:
+                    count = len(read_points_csv(entry.path))
+                except (OSError, ValueError):
+                    continue
+                labels[name] = [stat.st_mtime_ns, stat.st_size, count]
+        with self._lock:
+            if label_dir != self.label_dir:
+                return False  # 扫描期间已切换保存目录
+            changed = labels != self._labels
+            self._labels = labels
+        return changed
+
+    def refresh_in_background(self, callback=None, images=True):
+        """
+        在后台线程中依次刷新图像列表、标注状态和图像尺寸并写回缓存；images=False 时只刷新标注状态（标注目录有变化时）。
+        完成后调用 callback(catalog, 列表是否有变化)，界面可传入 pyqtSignal.emit。
+        刷新一次只跑一个：已有刷新在进行时本次请求合并到它结束后的下一轮，结果按请求顺序送达，
+        旧的结果不会在新的之后到达。返回新启动的线程，合并到正在运行的刷新时返回 None。
+        """
+        with self._refresh_lock:
+            self._requested = True
+            self._requested_images = self._requested_images or images
+            if callback is not None and callback not in self._callbacks:
+                self._callbacks.append(callback)
+            if self._refreshing:
+                return None
+            self._refreshing = True
+        thread = threading.Thread(target=self._refresh_loop, name="dataset-catalog", daemon=True)
+        thread.start()
+        return thread
+
+    def _refresh_loop(self):
+        # 任何异常都不能让线程带着 _refreshing=True 退出，否则之后的刷新请求都只会被合并、永远不再执行
+        try:
+            while True:
+                with self._refresh_lock:
+                    images, callbacks = self._requested_images, self._callbacks
+                    self._requested, self._requested_images, self._callbacks = False, False, []
+                changed = False
+                try:
+                    if images:
+                        changed = self.refresh()
+                    self.refresh_labels()
+                    if images:
+                        self.probe()
+                    self.save()
+                except OSError:
+                    pass
+                except Exception as e:
+                    print(f"数据集目录刷新失败: {e!r}", file=sys.stderr)
+                for callback in callbacks:
+                    try:
+                        callback(self, changed)
+                    except Exception as e:
+                        print(f"数据集目录刷新回调失败: {e!r}", file=sys.stderr)
+                with self._refresh_lock:
+                    # 与检查 _requested 在同一把锁内清除，刚合并进来的请求不会落空
+                    if not self._requested:
+                        self._refreshing = False
+                        return
+        except BaseException:
+            with self._refresh_lock:
+                self._refreshing = False
+            raise
+
+
+def check_bounds(catalog, label_dir):
+    """
+    检查 label_dir 中每个标注点是否落在对应切片图像内（左图点对 OPT、右图点对 SAR），
+    图像尺寸取自目录缓存。返回 (越界列表 [(切片名, ID, 'left'/'right', x, y, 宽, 高)], 找不到图像的切片名列表)
+    """
+    by_stem = {os.path.splitext(name)[0]: name for name in catalog.names()}
+    problems, missing = [], []
+    for tile, rows in load_points_dir(label_dir).items():
+        infos = catalog.image_info(by_stem[tile]) if tile in by_stem else (None, None)
+        if infos[0] is None or infos[1] is None:
+            if len(rows):
+                missing.append(tile)
+            continue
+        for side, columns, info in (("left", slice(0, 2), infos[0]), ("right", slice(2, 4), infos[1])):
+            xy = rows[:, columns]
+            bad = np.flatnonzero((xy[:, 0] < 0) | (xy[:, 0] >= info.width) | (xy[:, 1] < 0) | (xy[:, 1] >= info.height))
+            problems.extend((tile, int(i) + 1, side, int(xy[i, 0]), int(xy[i, 1]), info.width, info.height)
+                            for i in bad)
+    return problems, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用缓存的切片尺寸检查标注点是否越界")
+    parser.add_argument("opt_dir")
+    parser.add_argument("sar_dir")
+    parser.add_argument("label_dir")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    catalog = DatasetCatalog(args.opt_dir, args.sar_dir)
+    catalog.load()
+    catalog.refresh()
+    probed = catalog.probe()
+    catalog.save()
+    problems, missing = check_bounds(catalog, args.label_dir)
+    for tile, point_id, side, x, y, width, height in problems:
+        print(f"{tile} ID {point_id} {'左' if side == 'left' else '右'}图点 ({x}, {y}) 超出 {width}x{height}")
+    for tile in missing:
+        print(f"{tile}: 找不到对应的切片图像或无法读取尺寸")
+    print(f"共 {len(catalog.names())} 对图像（读取文件头 {probed} 个），越界点 {len(problems)} 个，"
+          f"缺少图像的标注 {len(missing)} 个（{time.perf_counter() - start:.2f} s）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+只读文件头的图像信息探测
+
+从 PNG / JPEG / TIFF / BMP / .npy 的文件头读取宽、高、位深和通道数，不解码像素：
+PNG、BMP、.npy 只读开头几十到几百字节，TIFF 只读第一个 IFD，JPEG 逐段跳到 SOF 段为止。
+按文件开头的魔数识别格式，不依赖扩展名。数据集目录（dataset_catalog）用它缓存每张切片的尺寸：
+    python image_probe.py OPT/tile_0_0.png SAR/tile_0_0.tif
+"""
+import os
+import struct
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from raster_io import read_tiff_tags
+
+
+# bits 为每个通道的位数
+ImageInfo = namedtuple("ImageInfo", ["width", "height", "bits", "channels"])
+
+# PNG 颜色类型 -> 通道数
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+# JPEG 中带尺寸的 SOF 段（排除 DHT、JPG、DAC）
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def probe(path):
+    """返回 ImageInfo；不是支持的格式或文件头损坏时抛出 ValueError"""
+    try:
+        return _probe(path)
+    except struct.error as e:
+        raise ValueError(f"文件头不完整: {path}") from e
+
+
+def _probe(path):
+    with open(path, 'rb') as file:
+        head = file.read(32)
+        if head.startswith(b'\x89PNG\r\n\x1a\n'):
+            return _probe_png(head, path)
+        if head.startswith(b'\xff\xd8'):
+            return _probe_jpeg(file, path)
+        if head.startswith(b'BM'):
+            return _probe_bmp(file, path)
+        if head.startswith(b'\x93NUMPY'):
+            file.seek(0)
+            return _probe_npy(file)
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return _probe_tiff(path)
+    raise ValueError(f"无法识别的图像格式: {path}")
+
+
+def probe_size(path):
+    """(宽, 高)；无法识别时返回 None"""
+    try:
+        info = probe(path)
+    except (OSError, ValueError):
+        return None
+    return info.width, info.height
+
+
+def _probe_png(head, path):
+    # 签名之后第一段必须是 IHDR
+    if head[12:16] != b'IHDR' or len(head) < 26:
+        raise ValueError(f"PNG 文件头损坏: {path}")
+    width, height, bits, color = struct.unpack('>IIBB', head[16:26])
+    return ImageInfo(width, height, bits, _PNG_CHANNELS.get(color, 1))
+
+
+def _probe_jpeg(file, path):
+    file.seek(2)
+    while True:
+        marker = file.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            raise ValueError(f"JPEG 中找不到 SOF 段: {path}")
+        code = marker[1]
+        if code == 0xFF:
+            file.seek(-1, os.SEEK_CUR)  # 填充字节
+            continue
+        if code == 0x01 or 0xD0 <= code <= 0xD7:
+            continue  # 没有长度字段的标记
+        if code == 0xDA:
+            raise ValueError(f"JPEG 在 SOS 之前没有 SOF 段: {path}")  # 之后是压缩数据
+        length = struct.unpack('>H', file.read(2))[0]
+        if code in _JPEG_SOF:
+            bits, height, width, channels = struct.unpack('>BHHB', file.read(6))
+            return ImageInfo(width, height, bits, channels)
+        file.seek(length - 2, os.SEEK_CUR)
+
+
+def _probe_bmp(file, path):
+    file.seek(14)
+    size = struct.unpack('<I', file.read(4))[0]
+    if size == 12:  # OS/2 BITMAPCOREHEADER
+        width, height, _, bpp = struct.unpack('<HHHH', file.read(8))
+    elif size >= 40:
+        width, height, _, bpp = struct.unpack('<iiHH', file.read(12))
+    else:
+        raise ValueError(f"BMP 文件头损坏: {path}")
+    channels = bpp // 8 if bpp >= 24 else 1
+    return ImageInfo(abs(width), abs(height), 8 if bpp >= 8 else bpp, channels)
+
+
+def _probe_npy(file):
+    version = np.lib.format.read_magic(file)
+    if version == (1, 0):
+        shape, _, dtype = np.lib.format.read_array_header_1_0(file)
+    else:
+        shape, _, dtype = np.lib.format.read_array_header_2_0(file)
+    if len(shape) not in (2, 3):
+        raise ValueError(f".npy 不是 (H, W) 或 (H, W, C) 的数组: {shape}")
+    return ImageInfo(shape[1], shape[0], dtype.itemsize * 8, shape[2] if len(shape) == 3 else 1)
+
+
+def _probe_tiff(path):
+    _, tags = read_tiff_tags(path)
+    if 'width' not in tags or 'height' not in tags:
+        raise ValueError(f"TIFF 缺少尺寸标签: {path}")
+    return ImageInfo(tags['width'][0], tags['height'][0], tags.get('bits', (1,))[0], tags.get('samples', (1,))[0])
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("用法: python image_probe.py 图像文件 ...", file=sys.stderr)
+        sys.exit(2)
+    for path in sys.argv[1:]:
+        try:
+            info = probe(path)
+        except (OSError, ValueError) as e:
+            print(f"{path}: {e}")
+            continue
+        print(f"{path}: {info.width}x{info.height}, {info.bits} 位, {info.channels} 通道")
+
+
+if __name__ == '__main__':
+    main()
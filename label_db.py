@@ -0,0 +1,283 @@
+"""
+SQLite 标注项目库
+
+把一个保存目录下所有切片的标注放进单个数据库文件，打开、保存、跨切片查询只需一个文件句柄：
+    tiles    每个切片一行（名称、左右图像名、切片在场景中的偏移）
+    pairs    每个点对一行，主键 (tile_id, idx)；带偏移的切片另存左图点的全局坐标并建索引，便于按范围查询
+             （场景模式的 tile_all 等没有偏移的切片不算全局坐标，不会和各切片的点重复出现在查询结果里）
+    history  每次保存中新增、修改、删除的点对，与修改本身在同一个事务中写入；
+             新旧点集按内容对齐，删掉第 1 对只记一条 delete，不会把后面顺移的点对都记成 update
+
+保存时只比较并写入有变化的点对（逐对 upsert）。可以从现有的 *_points.csv 导入，也可以导出回同样的 CSV 格式：
+    python label_db.py import Label Label/labels.db
+    python label_db.py export Label/labels.db Label_export
+    python label_db.py counts Label/labels.db                     # 每个切片的点对数
+    python label_db.py query Label/labels.db 0 0 2048 2048        # 按左图全局坐标范围查点对
+    python label_db.py history Label/labels.db --tile tile_0_0    # 最近的修改记录
+"""
+import argparse
+import difflib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from label_io import CSV_SUFFIX, parse_tile_offset, read_csv_header, read_points_dir, tile_name, write_points_csv
+
+
+DB_NAME = "labels.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    left_image TEXT NOT NULL DEFAULT '',
+    right_image TEXT NOT NULL DEFAULT '',
+    offset_x INTEGER,
+    offset_y INTEGER,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS pairs (
+    tile_id INTEGER NOT NULL REFERENCES tiles(id),
+    idx INTEGER NOT NULL,
+    left_x INTEGER NOT NULL,
+    left_y INTEGER NOT NULL,
+    right_x INTEGER NOT NULL,
+    right_y INTEGER NOT NULL,
+    global_x INTEGER,
+    global_y INTEGER,
+    updated REAL,
+    PRIMARY KEY (tile_id, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS pairs_global ON pairs(global_x, global_y);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    tile_id INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    op TEXT NOT NULL,
+    old TEXT,
+    new TEXT
+);
+CREATE INDEX IF NOT EXISTS history_tile ON history(tile_id, id);
+"""
+
+
+def _pair_text(row):
+    return ",".join(str(int(v)) for v in row)
+
+
+def _diff_history(old, rows, now, tile_id):
+    """
+    按内容对齐新旧点集，返回 history 记录 [(时间, tile_id, 序号, 操作, 旧值, 新值), ...]；
+    update/insert 记新序号，delete 记旧序号
+    """
+    old_pairs = [_pair_text(row) for row in old]
+    new_pairs = [_pair_text(row) for row in rows]
+    history = []
+    matcher = difflib.SequenceMatcher(None, old_pairs, new_pairs, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        common = min(i2 - i1, j2 - j1) if tag == "replace" else 0
+        history.extend((now, tile_id, j1 + k, "update", old_pairs[i1 + k], new_pairs[j1 + k]) for k in range(common))
+        history.extend((now, tile_id, i, "delete", old_pairs[i], None) for i in range(i1 + common, i2))
+        history.extend((now, tile_id, j, "insert", None, new_pairs[j]) for j in range(j1 + common, j2))
+    return history
+
+
+class LabelDatabase:
+    def __init__(self, path):
+        self.path = path
+        self.created = not os.path.exists(path)
+        # 界面线程读取、日志线程写入，共用一个连接并加锁
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ---- 读取 ----
+
+    def _tile_id(self, name):
+        row = self._conn.execute("SELECT id FROM tiles WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def has_tile(self, name):
+        with self._lock:
+            return self._tile_id(name) is not None
+
+    def load(self, name):
+        """返回某个切片的 (N, 4) int32 点对数组，切片不存在时为空数组"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT p.left_x, p.left_y, p.right_x, p.right_y FROM pairs p JOIN tiles t ON p.tile_id = t.id "
+                "WHERE t.name = ? ORDER BY p.idx", (name,)).fetchall()
+        return np.array(rows, dtype=np.int32).reshape(-1, 4)
+
+    def global_rows(self):
+        """所有带偏移的切片的点对，加上偏移换算到全局坐标，(N, 4) int32"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT p.left_x + t.offset_x, p.left_y + t.offset_y, p.right_x + t.offset_x, p.right_y + t.offset_y "
+                "FROM pairs p JOIN tiles t ON p.tile_id = t.id "
+                "WHERE t.offset_x IS NOT NULL ORDER BY t.name, p.idx").fetchall()
+        return np.array(rows, dtype=np.int32).reshape(-1, 4)
+
+    def query(self, left, top, right, bottom):
+        """
+        左图全局坐标落在 [left, right] x [top, bottom] 内的点对，
+        返回 [(切片名, 序号, LeftX, LeftY, RightX, RightY), ...]（切片内坐标）
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT t.name, p.idx, p.left_x, p.left_y, p.right_x, p.right_y "
+                "FROM pairs p JOIN tiles t ON p.tile_id = t.id "
+                "WHERE p.global_x BETWEEN ? AND ? AND p.global_y BETWEEN ? AND ? AND t.offset_x IS NOT NULL "
+                "ORDER BY t.name, p.idx", (left, right, top, bottom)).fetchall()
+
+    def tile_counts(self):
+        """{切片名: 点对数}"""
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT t.name, COUNT(p.idx) FROM tiles t LEFT JOIN pairs p ON p.tile_id = t.id "
+                "GROUP BY t.id ORDER BY t.name").fetchall())
+
+    def history(self, name=None, limit=100):
+        """最近的修改记录 [(时间, 切片名, 序号, 操作, 旧值, 新值), ...]，新的在前"""
+        sql = ("SELECT h.time, t.name, h.idx, h.op, h.old, h.new FROM history h JOIN tiles t ON h.tile_id = t.id "
+               + ("WHERE t.name = ? " if name else "") + "ORDER BY h.id DESC LIMIT ?")
+        with self._lock:
+            return self._conn.execute(sql, ((name, limit) if name else (limit,))).fetchall()
+
+    # ---- 写入 ----
+
+    def save(self, name, rows, left_image, right_image):
+        """保存一个切片的全部点对，只写入有变化的行；返回变化的点对数"""
+        with self._lock, self._conn:
+            return self._save(name, rows, left_image, right_image)
+
+    def _save(self, name, rows, left_image, right_image):
+        rows = np.asarray(rows, dtype=np.int64).reshape(-1, 4)
+        now = time.time()
+        offset = parse_tile_offset(name)
+        ox, oy = offset if offset is not None else (None, None)
+        self._conn.execute(
+            "INSERT INTO tiles (name, left_image, right_image, offset_x, offset_y, updated) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET left_image = excluded.left_image, right_image = excluded.right_image, "
+            "updated = excluded.updated", (name, left_image, right_image, ox, oy, now))
+        tile_id = self._tile_id(name)
+
+        old = np.array(self._conn.execute(
+            "SELECT left_x, left_y, right_x, right_y FROM pairs WHERE tile_id = ? ORDER BY idx",
+            (tile_id,)).fetchall(), dtype=np.int64).reshape(-1, 4)
+        common = min(len(old), len(rows))
+        changed = np.flatnonzero((old[:common] != rows[:common]).any(axis=1)).tolist()
+        changed += list(range(common, len(rows)))
+
+        upserts = []
+        for idx in changed:
+            lx, ly, rx, ry = (int(v) for v in rows[idx])
+            gx, gy = (lx + ox, ly + oy) if offset is not None else (None, None)
+            upserts.append((tile_id, idx, lx, ly, rx, ry, gx, gy, now))
+        # pairs 按序号存放，删掉中间的点对后其后的行都要改写；history 则按内容对齐新旧点集，只记真正的改动
+        history = _diff_history(old, rows, now, tile_id) if changed or len(old) > len(rows) else []
+
+        self._conn.executemany(
+            "INSERT INTO pairs (tile_id, idx, left_x, left_y, right_x, right_y, global_x, global_y, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(tile_id, idx) DO UPDATE SET "
+            "left_x = excluded.left_x, left_y = excluded.left_y, right_x = excluded.right_x, "
+            "right_y = excluded.right_y, global_x = excluded.global_x, global_y = excluded.global_y, "
+            "updated = excluded.updated", upserts)
+        if len(old) > len(rows):
+            self._conn.execute("DELETE FROM pairs WHERE tile_id = ? AND idx >= ?", (tile_id, len(rows)))
+        self._conn.executemany(
+            "INSERT INTO history (time, tile_id, idx, op, old, new) VALUES (?, ?, ?, ?, ?, ?)", history)
+        return len(history)
+
+    # ---- 与 label_io 相同签名的读写，供日志与界面直接替换 CSV ----
+
+    def read(self, csv_path):
+        return self.load(tile_name(csv_path))
+
+    def write(self, csv_path, rows, left_image, right_image):
+        self.save(tile_name(csv_path), rows, left_image, right_image)
+
+    # ---- CSV 导入导出 ----
+
+    def import_csv(self, directory):
+        """导入目录下所有 *_points.csv（并行读取，同一个事务写入），返回导入的切片数"""
+        tiles = read_points_dir(directory)
+        with self._lock, self._conn:
+            for name, rows in tiles.items():
+                left_image, right_image = read_csv_header(os.path.join(directory, name + CSV_SUFFIX))
+                self._save(name, rows, left_image, right_image)
+        return len(tiles)
+
+    def export_csv(self, directory, names=None):
+        """按现有 CSV 格式导出（默认导出全部切片），返回导出的文件数"""
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            tiles = self._conn.execute("SELECT name, left_image, right_image FROM tiles ORDER BY name").fetchall()
+        count = 0
+        for name, left_image, right_image in tiles:
+            if names is not None and name not in names:
+                continue
+            write_points_csv(os.path.join(directory, name + CSV_SUFFIX), self.load(name), left_image, right_image)
+            count += 1
+        return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="标注项目库的 CSV 导入导出与查询")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("import", help="把目录中的 *_points.csv 导入数据库")
+    p.add_argument("csv_dir")
+    p.add_argument("db")
+    p = sub.add_parser("export", help="把数据库导出为 *_points.csv")
+    p.add_argument("db")
+    p.add_argument("csv_dir")
+    p = sub.add_parser("counts", help="列出每个切片的点对数")
+    p.add_argument("db")
+    p = sub.add_parser("query", help="列出左图全局坐标落在范围内的点对（切片内坐标）")
+    p.add_argument("db")
+    for name in ("left", "top", "right", "bottom"):
+        p.add_argument(name, type=int)
+    p = sub.add_parser("history", help="列出最近的修改记录，新的在前")
+    p.add_argument("db")
+    p.add_argument("--tile", help="只看这个切片")
+    p.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.command == "import":
+        db = LabelDatabase(args.db)
+        print(f"已导入 {db.import_csv(args.csv_dir)} 个标注文件到 {args.db}")
+        db.close()
+        return
+    if not os.path.exists(args.db):
+        parser.error(f"数据库不存在: {args.db}")
+    db = LabelDatabase(args.db)
+    if args.command == "export":
+        print(f"已导出 {db.export_csv(args.csv_dir)} 个标注文件到 {args.csv_dir}")
+    elif args.command == "counts":
+        for name, count in db.tile_counts().items():
+            print(f"{name},{count}")
+    elif args.command == "query":
+        print("Tile,ID,LeftX,LeftY,RightX,RightY")
+        for name, idx, *pair in db.query(args.left, args.top, args.right, args.bottom):
+            print(",".join(map(str, [name, idx + 1, *pair])))
+    else:
+        for when, name, idx, op, old, new in db.history(args.tile, args.limit):
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when))}  {name}  #{idx + 1}  {op}  "
+                  f"{old or '-'} -> {new or '-'}")
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+标注编辑的撤销 / 重做
+
+每次编辑记录为一个命令对象，只保存增量（被删除的点对、移动前后的坐标等），不保存整份点集快照。
+历史按估算的内存占用限额，超出时丢弃最早的命令，长时间标注密集切片时内存也保持在限额以内。
+"""
+from collections import deque
+
+import numpy as np
+
+
+# 每个命令对象本身的大致开销（字节）
+COMMAND_OVERHEAD = 200
+
+
+class AddLeft:
+    """新建一对点并标注左图"""
+    text = "添加左图点"
+
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+    def redo(self, store):
+        store.add_left(self.x, self.y)
+
+    def undo(self, store):
+        store.pop()
+
+    def nbytes(self):
+        return COMMAND_OVERHEAD
+
+
+class SetRight:
+    """补上最后一对点的右图点"""
+    text = "添加右图点"
+
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+    def redo(self, store):
+        store.set_right(self.x, self.y)
+
+    def undo(self, store):
+        store.unset_right()
+
+    def nbytes(self):
+        return COMMAND_OVERHEAD
+
+
+class DeletePairs:
+    """删除若干点对，可一次批量删除；检查模式删除单个点对也走这里"""
+    text = "删除点对"
+
+    def __init__(self, store, indices):
+        self.indices = np.unique(np.asarray(indices, dtype=np.intp))
+        self.removed = store.take(self.indices)  # 撤销时原样插回
+
+    def redo(self, store):
+        store.delete(self.indices)
+
+    def undo(self, store):
+        store.insert(self.indices, *self.removed)
+
+    def nbytes(self):
+        return COMMAND_OVERHEAD + self.indices.nbytes + sum(a.nbytes for a in self.removed)
+
+
+class MovePoint:
+    """移动某一侧的一个点"""
+    text = "移动点"
+
+    def __init__(self, side, index, old, new):
+        self.side, self.index = side, index
+        self.old, self.new = tuple(old), tuple(new)
+
+    def redo(self, store):
+        store.move(self.side, self.index, *self.new)
+
+    def undo(self, store):
+        store.move(self.side, self.index, *self.old)
+
+    def nbytes(self):
+        return COMMAND_OVERHEAD
+
+
+class UndoStack:
+    def __init__(self, store, budget_bytes=16 * 1024 * 1024):
+        self.store = store
+        self.budget_bytes = budget_bytes
+        self._undo = deque()
+        self._redo = []
+        self._nbytes = 0
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+        self._nbytes = 0
+
+    def push(self, command, applied=False):
+        """执行命令并记入历史；applied=True 表示修改已经做过（如拖动过程中已实时移动）"""
+        if not applied:
+            command.redo(self.store)
+        self._undo.append(command)
+        self._nbytes += command.nbytes()
+        for dropped in self._redo:
+            self._nbytes -= dropped.nbytes()
+        self._redo.clear()
+        # 超出内存限额时丢弃最早的历史
+        while self._nbytes > self.budget_bytes and len(self._undo) > 1:
+            self._nbytes -= self._undo.popleft().nbytes()
+
+    def undo(self):
+        if not self._undo:
+            return None
+        command = self._undo.pop()
+        command.undo(self.store)
+        self._redo.append(command)
+        return command
+
+    def redo(self):
+        if not self._redo:
+            return None
+        command = self._redo.pop()
+        command.redo(self.store)
+        self._undo.append(command)
+        return command
+
+    def nbytes(self):
+        return self._nbytes
@@ -0,0 +1,145 @@
+"""
+标注 CSV 的读写
+
+文件格式（与标注工具、concat.py 的输出一致）：
+    LeftImage: OPT/tile_0_0.png
+    RightImage: SAR/tile_0_0.png
+    --------------------------------------------------
+    ID,LeftX,LeftY,RightX,RightY
+    1,236,24,260,12
+    ...
+点坐标直接读成 (N, 4) 的 int32 数组 [LeftX, LeftY, RightX, RightY]；
+read_points_dir 用线程池读取整个标注目录。性能测试见 bench_label_io.py。
+"""
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+HEADER_COLUMNS = ["ID", "LeftX", "LeftY", "RightX", "RightY"]
+CSV_SUFFIX = "_points.csv"
+
+# read_points_dir 中每个线程任务读取的文件数
+DIR_CHUNK = 256
+
+
+def parse_tile_offset(filename):
+    """
+    从文件名中提取坐标偏移值
+    例如：从 'tile_0_1024.png' 或 'tile_0_1024_points.csv' 提取 (0, 1024)，不符合命名规则时返回 None
+    """
+    parts = os.path.splitext(filename)[0].split('_')
+    if len(parts) < 3 or parts[0] != 'tile':
+        return None
+    try:
+        return int(parts[1]), int(parts[2])
+    except ValueError:
+        return None
+
+
+def tile_name(csv_path):
+    """'.../tile_0_1024_points.csv' -> 'tile_0_1024'"""
+    name = os.path.basename(csv_path)
+    return name[:-len(CSV_SUFFIX)] if name.endswith(CSV_SUFFIX) else os.path.splitext(name)[0]
+
+
+def read_points_csv(csv_path):
+    """读取标注文件，返回 (N, 4) 的 int32 数组"""
+    with open(csv_path, 'rb') as file:
+        return parse_points(file.read())
+
+
+def parse_points(data):
+    """
+    解析标注文件内容（bytes）。数据区整块切分后一次转换为数组，不逐行构造对象；
+    遇到空行、列数不对等不规整的内容时退回逐行解析。
+    """
+    # 自动跳过前几行标题
+    if data.startswith(b'ID,'):
+        start = 0
+    else:
+        start = data.find(b'\nID,') + 1
+    if start > 0 or data.startswith(b'ID,'):
+        end = data.find(b'\n', start)
+        body = data[end + 1:] if end >= 0 else b''
+    else:
+        body = data
+
+    values = body.replace(b'\r', b'').replace(b'\n', b',').split(b',')
+    if values[-1] == b'':
+        values.pop()
+    if len(values) % 5 == 0:
+        try:
+            return np.array(values, dtype=np.int64).reshape(-1, 5)[:, 1:].astype(np.int32)
+        except ValueError:
+            pass
+    return _parse_points_lines(body)
+
+
+def _parse_points_lines(body):
+    rows = [line.split(b',')[1:5] for line in body.splitlines()]
+    rows = [row for row in rows if len(row) == 4]
+    if not rows:
+        return np.zeros((0, 4), dtype=np.int32)
+    return np.array(rows, dtype=np.int64).astype(np.int32)
+
+
+def read_points_dir(directory, workers=8):
+    """
+    用线程池读取目录下所有 *_points.csv，返回 {切片名: (N, 4) int32 数组}，按切片名排序。
+    文件按块分给各线程，单个文件很小时也不会被任务调度开销拖慢。读取失败的文件抛出异常（附带文件名）。
+    """
+    paths = sorted(glob.glob(os.path.join(directory, "*" + CSV_SUFFIX)))
+    if not paths:
+        return {}
+    workers = max(1, min(workers, len(paths) // DIR_CHUNK + 1))
+    if workers == 1:
+        arrays = _read_points_chunk(paths)
+    else:
+        chunks = [paths[i:i + DIR_CHUNK] for i in range(0, len(paths), DIR_CHUNK)]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            arrays = [rows for chunk in pool.map(_read_points_chunk, chunks) for rows in chunk]
+    return {tile_name(path): rows for path, rows in zip(paths, arrays)}
+
+
+def _read_points_chunk(paths):
+    arrays = []
+    for csv_path in paths:
+        try:
+            arrays.append(read_points_csv(csv_path))
+        except (OSError, ValueError) as e:
+            raise ValueError(f"{csv_path}: {e}") from e
+    return arrays
+
+
+def read_csv_header(csv_path):
+    """读取文件头中的左右图像名，返回 (LeftImage, RightImage)，缺失时为空字符串"""
+    names = {"LeftImage": "", "RightImage": ""}
+    with open(csv_path, 'r', newline='') as file:
+        for _ in range(2):
+            key, _, value = file.readline().partition(':')
+            if key in names:
+                names[key] = value.strip()
+    return names["LeftImage"], names["RightImage"]
+
+
+def write_points_csv(csv_path, rows, left_image, right_image):
+    """
+    写入标注文件，rows 为 (N, 4) 数组，ID 从 1 开始编号。
+    先写临时文件再原子替换，中途崩溃也不会留下写了一半的 CSV。
+    """
+    rows = np.asarray(rows, dtype=np.int64).reshape(-1, 4)
+    tmp_path = csv_path + ".tmp"
+    with open(tmp_path, 'w', newline='') as file:
+        file.write(f"LeftImage: {left_image}\n")
+        file.write(f"RightImage: {right_image}\n")
+        file.write("-" * 50 + "\n")
+        file.write(",".join(HEADER_COLUMNS) + "\n")
+        if len(rows):
+            ids = np.arange(1, len(rows) + 1, dtype=np.int64)[:, None]
+            np.savetxt(file, np.hstack([ids, rows]), fmt='%d', delimiter=',')
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, csv_path)
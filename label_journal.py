@@ -0,0 +1,271 @@
+"""
+标注的写前日志（journal）与后台保存
+
+每次编辑以一行 JSON 追加到本次会话的日志文件，写盘在后台线程完成，界面线程只把记录放进队列。
+手动保存同样交给后台线程：先写临时文件再原子替换 CSV，成功后在日志里记一条 saved。
+程序崩溃后，日志中最后一次 open/saved 之后的操作就是未落盘的修改，下次启动时对 CSV 重放即可恢复。
+长时间编辑时界面定时调用 compact，把日志改写为当前点集的一份快照（open + clear + extend），
+重放结果不变、日志不再无限增长；压缩只改写日志，不会替用户写回 CSV。
+会话期间日志文件一直持有操作系统的独占文件锁（进程退出或崩溃时由系统释放），
+重放时跳过仍被锁住的日志，不会误把同一保存目录下另一个正在运行的实例的日志当作遗留日志处理。
+启用项目数据库（label_db）时 open 记录带上数据库路径，保存和重放都改为读写数据库。
+
+日志记录：
+    {"op": "open", "csv": ..., "left": ..., "right": ..., "db": ...}   开始编辑某个标注文件（内容与磁盘一致）
+    {"op": "add_left", "args": [x, y]} 等                    PointPairStore 上的修改操作
+    {"op": "saved", "csv": ...}                              CSV 已与内存一致（保存或放弃修改）
+"""
+import glob
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt  # Windows
+except ImportError:
+    msvcrt = None
+
+from label_db import LabelDatabase
+from label_io import read_points_csv, write_points_csv
+from label_store import PointPairStore
+
+
+JOURNAL_DIR_NAME = ".journal"
+
+
+def _plain(value):
+    # numpy 数组 / 标量转换为可序列化的列表和数字
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _try_lock(file):
+    """对打开的文件加非阻塞的独占锁；已被其他进程锁住时返回 False"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        elif msvcrt is not None:
+            position = file.tell()
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+            file.seek(position)
+    except OSError:
+        return False
+    return True
+
+
+class SessionJournal:
+    def __init__(self, save_dir, callback=None, after_write=None):
+        """
+        callback(ok, csv_path, message) 在后台线程中调用，报告保存结果；
+        界面可传入 pyqtSignal.emit，信号会以排队方式送回主线程。
+        after_write(csv_path) 在每次写完 CSV 后于后台线程中调用（如更新 sidecar），其失败不影响保存结果。
+        """
+        self.directory = os.path.join(save_dir, JOURNAL_DIR_NAME)
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"session_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.jsonl")
+        # 创建后立即加锁，其他实例的 replay_journals 就不会处理这个日志
+        self._file = open(self.path, 'a', encoding='utf-8')
+        _try_lock(self._file)
+        self.callback = callback
+        self.after_write = after_write
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="label-journal", daemon=True)
+        self._thread.start()
+
+    # ---- 界面线程调用，只入队不碰磁盘 ----
+
+    def begin(self, csv_path, left_image, right_image, database=None):
+        self._queue.put(("log", {"op": "open", "csv": csv_path, "left": left_image, "right": right_image,
+                                 "db": database.path if database is not None else None}))
+
+    def record(self, op, *args):
+        """可直接作为 PointPairStore.listener"""
+        self._queue.put(("log", {"op": op, "args": [_plain(arg) for arg in args]}))
+
+    def save(self, csv_path, rows, left_image, right_image, database=None):
+        """后台写入 CSV（或项目数据库）；rows 需是不会再被修改的副本"""
+        self._queue.put(("save", (database, (csv_path, rows, left_image, right_image))))
+
+    def compact(self, csv_path, left_image, right_image, rows, pending=None, database=None):
+        """
+        把日志压缩为 csv_path 当前点集的快照；pending 为只标了左图的最后一个点 (x, y)。
+        其他标注文件还有未落盘的修改时不压缩
+        """
+        self._queue.put(("compact", (csv_path, left_image, right_image, database.path if database is not None else None,
+                                     rows, pending)))
+
+    def discard(self, csv_path):
+        """放弃未保存的修改，之后重放时不再恢复"""
+        self._queue.put(("log", {"op": "saved", "csv": csv_path}))
+
+    def close(self):
+        """写完队列中的全部任务后结束；所有修改都已落盘时删除日志文件"""
+        self._queue.put(None)
+        self._thread.join()
+
+    # ---- 后台线程 ----
+
+    def _run(self):
+        pending = set()  # 有未落盘修改的 CSV
+        current = None
+        with self._file as file:
+            while True:
+                jobs = [self._queue.get()]
+                # 一次取完已排队的记录，合并为一次 flush
+                while True:
+                    try:
+                        jobs.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                stop = False
+                for job in jobs:
+                    if job is None:
+                        stop = True
+                        break
+                    kind, payload = job
+                    if kind == "log":
+                        if payload["op"] == "open":
+                            current = payload["csv"]
+                        elif payload["op"] == "saved":
+                            pending.discard(payload["csv"])
+                        else:
+                            pending.add(current)
+                        file.write(json.dumps(payload, ensure_ascii=False) + "\n")
+                    elif kind == "compact":
+                        csv_path, left, right, db_path, rows, pending_left = payload
+                        if pending - {csv_path}:
+                            continue
+                        records = [{"op": "open", "csv": csv_path, "left": left, "right": right, "db": db_path},
+                                   {"op": "clear", "args": []},
+                                   {"op": "extend", "args": [_plain(rows)]}]
+                        if pending_left is not None:
+                            records.append({"op": "add_left", "args": [_plain(value) for value in pending_left]})
+                        try:
+                            file.flush()
+                            file.truncate(0)
+                        except OSError:
+                            pass  # 截断失败时快照照样追加在后面，重放结果相同
+                        file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+                        current = csv_path
+                        pending = {csv_path}
+                    else:
+                        database, args = payload
+                        csv_path = args[0]
+                        try:
+                            (database.write if database is not None else write_points_csv)(*args)
+                        except (OSError, sqlite3.Error) as e:
+                            if self.callback:
+                                self.callback(False, csv_path, str(e))
+                            continue
+                        if database is None and self.after_write:
+                            try:
+                                self.after_write(csv_path)
+                            except (OSError, ValueError):
+                                pass
+                        pending.discard(csv_path)
+                        file.write(json.dumps({"op": "saved", "csv": csv_path}, ensure_ascii=False) + "\n")
+                        if self.callback:
+                            self.callback(True, csv_path, "")
+                file.flush()
+                os.fsync(file.fileno())
+                if stop:
+                    break
+
+        if not pending:
+            os.remove(self.path)
+
+
+def _read_csv(csv_path):
+    # 编辑时 CSV 还不存在（新标注的切片）则从空点集开始重放
+    if os.path.exists(csv_path):
+        return read_points_csv(csv_path)
+    return np.zeros((0, 4), dtype=np.int32)
+
+
+def journal_paths(save_dir):
+    """save_dir 下的全部日志文件（包括其他正在运行的实例的日志）"""
+    return sorted(glob.glob(os.path.join(save_dir, JOURNAL_DIR_NAME, "*.jsonl")))
+
+
+def replay_journals(save_dir, exclude=None, progress=None):
+    """
+    重放 save_dir 下遗留的日志（上次异常退出时留下），把未落盘的修改写回 CSV。
+    仍被其他正在运行的实例锁住的日志跳过。返回恢复的 CSV 路径列表；处理完的日志文件会被删除。
+    progress(已处理数, 总数) 在每个日志处理完后调用（可在后台线程中运行并传入 pyqtSignal.emit）。
+    """
+    recovered = []
+    databases = {}
+    paths = journal_paths(save_dir)
+    for done, path in enumerate(paths):
+        if progress:
+            progress(done, len(paths))
+        if exclude and os.path.abspath(path) == os.path.abspath(exclude):
+            continue
+        with open(path, 'r+', encoding='utf-8') as file:
+            # 持有锁直到重放完成并清空日志，两个实例同时启动时同一份遗留日志只会被重放一次
+            if not _try_lock(file):
+                continue
+            recovered.extend(_replay(file, databases))
+            file.seek(0)
+            file.truncate()
+        try:
+            os.remove(path)  # Windows 下打开的文件不能删除，关闭后再删
+        except OSError:
+            pass  # 已被另一个实例删除
+    if progress:
+        progress(len(paths), len(paths))
+    for database in databases.values():
+        database.close()
+    return recovered
+
+
+def _replay(file, databases):
+    """重放一个日志文件中未落盘的修改，返回恢复的 CSV 路径列表；databases 为按路径复用的项目库连接"""
+    recovered = []
+    targets = {}  # csv -> [left, right, 数据库路径, 操作列表]
+    current = None
+    for line in file:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            break  # 崩溃时写了一半的最后一行
+        op = record["op"]
+        if op == "open":
+            current = record["csv"]
+            targets[current] = [record["left"], record["right"], record.get("db"), []]
+        elif op == "saved":
+            if record["csv"] in targets:
+                targets[record["csv"]][3] = []
+        elif current is not None:
+            targets[current][3].append((op, record["args"]))
+
+    for csv_path, (left, right, db_path, ops) in targets.items():
+        if not ops:
+            continue
+        if db_path:
+            if db_path not in databases:
+                databases[db_path] = LabelDatabase(db_path)
+            read, write = databases[db_path].read, databases[db_path].write
+        else:
+            read, write = _read_csv, write_points_csv
+        store = PointPairStore()
+        store.extend(read(csv_path))
+        for op, args in ops:
+            getattr(store, op)(*args)
+        write(csv_path, store.rows(), left, right)
+        recovered.append(csv_path)
+    return recovered
@@ -0,0 +1,405 @@
+"""
+切片标注合并为全局坐标（取代 concat.py）
+
+读取目录下所有 tile_X_Y_points.csv，把每个切片的点加上文件名中的偏移量，
+按切片顺序写成一个 tile_all_points.csv（与标注工具相同的 4 行文件头，ID 从 1 连续编号）：
+    python label_merge.py Dataset_Label_Test2/Label1
+    python label_merge.py Label -o Label/tile_all_points.csv --workers 8
+    python label_merge.py Label --full          # 忽略清单，完整重新合并（允许覆盖被改过的输出）
+
+切片按块分给进程池解析，主进程按原顺序边收边写，同时在途的块数有上限，
+所以几万个切片时内存占用也只与块大小有关。写完后同步切片目录的二进制 sidecar。
+
+每次合并在输出文件旁留下清单（tile_all_points.manifest.json）和全局点对数组（tile_all_points.rows.npy）：
+清单记录每个切片 CSV 的 mtime、大小、内容摘要，以及它在输出中的行范围和字节范围。
+再次合并时只重新读取有变化的切片，其余切片的行直接从旧输出按字节复制（ID 不变时）
+或从 .npy 重新格式化（前面切片点数变化导致 ID 顺延时），不再解析整个目录。
+.npy 以内存映射方式逐块写入，旧输出的字节也按块复制，增量合并的内存占用同样与切片总数无关。
+
+输出文件与清单记录的 mtime、大小不一致说明它在上次合并之后被别的程序改过，
+例如场景模式直接保存的全局标注。这时拒绝合并，以免覆盖这些修改；确认要用切片重新生成时加 --full。
+没有清单的旧输出（从未用本工具合并过）按首次合并处理，直接重新生成。
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from label_io import CSV_SUFFIX, parse_points, parse_tile_offset, tile_name
+from label_sidecar import update_sidecar
+
+
+OUTPUT_NAME = "tile_all_points.csv"
+LEFT_IMAGE = "OPT/tile_all.png"
+RIGHT_IMAGE = "SAR/tile_all.png"
+
+# 每个进程任务处理的切片数
+CHUNK = 512
+# 复制或重新格式化全局点对时每块的行数，以及从旧输出复制字节时每次读取的字节数
+ROW_CHUNK = 65536
+COPY_CHUNK = 4 << 20
+
+MANIFEST_VERSION = 1
+# 清单中每个切片的字段
+MTIME, SIZE, DIGEST, ROW_START, ROW_COUNT, BYTE_START, BYTE_LENGTH = range(7)
+
+
+def _header():
+    return (f"LeftImage: {LEFT_IMAGE}\nRightImage: {RIGHT_IMAGE}\n" + "-" * 50 + "\n"
+            "ID,LeftX,LeftY,RightX,RightY\n").encode("ascii")
+
+
+def manifest_paths(output):
+    """输出文件对应的 (清单路径, 全局点对 .npy 路径)"""
+    stem = os.path.splitext(output)[0]
+    return stem + ".manifest.json", stem + ".rows.npy"
+
+
+def list_tiles(directory):
+    """
+    目录中可合并的切片 [(路径, (x, y), (mtime_ns, 大小)), ...]，按行优先（先 y 后 x）排序；
+    无偏移的文件（如合并结果本身）跳过
+    """
+    tiles = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(CSV_SUFFIX):
+                offset = parse_tile_offset(entry.name[:-len(CSV_SUFFIX)])
+                if offset is not None:
+                    stat = entry.stat()
+                    tiles.append((entry.path, offset, (stat.st_mtime_ns, stat.st_size)))
+    tiles.sort(key=lambda tile: (tile[1][1], tile[1][0], tile[0]))
+    return tiles
+
+
+def _read_tile(path, offset):
+    """读取一个切片，返回 (全局坐标 (N, 4) int32, 内容摘要)"""
+    with open(path, 'rb') as file:
+        data = file.read()
+    x, y = offset
+    rows = parse_points(data) + np.array([x, y, x, y], dtype=np.int32)
+    return rows, hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def merge_chunk(tiles):
+    """子进程中运行：读取一块切片并换算到全局坐标，返回 [(点对, 摘要), ...]"""
+    return [_read_tile(path, offset) for path, offset, _ in tiles]
+
+
+def _format_rows(rows, first_id):
+    """把点对格式化为带 ID 的 CSV 行（bytes）"""
+    if not len(rows):
+        return b''
+    ids = np.arange(first_id, first_id + len(rows), dtype=np.int64)[:, None]
+    values = np.hstack([ids, np.asarray(rows, dtype=np.int64)]).ravel().tolist()
+    return (("%d,%d,%d,%d,%d\n" * len(rows)) % tuple(values)).encode("ascii")
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _load_manifest(directory, output):
+    """读取并校验上次合并的清单，返回 (清单, 全局点对 memmap)；不可用时返回 None"""
+    manifest_path, rows_path = manifest_paths(output)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+        if (manifest.get("version") != MANIFEST_VERSION
+                or manifest.get("directory") != os.path.abspath(directory)
+                or manifest.get("output") != _stat(output)):
+            return None  # 输出被别的程序改过，行范围已不可信
+        old_rows = np.load(rows_path, mmap_mode='r')
+        if old_rows.shape != (manifest["rows"], 4):
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return manifest, old_rows
+
+
+def _rows_tmp_path(output):
+    return manifest_paths(output)[1] + ".tmp.npy"
+
+
+def _open_rows(path, total):
+    """新建 (total, 4) int32 的 .npy 并以内存映射方式打开，供逐块写入；total 为 0 时直接写出空数组并返回 None"""
+    if not total:
+        np.save(path, np.zeros((0, 4), dtype=np.int32))
+        return None
+    return np.lib.format.open_memmap(path, mode='w+', dtype=np.int32, shape=(total, 4))
+
+
+def _copy_rows(source, start, target, target_start, count):
+    """把 source[start:start + count] 按 ROW_CHUNK 行一块复制到 target[target_start:]"""
+    for i in range(0, count, ROW_CHUNK):
+        n = min(ROW_CHUNK, count - i)
+        target[target_start + i:target_start + i + n] = source[start + i:start + i + n]
+
+
+def _copy_bytes(file, start, length):
+    """按 COPY_CHUNK 分块读出 file 中 [start, start + length) 的字节"""
+    file.seek(start)
+    while length > 0:
+        block = file.read(min(length, COPY_CHUNK))
+        if not block:
+            raise ValueError(f"{file.name} 比清单记录的短")
+        length -= len(block)
+        yield block
+
+
+def output_modified(output):
+    """
+    有上次合并的清单、但输出文件的 mtime/大小与清单记录不符（合并之后被改过）时返回 True。
+    没有清单（从未用本工具合并过，如仓库自带的旧输出）或清单读不出来时按首次合并处理
+    """
+    try:
+        with open(manifest_paths(output)[0], 'r', encoding='utf-8') as file:
+            recorded = json.load(file).get("output")
+        return recorded != _stat(output)
+    except (OSError, ValueError, AttributeError):
+        return False
+
+
+def _save_manifest(directory, output, entries, total, rows_written):
+    """写入清单；rows_written 为真时用本次写出的 .npy 替换旧的全局点对"""
+    manifest_path, rows_path = manifest_paths(output)
+    if rows_written:
+        os.replace(_rows_tmp_path(output), rows_path)
+    manifest = {"version": MANIFEST_VERSION, "directory": os.path.abspath(directory),
+                "output": _stat(output), "rows": total, "tiles": entries}
+    with open(manifest_path + ".tmp", 'w', encoding='utf-8') as file:
+        # json.dumps 走 C 编码器，比 json.dump 逐段写快得多
+        file.write(json.dumps(manifest, ensure_ascii=False, separators=(',', ':')))
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def _write_output(output, pieces):
+    """按顺序写出 pieces（bytes 或 memoryview），临时文件 + 原子替换"""
+    tmp_path = output + ".tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(_header())
+        for piece in pieces:
+            file.write(piece)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, output)
+
+
+def _full_merge(directory, output, tiles, workers, chunk):
+    """完整合并，全局点对写到 _rows_tmp_path(output)；返回 (清单条目, 点对数)"""
+    chunks = [tiles[i:i + chunk] for i in range(0, len(tiles), chunk)]
+    entries = {}
+    position = [1, len(_header())]  # 下一行的 ID、字节位置
+    # 点对总数要等全部切片解析完才知道：先顺序追加到原始文件，最后再按块复制进 .npy
+    raw_path = _rows_tmp_path(output) + ".raw"
+
+    def pieces(results, raw):
+        # 按切片顺序格式化，同时记录每个切片的行范围和字节范围
+        for tile_chunk, result in results:
+            for (path, _, stat), (rows, digest) in zip(tile_chunk, result):
+                text = _format_rows(rows, position[0])
+                entries[tile_name(path)] = [stat[0], stat[1], digest, position[0] - 1, len(rows),
+                                            position[1], len(text)]
+                position[0] += len(rows)
+                position[1] += len(text)
+                raw.write(np.ascontiguousarray(rows, dtype=np.int32).tobytes())
+                yield text
+
+    def results():
+        if len(chunks) <= 1 or workers <= 1:
+            for tile_chunk in chunks:
+                yield tile_chunk, merge_chunk(tile_chunk)
+            return
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # 最多 2 * workers 个块在途，按提交顺序取结果写出
+            pending = []
+            next_chunk = 0
+            while next_chunk < len(chunks) or pending:
+                while next_chunk < len(chunks) and len(pending) < 2 * workers:
+                    pending.append((chunks[next_chunk], pool.submit(merge_chunk, chunks[next_chunk])))
+                    next_chunk += 1
+                tile_chunk, future = pending.pop(0)
+                yield tile_chunk, future.result()
+
+    try:
+        with open(raw_path, 'wb') as raw:
+            _write_output(output, pieces(results(), raw))
+        total = position[0] - 1
+        rows = _open_rows(_rows_tmp_path(output), total)
+        if rows is not None:
+            source = np.memmap(raw_path, dtype=np.int32, mode='r', shape=(total, 4))
+            _copy_rows(source, 0, rows, 0, total)
+            rows.flush()
+            del rows, source  # 先释放映射再删除原始文件
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+    return entries, total
+
+
+def _byte_lengths(text, counts):
+    """text 由若干切片的行依次组成，返回各切片（行数为 counts）所占的字节数"""
+    ends = np.concatenate([[0], np.flatnonzero(np.frombuffer(text, dtype=np.uint8) == ord('\n')) + 1])
+    return np.diff(ends[np.concatenate([[0], np.cumsum(counts)])]).tolist()
+
+
+def _incremental_merge(output, tiles, previous):
+    """
+    根据上次的清单增量合并，全局点对写到 _rows_tmp_path(output)；返回 (清单条目, 点对数, 重新读取的切片数)。
+    没有任何变化时不重写输出，点对数返回 None
+    """
+    manifest, old_rows = previous
+    old_entries = manifest["tiles"]
+    plan = []  # (切片名, 新读取的点对或 None, 旧条目, mtime/大小, 摘要)
+    reread = 0
+    changed = len(old_entries) != len(tiles)
+    for path, offset, stat in tiles:
+        name = os.path.basename(path)[:-len(CSV_SUFFIX)]
+        old = old_entries.get(name)
+        if old is not None and (old[MTIME], old[SIZE]) == stat:
+            plan.append((name, None, old, stat, old[DIGEST]))
+            continue
+        rows, digest = _read_tile(path, offset)
+        reread += 1
+        if old is not None and old[DIGEST] == digest:
+            plan.append((name, None, old, stat, digest))  # 只是被重新保存，内容未变
+        else:
+            plan.append((name, rows, old, stat, digest))
+            changed = True
+    if not changed:
+        # 只需刷新清单中的 mtime
+        entries = {name: [stat[0], stat[1]] + old[DIGEST:] for name, _, old, stat, _ in plan}
+        return entries, None, reread
+
+    # 连续复用的旧切片合成一段 [(切片名, 旧条目, mtime/大小)]，它们在旧输出中首尾相接；
+    # 新读取的切片单独成组 (切片名, 点对, mtime/大小, 摘要)
+    groups = []
+    for name, rows, old, stat, digest in plan:
+        if rows is not None:
+            groups.append((name, rows, stat, digest))
+        elif (groups and isinstance(groups[-1], list)
+              and old[ROW_START] == groups[-1][-1][1][ROW_START] + groups[-1][-1][1][ROW_COUNT]):
+            groups[-1].append((name, old, stat))
+        else:
+            groups.append([(name, old, stat)])
+
+    total = sum(old[ROW_COUNT] if rows is None else len(rows) for _, rows, old, _, _ in plan)
+    new_rows = _open_rows(_rows_tmp_path(output), total)
+    entries = {}
+    cursor = [0, len(_header())]  # 下一行的序号（从 0 起）、字节位置
+
+    def add(name, stat, digest, count, length):
+        entries[name] = [stat[0], stat[1], digest, cursor[0], count, cursor[1], length]
+        cursor[0] += count
+        cursor[1] += length
+
+    def reuse(run, old_file):
+        # 一段复用的切片：ID 没有顺延时直接按块复制旧输出的字节，否则按不超过 ROW_CHUNK 行的批次重新格式化
+        start = run[0][1][ROW_START]
+        count = sum(old[ROW_COUNT] for _, old, _ in run)
+        _copy_rows(old_rows, start, new_rows, cursor[0], count)
+        if cursor[0] == start:
+            first = cursor[1]
+            for name, old, stat in run:
+                add(name, stat, old[DIGEST], old[ROW_COUNT], old[BYTE_LENGTH])
+            yield from _copy_bytes(old_file, run[0][1][BYTE_START], cursor[1] - first)
+            return
+        batch, batch_rows = [], 0
+        for item in run + [None]:
+            if batch and (item is None or batch_rows + item[1][ROW_COUNT] > ROW_CHUNK):
+                begin = batch[0][1][ROW_START]
+                counts = [old[ROW_COUNT] for _, old, _ in batch]
+                text = _format_rows(old_rows[begin:begin + sum(counts)], cursor[0] + 1)
+                for (name, old, stat), length in zip(batch, _byte_lengths(text, counts)):
+                    add(name, stat, old[DIGEST], old[ROW_COUNT], length)
+                yield text
+                batch, batch_rows = [], 0
+            if item is not None:
+                batch.append(item)
+                batch_rows += item[1][ROW_COUNT]
+
+    def pieces(old_file):
+        for group in groups:
+            if isinstance(group, list):
+                yield from reuse(group, old_file)
+                continue
+            name, rows, stat, digest = group
+            text = _format_rows(rows, cursor[0] + 1)
+            _copy_rows(rows, 0, new_rows, cursor[0], len(rows))
+            add(name, stat, digest, len(rows), len(text))
+            yield text
+
+    with open(output, 'rb') as old_file:
+        _write_output(output, pieces(old_file))
+    if new_rows is not None:
+        new_rows.flush()
+    del new_rows  # 替换 .npy 之前释放映射
+    return entries, total, reread
+
+
+def merge_directory(directory, output=None, workers=None, chunk=CHUNK, sidecar=True, incremental=True,
+                    overwrite=False):
+    """
+    合并 directory 中的切片标注，返回 (切片数, 点对数)。
+    incremental 为真且上次合并的清单有效时，只重新读取有变化的切片。
+    输出在上次合并后被改过时抛出 ValueError，overwrite 为真才覆盖。
+    """
+    output = output or os.path.join(directory, OUTPUT_NAME)
+    if not overwrite and output_modified(output):
+        raise ValueError(f"{output} 在上次合并之后被修改过（如场景模式中保存的全局标注），为避免覆盖这些修改已停止合并；"
+                         f"确认要用切片标注重新生成时请加 --full")
+    tiles = list_tiles(directory)
+    workers = workers or os.cpu_count() or 1
+
+    previous = _load_manifest(directory, output) if incremental else None
+    full = previous is None
+    if full:
+        entries, total = _full_merge(directory, output, tiles, workers, chunk)
+        reread, rows_written = len(tiles), True
+    else:
+        entries, total, reread = _incremental_merge(output, tiles, previous)
+        rows_written = total is not None
+        if total is None:
+            total = len(previous[1])
+    # 先释放旧 .npy 的映射再替换它（Windows 下映射期间文件不能被替换）
+    del previous
+    if reread or rows_written:
+        _save_manifest(directory, output, entries, total, rows_written)
+
+    # 标注工具保存时只更新单个切片的条目，新切片要在整体重写时才写进 sidecar
+    if sidecar and (full or reread):
+        try:
+            update_sidecar(directory)
+        except (OSError, ValueError) as e:
+            print(f"sidecar 未更新: {e}", file=sys.stderr)
+    return len(tiles), total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把 tile_X_Y_points.csv 切片标注合并为全局坐标的 tile_all_points.csv")
+    parser.add_argument("directory", help="切片标注所在目录")
+    parser.add_argument("-o", "--output", help=f"输出文件，默认为目录下的 {OUTPUT_NAME}")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认为 CPU 核数")
+    parser.add_argument("--chunk", type=int, default=CHUNK, help="每个进程任务处理的切片数")
+    parser.add_argument("--full", action="store_true", help="忽略上次合并的清单，完整重新合并；输出被改过时也覆盖")
+    parser.add_argument("--no-sidecar", action="store_true", help="不更新切片目录的二进制 sidecar")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        tiles, points = merge_directory(args.directory, args.output, args.workers, args.chunk,
+                                        not args.no_sidecar, not args.full, args.full)
+    except ValueError as e:
+        parser.error(str(e))
+    output = args.output or os.path.join(args.directory, OUTPUT_NAME)
+    print(f"已合并 {tiles} 个切片、{points} 对点到 {output}（{time.perf_counter() - start:.2f} s）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""
+标注目录的二进制旁路文件（sidecar）
+
+把一个标注目录中所有 *_points.csv 的点对打包成一个定长格式的二进制文件 points.lbl，
+批处理工具可以用 numpy.memmap 直接映射，不必重新解析成千上万个文本 CSV：
+
+    文件头     HEADER_DTYPE，魔数、版本、切片数、点对数及两张表的偏移
+    切片表     TILE_DTYPE，每个切片一行：名称、点对起止、偏移、源 CSV 的 mtime、大小、内容摘要和校验时间
+    点对表     POINT_DTYPE，各切片的点对连续存放
+
+CSV 仍是标注的正式格式，sidecar 只是缓存：读取时逐个切片比较源 CSV 的 mtime 和大小，
+不一致（或 CSV 是新文件）的切片退回解析 CSV，已删除的 CSV 不再返回。
+mtime 距记录时的校验时间不到 RACY_NS 的切片，同一时间戳粒度内可能又被改写成同样大小，
+这些切片再读一遍 CSV 比较内容摘要。
+
+标注工具每次保存 CSV 后用 patch_sidecar 只更新这一个切片：新的点对追加到点对表末尾，再改写它的条目，
+不扫描目录、不重写整个文件。旧的行成为空洞，空洞超过有效点对数时，下次整目录刷新
+（load_points_dir(refresh=True) 或 update_sidecar，合并、拆分工具会调用）整体重写压缩。
+"""
+import hashlib
+import os
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt  # Windows
+except ImportError:
+    msvcrt = None
+
+from label_io import CSV_SUFFIX, parse_points, parse_tile_offset, tile_name
+
+
+SIDECAR_NAME = "points.lbl"
+# 合并后的全局标注由各切片推导而来，不放进 sidecar
+EXCLUDED_TILES = {"tile_all"}
+MAGIC = b"OSLABEL1"
+VERSION = 2
+# 文件系统时间戳的最粗粒度（FAT 为 2 秒）：mtime 离校验时间比这更近的切片要比较内容摘要
+RACY_NS = 2_000_000_000
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"), ("version", "<u4"), ("reserved", "<u4"),
+    ("tile_count", "<u8"), ("point_count", "<u8"),
+    ("tiles_offset", "<u8"), ("points_offset", "<u8"),
+])
+TILE_DTYPE = np.dtype([
+    ("name", "S128"),
+    ("start", "<i8"), ("count", "<i8"),
+    ("offset_x", "<i4"), ("offset_y", "<i4"), ("has_offset", "u1"), ("pad", "V7"),
+    ("mtime_ns", "<i8"), ("size", "<i8"), ("checked_ns", "<i8"), ("digest", "<u8"),
+])
+POINT_DTYPE = np.dtype([("left_x", "<i4"), ("left_y", "<i4"), ("right_x", "<i4"), ("right_y", "<i4")])
+
+ALIGN = 64
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def sidecar_path(directory):
+    return os.path.join(directory, SIDECAR_NAME)
+
+
+def open_sidecar(path):
+    """
+    以内存映射方式打开 sidecar，返回 (切片表, 点对表)；文件不存在或格式不对时返回 None。
+    返回的数组引用着映射的文件，用完应及时释放（Windows 下映射期间文件不能被替换）。
+    """
+    try:
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    except OSError:
+        return None
+    if len(header) != 1 or header["magic"][0] != MAGIC or header["version"][0] != VERSION:
+        return None
+    header = header[0]
+    tile_count, point_count = int(header["tile_count"]), int(header["point_count"])
+    expected = int(header["points_offset"]) + point_count * POINT_DTYPE.itemsize
+    if os.path.getsize(path) < expected:
+        return None  # 写了一半的文件
+    tiles = np.memmap(path, dtype=TILE_DTYPE, mode='r', offset=int(header["tiles_offset"]), shape=(tile_count,))
+    if point_count:
+        points = np.memmap(path, dtype=POINT_DTYPE, mode='r', offset=int(header["points_offset"]), shape=(point_count,))
+    else:
+        points = np.zeros(0, dtype=POINT_DTYPE)
+    return tiles, points
+
+
+def _digest(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def _read_csv(path):
+    """解析一个 CSV，返回 (点对, 校验时间, 内容摘要)；校验时间取在读取之前"""
+    checked_ns = time.time_ns()
+    with open(path, 'rb') as file:
+        data = file.read()
+    return parse_points(data), checked_ns, _digest(data)
+
+
+def _scan_csv(directory):
+    """{切片名: (路径, mtime_ns, 大小)}"""
+    found = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            name = entry.name[:-len(CSV_SUFFIX)]
+            if entry.name.endswith(CSV_SUFFIX) and name not in EXCLUDED_TILES and entry.is_file():
+                stat = entry.stat()
+                found[name] = (entry.path, stat.st_mtime_ns, stat.st_size)
+    return found
+
+
+def _load(directory):
+    """
+    返回 ({切片名: (N, 4) int32}, {切片名: (mtime_ns, 大小, 校验时间, 摘要)}, 重新解析的切片数, sidecar 是否需要重写)。
+    sidecar 中与 CSV 一致的切片是内存映射上的视图，不复制数据
+    """
+    sources = _scan_csv(directory)
+    tiles, stats, stale, packed_count, dead = {}, {}, 0, -1, 0
+
+    packed = open_sidecar(sidecar_path(directory))
+    if packed is not None:
+        table, points = packed
+        packed_count = len(table)
+        dead = len(points) - int(table["count"].sum())
+        points = points.view(np.int32).reshape(-1, 4)
+        for name, start, count, mtime_ns, size, checked_ns, digest in zip(
+                table["name"].tolist(), table["start"].tolist(), table["count"].tolist(),
+                table["mtime_ns"].tolist(), table["size"].tolist(), table["checked_ns"].tolist(),
+                table["digest"].tolist()):
+            name = name.decode("utf-8")
+            source = sources.get(name)
+            if source is None or (mtime_ns, size) != source[1:]:
+                continue
+            if mtime_ns + RACY_NS > checked_ns:
+                # 记录时 CSV 刚改过，之后同一时间戳内的改写看不出来：比较内容摘要
+                rows, checked_ns, current = _read_csv(source[0])
+                if current != digest:
+                    tiles[name] = rows
+                    stats[name] = (mtime_ns, size, checked_ns, current)
+                    stale += 1
+                    continue
+            tiles[name] = points[start:start + count]
+            stats[name] = (mtime_ns, size, checked_ns, digest)
+        del packed, table, points
+
+    for name, (path, mtime_ns, size) in sources.items():
+        if name not in tiles:
+            rows, checked_ns, digest = _read_csv(path)
+            tiles[name] = rows
+            stats[name] = (mtime_ns, size, checked_ns, digest)
+            stale += 1
+    # 有切片重新解析、有 CSV 被删除（sidecar 中多出的切片）、还没有 sidecar，
+    # 或者保存时追加留下的空洞超过了有效点对数时需要重写
+    live = sum(len(rows) for rows in tiles.values())
+    outdated = stale > 0 or packed_count != len(tiles) or dead > live
+    return dict(sorted(tiles.items())), stats, stale, outdated
+
+
+def _detach(tiles):
+    # 复制出映射中的切片：替换 sidecar 之前不能再引用旧文件的映射（Windows 下映射期间文件不能被替换）
+    return {name: np.array(rows) for name, rows in tiles.items()}
+
+
+def load_points_dir(directory, refresh=False):
+    """
+    读取标注目录的全部点对 {切片名: (N, 4) int32}，按切片名排序；
+    sidecar 中与 CSV 一致的切片直接取内存映射上的视图，其余切片解析 CSV。
+    返回的数组可能引用着映射的文件，用完应及时释放。
+    refresh 为真且 sidecar 已过期时顺便重写它（失败时忽略，sidecar 只是缓存）。
+    """
+    tiles, stats, _, outdated = _load(directory)
+    if refresh and outdated:
+        tiles = _detach(tiles)
+        try:
+            write_sidecar(directory, tiles, stats)
+        except OSError:
+            pass
+    return tiles
+
+
+def write_sidecar(directory, tiles, stats):
+    """把 {切片名: 点对} 写成 sidecar（临时文件 + 原子替换）"""
+    names = list(tiles)
+    table = np.zeros(len(names), dtype=TILE_DTYPE)
+    counts = np.array([len(tiles[name]) for name in names], dtype=np.int64)
+    table["start"] = np.concatenate([[0], np.cumsum(counts)[:-1]]) if len(names) else 0
+    table["count"] = counts
+    for i, name in enumerate(names):
+        table["name"][i] = name.encode("utf-8")
+        offset = parse_tile_offset(name)
+        if offset is not None:
+            table["offset_x"][i], table["offset_y"][i] = offset
+            table["has_offset"][i] = 1
+        table["mtime_ns"][i], table["size"][i], table["checked_ns"][i], table["digest"][i] = stats[name]
+
+    if names:
+        points = np.ascontiguousarray(np.concatenate([tiles[name] for name in names]), dtype="<i4")
+    else:
+        points = np.zeros((0, 4), dtype="<i4")
+
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["version"] = VERSION
+    header["tile_count"] = len(names)
+    header["point_count"] = len(points)
+    header["tiles_offset"] = _align(HEADER_DTYPE.itemsize)
+    header["points_offset"] = _align(int(header["tiles_offset"][0]) + table.nbytes)
+
+    path = sidecar_path(directory)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(header.tobytes())
+        file.seek(int(header["tiles_offset"][0]))
+        file.write(table.tobytes())
+        file.seek(int(header["points_offset"][0]))
+        file.write(points.tobytes())
+    os.replace(tmp_path, path)
+
+
+def update_sidecar(directory):
+    """与目录中的 CSV 同步 sidecar，只重新解析有变化的切片；返回重新解析的切片数"""
+    tiles, stats, stale, outdated = _load(directory)
+    if not outdated:
+        return 0  # 已是最新
+    write_sidecar(directory, _detach(tiles), stats)
+    return stale
+
+
+def _lock(file):
+    """对 sidecar 加独占锁（阻塞），同一目录的两次 patch_sidecar 不会同时追加"""
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+    elif msvcrt is not None:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _write_at(file, offset, array):
+    file.seek(offset)
+    file.write(array.tobytes())
+    file.flush()
+
+
+def patch_sidecar(csv_path):
+    """
+    保存一个标注 CSV 后只更新 sidecar 中这个切片：点对追加到点对表末尾，再改写它在切片表中的条目。
+    sidecar 不存在、格式不对或还没有这个切片（新标注的切片）时不做改动，读取时照常解析 CSV，
+    下次整目录刷新时再写进去。返回是否更新了
+    """
+    name = tile_name(csv_path)
+    if name in EXCLUDED_TILES:
+        return False
+    try:
+        file = open(sidecar_path(os.path.dirname(csv_path)), 'r+b')
+    except FileNotFoundError:
+        return False
+    with file:
+        _lock(file)
+        file.seek(0)
+        header = np.frombuffer(file.read(HEADER_DTYPE.itemsize), dtype=np.uint8)
+        if len(header) != HEADER_DTYPE.itemsize:
+            return False
+        header = header.view(HEADER_DTYPE).copy()
+        if header["magic"][0] != MAGIC or header["version"][0] != VERSION:
+            return False
+        tiles_offset, points_offset = int(header["tiles_offset"][0]), int(header["points_offset"][0])
+        tile_count, point_count = int(header["tile_count"][0]), int(header["point_count"][0])
+        file.seek(tiles_offset)
+        table = np.frombuffer(file.read(tile_count * TILE_DTYPE.itemsize), dtype=TILE_DTYPE)
+        hits = np.flatnonzero(table["name"] == name.encode("utf-8"))
+        if len(table) != tile_count or not len(hits):
+            return False
+        index = int(hits[0])
+        entry = table[index:index + 1].copy()
+        entry_offset = tiles_offset + index * TILE_DTYPE.itemsize
+
+        stat = os.stat(csv_path)
+        rows, checked_ns, digest = _read_csv(csv_path)
+        rows = np.ascontiguousarray(rows, dtype="<i4")
+        # 先让条目失效，中途出错或崩溃时读取方只会退回解析 CSV；
+        # 新的点对总是追加，其他进程已经映射的旧行不会被改动
+        entry["mtime_ns"] = -1
+        _write_at(file, entry_offset, entry)
+        _write_at(file, points_offset + point_count * POINT_DTYPE.itemsize, rows)
+        header["point_count"] = point_count + len(rows)
+        _write_at(file, 0, header)
+        entry["start"], entry["count"] = point_count, len(rows)
+        entry["mtime_ns"], entry["size"] = stat.st_mtime_ns, stat.st_size
+        entry["checked_ns"], entry["digest"] = checked_ns, digest
+        _write_at(file, entry_offset, entry)
+    return True
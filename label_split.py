@@ -0,0 +1,205 @@
+"""
+全局标注拆分回切片（label_merge 的逆操作）
+
+把 tile_all_points.csv 这类全局坐标的标注按切片范围分配回各个 tile_X_Y_points.csv：
+    python label_split.py Label/tile_all_points.csv
+    python label_split.py merged.csv -o Label --tiles OPT --overlap all
+    python label_split.py merged.csv -o Label_new --tile-size 1024      # 没有现成切片时按规则格网生成
+
+切片列表取自 --tiles 目录中切片图像或标注 CSV 的文件名（默认为输出目录）；切片大小默认读取切片图像的尺寸，
+没有图像时按切片偏移的最小间距推断，也可以用 --tile-size 指定。
+全局点按左图坐标建格网索引，每个切片只检查与其范围相交的格子；左右两点都落在切片内的点对才属于该切片。
+相邻切片有重叠时，重叠区中的点对按 --overlap 处理：
+    center   只写入切片中心离左图点最近的那个切片（默认，点离切片边缘最远）
+    first    只写入按行优先顺序的第一个切片
+    all      写入所有包含它的切片
+有点对的切片以及输出目录中已有 CSV 的切片由线程池并行写出，格式与标注工具相同；内容没有变化的 CSV 不重写。
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from label_io import CSV_SUFFIX, DIR_CHUNK, parse_tile_offset, read_csv_header, read_points_csv, write_points_csv
+from label_merge import OUTPUT_NAME
+from image_probe import probe_size
+from label_sidecar import update_sidecar
+from spatial_index import PointGridIndex
+
+
+OVERLAP_POLICIES = ("center", "first", "all")
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')
+
+
+def find_tiles(directory):
+    """目录中切片图像或标注 CSV 对应的切片 [(切片名, (x, y)), ...]，按行优先排序"""
+    tiles = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            name = entry.name
+            if name.endswith(CSV_SUFFIX):
+                name = name[:-len(CSV_SUFFIX)]
+            elif name.lower().endswith(IMAGE_SUFFIXES):
+                name = os.path.splitext(name)[0]
+            else:
+                continue
+            offset = parse_tile_offset(name)
+            if offset is not None:
+                tiles[f"tile_{offset[0]}_{offset[1]}"] = offset
+    return sorted(tiles.items(), key=lambda tile: (tile[1][1], tile[1][0]))
+
+
+def infer_tile_size(directory, tiles):
+    """切片大小 (宽, 高)：优先读取切片图像的尺寸（image_probe 只读文件头），否则取切片偏移的最小间距；无法推断时返回 None"""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(IMAGE_SUFFIXES) and parse_tile_offset(entry.name) is not None:
+                size = probe_size(entry.path)
+                if size is not None:
+                    return size
+
+    def stride(values):
+        steps = np.diff(np.unique(values))
+        return int(steps.min()) if len(steps) else None
+
+    xs = stride([offset[0] for _, offset in tiles])
+    ys = stride([offset[1] for _, offset in tiles])
+    if xs is None and ys is None:
+        return None
+    return xs or ys, ys or xs
+
+
+def regular_tiles(rows, width, height):
+    """按规则格网覆盖全部点对（左右两点）的切片 [(切片名, (x, y)), ...]"""
+    if not len(rows):
+        return []
+    xy = rows.reshape(-1, 2)
+    x0, y0 = (xy.min(axis=0) // (width, height)).tolist()
+    x1, y1 = (xy.max(axis=0) // (width, height)).tolist()
+    return [(f"tile_{cx * width}_{cy * height}", (cx * width, cy * height))
+            for cy in range(y0, y1 + 1) for cx in range(x0, x1 + 1)]
+
+
+def assign_pairs(rows, tiles, width, height, overlap="center"):
+    """
+    把全局点对分配到切片，返回每个切片的点对序号 [array, ...]（与 tiles 一一对应，按原顺序）
+    以及没有落入任何切片的点对数
+    """
+    if overlap not in OVERLAP_POLICIES:
+        raise ValueError(f"未知的重叠处理方式: {overlap}")
+    index = PointGridIndex(rows[:, :2], cell=max(1, min(width, height)))
+    points, owners, scores = [], [], []
+    for t, (_, (ox, oy)) in enumerate(tiles):
+        found = index.query(ox, oy, ox + width - 1, oy + height - 1)
+        if not len(found):
+            continue
+        right = rows[found, 2:] - (ox, oy)
+        found = found[(right[:, 0] >= 0) & (right[:, 0] < width) & (right[:, 1] >= 0) & (right[:, 1] < height)]
+        centre = (ox + width / 2, oy + height / 2)
+        points.append(found)
+        owners.append(np.full(len(found), t, dtype=np.intp))
+        scores.append(((rows[found, :2] - centre) ** 2).sum(axis=1))
+
+    if not points:
+        return [np.zeros(0, dtype=np.intp) for _ in tiles], len(rows)
+    points, owners, scores = np.concatenate(points), np.concatenate(owners), np.concatenate(scores)
+    if overlap != "all":
+        # 每个点对只保留一个切片：按点对分组后取得分最小（center）或行优先最靠前（first）的那个
+        keys = (owners, scores, points) if overlap == "center" else (owners, points)
+        order = np.lexsort(keys)
+        _, first = np.unique(points[order], return_index=True)
+        keep = order[first]
+        points, owners = points[keep], owners[keep]
+
+    order = np.lexsort((points, owners))
+    points, owners = points[order], owners[order]
+    bounds = np.searchsorted(owners, np.arange(len(tiles) + 1))
+    assigned = [points[bounds[t]:bounds[t + 1]] for t in range(len(tiles))]
+    return assigned, len(rows) - len(np.unique(points))
+
+
+def split_file(path, output=None, tiles_dir=None, tile_size=None, overlap="center", workers=8, sidecar=True):
+    """
+    把全局标注文件拆分为切片 CSV，返回 (写出（有变化）的切片数, 分配的点对数, 未落入任何切片的点对数)。
+    tile_size 为 (宽, 高)，为 None 时自动推断。
+    """
+    output = output or os.path.dirname(os.path.abspath(path))
+    os.makedirs(output, exist_ok=True)
+    tiles_dir = tiles_dir or output
+    rows = read_points_csv(path).astype(np.int64)
+
+    tiles = find_tiles(tiles_dir)
+    if tile_size is None:
+        tile_size = infer_tile_size(tiles_dir, tiles)
+        if tile_size is None:
+            raise ValueError(f"无法从 {tiles_dir} 推断切片大小，请指定 --tile-size")
+    width, height = tile_size
+    if not tiles:
+        tiles = regular_tiles(rows, width, height)
+
+    assigned, unassigned = assign_pairs(rows, tiles, width, height, overlap)
+
+    def write(tile):
+        (name, (ox, oy)), indices = tile
+        csv_path = os.path.join(output, name + CSV_SUFFIX)
+        tile_rows = rows[indices] - (ox, oy, ox, oy)
+        if os.path.exists(csv_path):
+            if np.array_equal(read_points_csv(csv_path), tile_rows):
+                return 0  # 内容相同的切片不重写，重复拆分时只写有变化的文件
+            left_image, right_image = read_csv_header(csv_path)
+        elif not len(indices):
+            return 0  # 没有点对也没有旧文件的切片不生成空 CSV
+        else:
+            left_image, right_image = f"OPT/{name}.png", f"SAR/{name}.png"
+        write_points_csv(csv_path, tile_rows, left_image, right_image)
+        return 1
+
+    def write_chunk(chunk):
+        return sum(write(tile) for tile in chunk)
+
+    # 每个文件写完都要 fsync，线程在等待磁盘时释放 GIL；按块提交以减少任务调度的开销
+    jobs = list(zip(tiles, assigned))
+    chunks = [jobs[i:i + DIR_CHUNK] for i in range(0, len(jobs), DIR_CHUNK)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        written = sum(pool.map(write_chunk, chunks))
+
+    if sidecar and written:
+        try:
+            update_sidecar(output)
+        except (OSError, ValueError) as e:
+            print(f"sidecar 未更新: {e}", file=sys.stderr)
+    return written, sum(len(indices) for indices in assigned), unassigned
+
+
+def _tile_size(text):
+    width, _, height = text.lower().partition('x')
+    return int(width), int(height or width)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把全局坐标的标注拆分回 tile_X_Y_points.csv 切片标注")
+    parser.add_argument("input", help=f"全局标注文件，如 Label/{OUTPUT_NAME}")
+    parser.add_argument("-o", "--output", help="切片 CSV 的输出目录，默认为输入文件所在目录")
+    parser.add_argument("--tiles", help="从该目录的切片图像或 CSV 文件名获取切片列表，默认为输出目录")
+    parser.add_argument("--tile-size", type=_tile_size, help="切片大小，如 1024 或 1024x768；默认自动推断")
+    parser.add_argument("--overlap", choices=OVERLAP_POLICIES, default="center", help="重叠区中点对的分配方式")
+    parser.add_argument("--workers", type=int, default=8, help="写文件的线程数")
+    parser.add_argument("--no-sidecar", action="store_true", help="不更新输出目录的二进制 sidecar")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        written, pairs, unassigned = split_file(args.input, args.output, args.tiles, args.tile_size,
+                                                args.overlap, args.workers, not args.no_sidecar)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"已写出 {written} 个切片、{pairs} 对点（{time.perf_counter() - start:.2f} s）")
+    if unassigned:
+        print(f"有 {unassigned} 对点没有落入任何切片，未写出", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
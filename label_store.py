@@ -0,0 +1,234 @@
+"""
+标注点对存储
+
+左右两幅图像的标注点成对保存在一组 NumPy 数组中（左图 xy、右图 xy、标志位、时间戳），
+两个 ImageLabel 共享同一个 PointPairStore，不再靠两个列表长度相同来保持一致。
+容量按倍数增长，追加和弹出均摊 O(1)；left / right 返回数组视图，绘制和拟合时不复制数据。
+每次修改递增 revision，与保存时记下的 saved_revision 比较即可 O(1) 判断是否有未保存的修改。
+设置 listener 后每次修改都会以 (操作名, 参数...) 回调，供写前日志记录；按同样的顺序
+对同一初始状态调用同名方法即可重放。
+"""
+import hashlib
+import time
+
+import numpy as np
+
+
+LEFT = 0
+RIGHT = 1
+
+# 标志位：该点对的哪一侧已经标注
+HAS_LEFT = 1
+HAS_RIGHT = 2
+
+
+class PointPairStore:
+    def __init__(self, capacity=64):
+        self._xy = np.zeros((2, capacity, 2), dtype=np.int32)  # [side, idx, (x, y)]
+        self._flags = np.zeros(capacity, dtype=np.uint8)
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._count = 0
+        self.revision = 0  # 每次修改递增
+        self.saved_revision = 0  # 上次加载或保存时的 revision
+        self.listener = None  # listener(op, *args)，每次修改后调用
+        self._saved_hash = self.content_hash()
+        self._hash_cache = (self.revision, self._saved_hash)
+
+    def __len__(self):
+        return self._count
+
+    def _changed(self, op, *args):
+        self.revision += 1
+        if self.listener is not None:
+            self.listener(op, *args)
+
+    def _reserve(self, count):
+        capacity = self._flags.shape[0]
+        if count <= capacity:
+            return
+        while capacity < count:
+            capacity *= 2
+        xy = np.zeros((2, capacity, 2), dtype=np.int32)
+        xy[:, :self._count] = self._xy[:, :self._count]
+        flags = np.zeros(capacity, dtype=np.uint8)
+        flags[:self._count] = self._flags[:self._count]
+        times = np.zeros(capacity, dtype=np.float64)
+        times[:self._count] = self._times[:self._count]
+        self._xy, self._flags, self._times = xy, flags, times
+
+    # ---- 视图 ----
+
+    @property
+    def left(self):
+        return self._xy[LEFT, :self._count]
+
+    @property
+    def right(self):
+        return self._xy[RIGHT, :self.side_count(RIGHT)]
+
+    @property
+    def flags(self):
+        return self._flags[:self._count]
+
+    @property
+    def times(self):
+        return self._times[:self._count]
+
+    def xy(self, side):
+        """某一侧已标注点的 (N, 2) 视图"""
+        return self.left if side == LEFT else self.right
+
+    def side_count(self, side):
+        # 只有最后一对可能缺少右图点，所以右图点总是前缀
+        if side == RIGHT and self.has_pending():
+            return self._count - 1
+        return self._count
+
+    def has_pending(self):
+        """最后一对是否只标了左图"""
+        return self._count > 0 and not self._flags[self._count - 1] & HAS_RIGHT
+
+    def rows(self):
+        """完整点对的 (N, 4) 数组 [LeftX, LeftY, RightX, RightY]（新数组）"""
+        n = self.side_count(RIGHT)
+        return np.hstack([self._xy[LEFT, :n], self._xy[RIGHT, :n]])
+
+    # ---- 保存状态 ----
+
+    def content_hash(self):
+        """点对内容（坐标与标志位）的摘要"""
+        n = self._count
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.ascontiguousarray(self._xy[:, :n]).tobytes())
+        digest.update(self._flags[:n].tobytes())
+        return digest.digest()
+
+    def _current_hash(self):
+        # 同一 revision 只计算一次
+        if self._hash_cache[0] != self.revision:
+            self._hash_cache = (self.revision, self.content_hash())
+        return self._hash_cache[1]
+
+    def mark_dirty(self):
+        """保存失败时调用，使当前内容重新视为未保存（内容摘要也作废，check_content=True 时同样返回 True）"""
+        self.saved_revision = -1
+        self._saved_hash = None
+
+    def mark_saved(self):
+        """把当前内容记为已保存（加载完成或写盘之后调用）"""
+        self.saved_revision = self.revision
+        self._saved_hash = self._current_hash()
+
+    def is_dirty(self, check_content=False):
+        """
+        是否有未保存的修改。默认只比较 revision，O(1)；
+        check_content=True 时 revision 不同再比较内容摘要，添加后又撤销的情况不算修改。
+        """
+        if self.revision == self.saved_revision:
+            return False
+        if not check_content:
+            return True
+        return self._current_hash() != self._saved_hash
+
+    # ---- 修改 ----
+
+    def clear(self):
+        self._count = 0
+        self._changed('clear')
+
+    def extend(self, rows):
+        """批量追加完整点对，rows 为 (N, 4) 数组"""
+        rows = np.asarray(rows, dtype=np.int32).reshape(-1, 4)
+        start, end = self._count, self._count + len(rows)
+        self._reserve(end)
+        self._xy[LEFT, start:end] = rows[:, 0:2]
+        self._xy[RIGHT, start:end] = rows[:, 2:4]
+        self._flags[start:end] = HAS_LEFT | HAS_RIGHT
+        self._times[start:end] = time.time()
+        self._count = end
+        self._changed('extend', rows)
+
+    def add_left(self, x, y):
+        """新建一对点，先标左图"""
+        self._reserve(self._count + 1)
+        self._xy[:, self._count] = (x, y)
+        self._flags[self._count] = HAS_LEFT
+        self._times[self._count] = time.time()
+        self._count += 1
+        self._changed('add_left', x, y)
+
+    def set_right(self, x, y):
+        """补上最后一对点的右图点"""
+        if not self.has_pending():
+            raise ValueError("没有等待标注右图的点对")
+        idx = self._count - 1
+        self._xy[RIGHT, idx] = (x, y)
+        self._flags[idx] |= HAS_RIGHT
+        self._times[idx] = time.time()
+        self._changed('set_right', x, y)
+
+    def pop(self):
+        """删除最后一对点，返回其 (flags, 左 xy, 右 xy)"""
+        if not self._count:
+            raise IndexError("pop from empty store")
+        self._count -= 1
+        idx = self._count
+        self._changed('pop')
+        return int(self._flags[idx]), tuple(self._xy[LEFT, idx]), tuple(self._xy[RIGHT, idx])
+
+    def unset_right(self):
+        """撤销最后一对点的右图点，使其重新等待标注右图"""
+        idx = self._count - 1
+        if idx < 0 or not self._flags[idx] & HAS_RIGHT:
+            raise ValueError("最后一对点没有右图点")
+        self._flags[idx] &= ~np.uint8(HAS_RIGHT)
+        self._changed('unset_right')
+
+    def move(self, side, index, x, y):
+        """移动第 index 对点某一侧的位置"""
+        if not 0 <= index < self.side_count(side):
+            raise IndexError(index)
+        self._xy[side, index] = (x, y)
+        self._changed('move', side, index, x, y)
+
+    def take(self, indices):
+        """返回若干点对的 (xy, flags, times) 副本，xy 形状为 (2, K, 2)"""
+        indices = np.asarray(indices, dtype=np.intp)
+        return self._xy[:, indices].copy(), self._flags[indices].copy(), self._times[indices].copy()
+
+    def delete(self, indices):
+        """删除若干点对（序号或序号数组），后面的点对前移"""
+        indices = np.unique(np.asarray(indices, dtype=np.intp))
+        if len(indices) and (indices[0] < 0 or indices[-1] >= self._count):
+            raise IndexError(indices)
+        n = self._count
+        keep = np.ones(n, dtype=bool)
+        keep[indices] = False
+        remain = int(keep.sum())
+        self._xy[:, :remain] = self._xy[:, :n][:, keep]
+        self._flags[:remain] = self._flags[:n][keep]
+        self._times[:remain] = self._times[:n][keep]
+        self._count = remain
+        self._changed('delete', indices)
+
+    def insert(self, indices, xy, flags, times):
+        """
+        在 indices（插入后的最终序号，升序）处插回点对，与 take/delete 互逆。
+        xy 形状为 (2, K, 2)。
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        total = self._count + len(indices)
+        if len(indices) and (indices[0] < 0 or indices[-1] >= total):
+            raise IndexError(indices)
+        self._reserve(total)
+        keep = np.ones(total, dtype=bool)
+        keep[indices] = False
+        for data, new in ((self._flags, flags), (self._times, times)):
+            old = data[:self._count].copy()
+            data[:total][keep] = old
+            data[:total][~keep] = new
+        old = self._xy[:, :self._count].copy()
+        self._xy[:, :total][:, keep] = old
+        self._xy[:, :total][:, ~keep] = xy
+        self._count = total
+        self._changed('insert', indices, xy, flags, times)
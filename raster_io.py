@@ -0,0 +1,217 @@
+"""
+SAR 原始栅格读取与显示拉伸
+
+16 位 / 浮点的 SAR 幅度数据（TIFF 或 .npy）以内存映射方式打开，不把原始数据整体读入或复制；
+显示时按 dB + 百分位拉伸转换为 8 位灰度。拉伸参数每个文件只计算一次并缓存，
+整数数据通过查找表（LUT）转换，浮点数据按块做向量化计算。
+"""
+import os
+import struct
+import threading
+
+import numpy as np
+
+try:
+    import tifffile  # 可选依赖，能读取压缩或分块存储的 TIFF
+except ImportError:
+    tifffile = None
+
+
+RASTER_EXTENSIONS = ('.tif', '.tiff', '.npy')
+
+# 百分位统计时最多抽样的像素数
+SAMPLE_PIXELS = 1 << 20
+# 浮点数据拉伸时每块的像素数（按整行划分），临时数组只有这么大
+BLOCK_PIXELS = 1 << 18
+
+# TIFF 标签与 SampleFormat 对应的 numpy 类型
+_TIFF_TAGS = {256: 'width', 257: 'height', 258: 'bits', 259: 'compression', 273: 'offsets',
+              277: 'samples', 279: 'counts', 284: 'planar', 322: 'tile_width', 339: 'sample_format'}
+_TIFF_TYPES = {3: ('H', 2), 4: ('I', 4), 16: ('Q', 8)}
+_SAMPLE_KINDS = {1: 'u', 2: 'i', 3: 'f'}
+
+
+def needs_stretch(path):
+    """.npy 以及非 8 位的 TIFF 需要经过拉伸显示；普通 8 位 TIFF 仍交给 Qt 解码"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npy':
+        return True
+    if ext not in RASTER_EXTENSIONS:
+        return False
+    try:
+        return open_raster(path).dtype != np.uint8
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def open_raster(path):
+    """以内存映射方式打开栅格，返回 (H, W) 或 (H, W, C) 的只读数组"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npy':
+        return np.load(path, mmap_mode='r')
+    if tifffile is not None:
+        try:
+            return tifffile.memmap(path, mode='r')
+        except ValueError:
+            pass  # 压缩或分块的 TIFF 无法映射，交给下面的解析给出明确的错误
+    return _memmap_tiff(path)
+
+
+def read_tiff_tags(path):
+    """读取 TIFF 第一个 IFD 中 _TIFF_TAGS 列出的标签，返回 (字节序, {标签名: 数值元组})"""
+    with open(path, 'rb') as file:
+        header = file.read(8)
+        if header[:2] == b'II':
+            order = '<'
+        elif header[:2] == b'MM':
+            order = '>'
+        else:
+            raise ValueError(f"不是 TIFF 文件: {path}")
+        if struct.unpack(order + 'H', header[2:4])[0] != 42:
+            raise ValueError(f"不支持 BigTIFF: {path}")
+        file.seek(struct.unpack(order + 'I', header[4:8])[0])
+        count = struct.unpack(order + 'H', file.read(2))[0]
+        entries = file.read(count * 12)
+
+        tags = {}
+        for i in range(count):
+            tag, typ, n, value = struct.unpack(order + 'HHI4s', entries[i * 12:(i + 1) * 12])
+            name = _TIFF_TAGS.get(tag)
+            if name is None or typ not in _TIFF_TYPES:
+                continue
+            fmt, size = _TIFF_TYPES[typ]
+            if n * size <= 4:
+                values = struct.unpack(order + fmt * n, value[:n * size])
+            else:
+                pos = file.tell()
+                file.seek(struct.unpack(order + 'I', value)[0])
+                values = struct.unpack(order + fmt * n, file.read(n * size))
+                file.seek(pos)
+            tags[name] = values
+    return order, tags
+
+
+def _memmap_tiff(path):
+    """只支持未压缩、按行条带连续存储的基线 TIFF（GDAL 默认输出即为此格式）"""
+    order, tags = read_tiff_tags(path)
+    if tags.get('compression', (1,))[0] != 1 or 'tile_width' in tags or tags.get('planar', (1,))[0] != 1:
+        raise ValueError(f"只支持未压缩、按条带存储的 TIFF，请安装 tifffile: {path}")
+    offsets, counts = tags['offsets'], tags['counts']
+    for i in range(len(offsets) - 1):
+        if offsets[i] + counts[i] != offsets[i + 1]:
+            raise ValueError(f"TIFF 条带不连续，请安装 tifffile: {path}")
+
+    width, height = tags['width'][0], tags['height'][0]
+    samples = tags.get('samples', (1,))[0]
+    bits = tags['bits'][0]
+    kind = _SAMPLE_KINDS.get(tags.get('sample_format', (1,))[0], 'u')
+    dtype = np.dtype(f"{order}{kind}{bits // 8}")
+    shape = (height, width) if samples == 1 else (height, width, samples)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offsets[0], shape=shape)
+
+
+class DisplayStretch:
+    """
+    栅格到 8 位灰度的显示拉伸：可选 dB 变换后按百分位线性拉伸。
+    统计只在跨步抽样的视图上进行，不复制原始数据。
+    """
+
+    def __init__(self, data, db=True, low=2.0, high=98.0, db_factor=20.0):
+        self.db = db
+        self.db_factor = db_factor  # 幅度数据为 20，功率数据为 10
+        self.dtype = data.dtype
+
+        band = data if data.ndim == 2 else data[..., 0]
+        step = max(1, int(np.sqrt(band.size / SAMPLE_PIXELS)))
+        sample = self._transform(np.asarray(band[::step, ::step], dtype=np.float32))
+        sample = sample[np.isfinite(sample)]
+        if sample.size:
+            self.vmin, self.vmax = (float(v) for v in np.percentile(sample, (low, high)))
+        else:
+            self.vmin, self.vmax = 0.0, 1.0
+        if self.vmax <= self.vmin:
+            self.vmax = self.vmin + 1.0
+
+        # 8/16 位整数数据直接用查找表，每个像素只需一次索引
+        self.lut = None
+        if self.dtype.kind in 'ui' and self.dtype.itemsize <= 2:
+            info = np.iinfo(self.dtype)
+            self._lut_base = int(info.min)
+            self.lut = self._to_uint8(self._transform(np.arange(info.min, info.max + 1, dtype=np.float32)))
+
+    def _transform(self, values):
+        if not self.db:
+            return values
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.db_factor * np.log10(np.abs(values))
+
+    def _scale(self, values):
+        """float32 数组原地线性拉伸到 [0, 255]，NaN 置 0"""
+        values -= self.vmin
+        values *= 255.0 / (self.vmax - self.vmin)
+        np.clip(values, 0, 255, out=values)
+        np.nan_to_num(values, copy=False, nan=0.0)
+        return values
+
+    def _to_uint8(self, values):
+        return self._scale(np.array(values, dtype=np.float32)).astype(np.uint8)
+
+    def _apply_rows(self, rows):
+        if self.lut is not None:
+            return self.lut[rows.astype(np.int32) - self._lut_base]
+        values = np.array(rows, dtype=np.float32)  # 只复制这几行
+        if self.db:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                np.abs(values, out=values)
+                np.log10(values, out=values)
+            values *= self.db_factor
+        return self._scale(values)
+
+    def apply(self, block):
+        """
+        把一块原始数据（可以是内存映射的切片视图）转换为 uint8。
+        除无偏移的查找表外按行分块计算并写入预先分配的输出，不复制整块原始数据。
+        """
+        if self.lut is not None and not self._lut_base:
+            return self.lut[block]
+        out = np.empty(block.shape, dtype=np.uint8)
+        if not out.size:
+            return out
+        rows = max(1, BLOCK_PIXELS // block[0].size)
+        for start in range(0, len(block), rows):
+            out[start:start + rows] = self._apply_rows(block[start:start + rows])
+        return out
+
+
+_stretch_cache = {}
+_stretch_lock = threading.Lock()
+
+
+def get_stretch(path, data=None, **options):
+    """按文件路径和修改时间缓存拉伸参数，同一文件只统计一次"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, tuple(sorted(options.items())))
+    with _stretch_lock:
+        stretch = _stretch_cache.get(key)
+    if stretch is None:
+        stretch = DisplayStretch(open_raster(path) if data is None else data, **options)
+        with _stretch_lock:
+            if len(_stretch_cache) >= 1024:
+                _stretch_cache.clear()
+            _stretch_cache[key] = stretch
+    return stretch
+
+
+def render(path, step=1, region=None, **options):
+    """
+    将栅格（或其中 region=(x, y, w, h) 的范围）按 step 跨步抽样后拉伸为 uint8 数组。
+    抽样和裁剪都是内存映射上的视图，只有输出的 8 位图像会真正分配内存。
+    """
+    data = open_raster(path)
+    stretch = get_stretch(path, data, **options)
+    if region is not None:
+        x, y, w, h = region
+        data = data[y:y + h, x:x + w]
+    if data.ndim == 3:
+        data = data[..., 0]
+    return np.ascontiguousarray(stretch.apply(data[::step, ::step]))
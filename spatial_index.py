@@ -0,0 +1,138 @@
+"""
+标注点与切片的空间索引（不依赖 Qt，界面和命令行工具共用）
+"""
+import bisect
+import math
+import os
+
+import numpy as np
+
+from label_io import parse_tile_offset
+
+
+class PointGridIndex:
+    """
+    标注点的格网空间索引：按 cell 大小把点分桶，范围查询只访问与矩形相交的桶，
+    绘制时只画可见范围内的点，点击命中测试也走同一个索引。
+    """
+
+    def __init__(self, xy, cell=128):
+        self.cell = cell
+        self.xy = xy
+        self.buckets = {}  # (cx, cy) -> 点序号数组
+        if len(xy):
+            cells = xy // cell
+            order = np.lexsort((cells[:, 1], cells[:, 0]))
+            keys, starts = np.unique(cells[order], axis=0, return_index=True)
+            ends = np.append(starts[1:], len(order))
+            for (cx, cy), start, end in zip(keys.tolist(), starts, ends):
+                self.buckets[(cx, cy)] = order[start:end]
+
+    def query(self, left, top, right, bottom):
+        """返回落在 [left, right] x [top, bottom]（原图坐标）内的点序号，按序号排序"""
+        cell = self.cell
+        cx0, cx1 = int(math.floor(left / cell)), int(math.floor(right / cell))
+        cy0, cy1 = int(math.floor(top / cell)), int(math.floor(bottom / cell))
+        found = []
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.buckets):
+            # 查询范围比非空桶还多时直接遍历所有桶
+            for (cx, cy), indices in self.buckets.items():
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                    found.append(indices)
+        else:
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    indices = self.buckets.get((cx, cy))
+                    if indices is not None:
+                        found.append(indices)
+        if not found:
+            return np.zeros(0, dtype=np.intp)
+        found = np.sort(np.concatenate(found))
+        x, y = self.xy[found, 0], self.xy[found, 1]
+        return found[(x >= left) & (x <= right) & (y >= top) & (y <= bottom)]
+
+    def nearest(self, x, y, radius):
+        """返回距 (x, y) 不超过 radius 的最近点序号，没有则返回 -1"""
+        candidates = self.query(x - radius, y - radius, x + radius, y + radius)
+        if not len(candidates):
+            return -1
+        d2 = ((self.xy[candidates] - (x, y)) ** 2).sum(axis=1)
+        best = int(np.argmin(d2))
+        return int(candidates[best]) if d2[best] <= radius * radius else -1
+
+
+class TileIndex:
+    """
+    图像列表的切片索引：按文件名中的 tile_X_Y 偏移把切片组织成格网。
+    按名称查找序号、查找包含全局坐标 (x, y) 的切片、查找上下左右相邻的切片都不需要遍历列表。
+    """
+
+    def __init__(self, filenames, sizes=None):
+        """filenames 为图像列表（序号即列表下标）；sizes 为对应的 (宽, 高)，未知时按切片间距估计"""
+        self.names = {}  # 文件名、去扩展名的文件名、"X_Y" -> 序号
+        self.offsets = {}  # (x, y) -> 序号
+        self.positions = []  # 序号 -> (x, y) 或 None
+        for index, filename in enumerate(filenames):
+            stem = os.path.splitext(filename)[0]
+            offset = parse_tile_offset(filename)
+            self.positions.append(offset)
+            for key in (filename, stem) + ((f"{offset[0]}_{offset[1]}",) if offset else ()):
+                self.names.setdefault(key, index)
+            if offset is not None:
+                self.offsets.setdefault(offset, index)
+
+        # 同一行（相同 y）的 x 升序、同一列（相同 x）的 y 升序，用于相邻切片查找
+        self.rows, self.columns = {}, {}
+        for x, y in sorted(self.offsets):
+            self.columns.setdefault(x, []).append(y)
+        for x, y in sorted(self.offsets, key=lambda offset: (offset[1], offset[0])):
+            self.rows.setdefault(y, []).append(x)
+        self.xs = sorted(self.columns)
+        self.ys = sorted(self.rows)
+
+        step_x = min((b - a for a, b in zip(self.xs, self.xs[1:])), default=0)
+        step_y = min((b - a for a, b in zip(self.ys, self.ys[1:])), default=0)
+        default = (step_x or step_y or 1, step_y or step_x or 1)
+        self.sizes = [tuple(size) if size else default for size in (sizes or [None] * len(filenames))]
+        self.max_width = max((size[0] for size in self.sizes), default=1)
+        self.max_height = max((size[1] for size in self.sizes), default=1)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def find(self, name):
+        """按文件名、去扩展名的文件名或 "X_Y" 查找序号，找不到返回 None"""
+        name = name.strip()
+        index = self.names.get(name)
+        if index is None and not name.startswith("tile_"):
+            index = self.names.get("tile_" + name)
+        return index
+
+    def containing(self, x, y):
+        """包含全局坐标 (x, y) 的切片序号；有重叠时取偏移最大（最靠右下）的那个，没有则返回 None"""
+        # 偏移落在 (x - 最大切片尺寸, x] 内的列与行才可能包含该点
+        for ox in reversed(self.xs[bisect.bisect_left(self.xs, x - self.max_width + 1):bisect.bisect_right(self.xs, x)]):
+            for oy in reversed(self.ys[bisect.bisect_left(self.ys, y - self.max_height + 1):
+                                       bisect.bisect_right(self.ys, y)]):
+                index = self.offsets.get((ox, oy))
+                if index is not None:
+                    width, height = self.sizes[index]
+                    if x < ox + width and y < oy + height:
+                        return index
+        return None
+
+    def neighbour(self, index, dx, dy):
+        """序号为 index 的切片在 (dx, dy) 方向（各为 -1/0/1，只取一个方向）上最近的切片，没有则返回 None"""
+        offset = self.positions[index] if 0 <= index < len(self.positions) else None
+        if offset is None:
+            return None
+        x, y = offset
+        if dx:
+            line, value, key = self.rows[y], x, lambda other: (other, y)
+        else:
+            line, value, key = self.columns[x], y, lambda other: (x, other)
+        step = dx or dy
+        pos = bisect.bisect_left(line, value) + step
+        if 0 <= pos < len(line):
+            return self.offsets[key(line[pos])]
+        return None
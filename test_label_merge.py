@@ -0,0 +1,45 @@
+"""
+label_merge 的回归测试：python -m pytest -q test_label_merge.py
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from label_io import read_points_csv, write_points_csv
+from label_merge import manifest_paths, merge_directory
+
+
+class MergeDirectoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.output = os.path.join(self.directory, "tile_all_points.csv")
+        write_points_csv(os.path.join(self.directory, "tile_0_0_points.csv"),
+                         np.array([[1, 2, 3, 4], [5, 6, 7, 8]]), "OPT/tile_0_0.png", "SAR/tile_0_0.png")
+        write_points_csv(os.path.join(self.directory, "tile_0_512_points.csv"),
+                         np.array([[10, 20, 30, 40]]), "OPT/tile_0_512.png", "SAR/tile_0_512.png")
+        self.expected = np.array([[1, 2, 3, 4], [5, 6, 7, 8], [10, 532, 30, 552]])
+
+    def test_output_without_manifest_is_a_first_merge(self):
+        # 仓库自带的 Label2 就是这样：有旧的合并结果，没有清单
+        write_points_csv(self.output, np.array([[9, 9, 9, 9]]), "OPT/tile_all.png", "SAR/tile_all.png")
+        self.assertFalse(os.path.exists(manifest_paths(self.output)[0]))
+        self.assertEqual(merge_directory(self.directory, self.output, workers=1, sidecar=False), (2, 3))
+        np.testing.assert_array_equal(read_points_csv(self.output), self.expected)
+
+    def test_output_edited_after_merge_is_not_overwritten(self):
+        merge_directory(self.directory, self.output, workers=1, sidecar=False)
+        time.sleep(0.01)
+        write_points_csv(self.output, np.array([[9, 9, 9, 9]]), "OPT/tile_all.png", "SAR/tile_all.png")
+        with self.assertRaises(ValueError):
+            merge_directory(self.directory, self.output, workers=1, sidecar=False)
+        merge_directory(self.directory, self.output, workers=1, sidecar=False, incremental=False, overwrite=True)
+        np.testing.assert_array_equal(read_points_csv(self.output), self.expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+"""
+缩略图磁盘缓存
+
+缩略图按原图文件内容的哈希（blake2b）保存为 ~/.os_tool/thumbs/<哈希前两位>/<哈希>_<边长>.jpg：
+同一张图复制到别的目录或改名后仍然命中，内容变化后自然失效，多个数据集之间共用同一份缓存。
+计算哈希需要读一遍原图，所以每个图像目录另存一个 (文件名 -> [mtime_ns, 大小, 哈希]) 的索引 index_<目录哈希>.json，
+重新打开数据集时 mtime 和大小没变的图像直接按索引找到缩略图，只读几 KB 的 JPEG，不再读取原图。
+
+缩略图的生成（解码、缩小）由调用方传入的 render(path) 完成，本模块只负责命名、读写和索引；
+thumbnail() 可以在多个工作线程中同时调用，索引在 save() 时写回。
+"""
+import hashlib
+import json
+import os
+import threading
+
+from PyQt5.QtGui import QImage
+
+
+THUMB_DIR = os.path.join(os.path.expanduser("~"), ".os_tool", "thumbs")
+THUMB_SIZE = 96  # 缩略图长边的像素数
+INDEX_VERSION = 1
+# 索引的字段
+MTIME, SIZE, DIGEST = range(3)
+
+READ_CHUNK = 1 << 20
+
+
+def file_digest(path):
+    """原图文件内容的 blake2b 哈希（16 字节，十六进制）"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(READ_CHUNK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ThumbnailCache:
+    def __init__(self, cache_dir=THUMB_DIR, size=THUMB_SIZE):
+        self.cache_dir = cache_dir
+        self.size = size
+        self._indexes = {}  # 图像目录 -> {文件名: [mtime_ns, 大小, 哈希]}
+        self._dirty = set()  # 有新条目、尚未写回的图像目录
+        self._lock = threading.Lock()
+
+    def thumbnail_path(self, digest):
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}_{self.size}.jpg")
+
+    def index_path(self, directory):
+        key = hashlib.blake2b(os.path.abspath(directory).encode("utf-8"), digest_size=8).hexdigest()
+        return os.path.join(self.cache_dir, f"index_{key}.json")
+
+    def _index(self, directory):
+        # 调用方需持有锁；每个目录的索引在第一次用到时读入
+        index = self._indexes.get(directory)
+        if index is None:
+            index = {}
+            try:
+                with open(self.index_path(directory), 'r', encoding='utf-8') as file:
+                    data = json.load(file)
+                if data.get("version") == INDEX_VERSION and data.get("directory") == os.path.abspath(directory):
+                    index = data["files"]
+            except (OSError, ValueError, KeyError):
+                pass
+            self._indexes[directory] = index
+        return index
+
+    def thumbnail(self, path, render):
+        """
+        返回 path 的缩略图 QImage（长边不超过 size）；磁盘缓存未命中时调用 render(path) 生成并写入缓存。
+        原图无法读取时返回空的 QImage。
+        """
+        directory, name = os.path.split(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return QImage()
+        with self._lock:
+            entry = self._index(directory).get(name)
+        if entry and entry[MTIME:SIZE + 1] == [stat.st_mtime_ns, stat.st_size]:
+            image = QImage(self.thumbnail_path(entry[DIGEST]))
+            if not image.isNull():
+                return image
+
+        try:
+            digest = file_digest(path)
+        except OSError:
+            return QImage()
+        thumb_path = self.thumbnail_path(digest)
+        image = QImage(thumb_path)  # 内容相同的图像（如复制到别的目录）已有缩略图
+        if image.isNull():
+            image = render(path)
+            if image.isNull():
+                return image
+            if not self._store(image, thumb_path):
+                return image  # 缓存目录不可写（只读、磁盘满）时照常显示，只是不缓存
+        with self._lock:
+            self._index(directory)[name] = [stat.st_mtime_ns, stat.st_size, digest]
+            self._dirty.add(directory)
+        return image
+
+    def _store(self, image, thumb_path):
+        """把缩略图写入缓存（临时文件 + 原子替换），成功返回 True"""
+        tmp_path = f"{thumb_path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+            if image.save(tmp_path, "JPG", 85):
+                os.replace(tmp_path, thumb_path)
+                return True
+        except OSError:
+            pass
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+
+    def save(self):
+        """把有新条目的目录索引写回磁盘"""
+        with self._lock:
+            jobs = [(directory, json.dumps({"version": INDEX_VERSION, "directory": os.path.abspath(directory),
+                                            "files": self._indexes[directory]}, separators=(',', ':')))
+                    for directory in self._dirty]
+            self._dirty.clear()
+        for directory, text in jobs:
+            path = self.index_path(directory)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                file.write(text)
+            os.replace(tmp_path, path)